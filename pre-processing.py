@@ -1,87 +1,199 @@
-import pandas as pd
+# The preprocessing pipeline producing static embeddings of lexical items with a BERT model.
 # Symptoms list used: https://www.kaggle.com/plarmuseau/sdsort?select=symptoms2.csv
-df = pd.read_csv('/path/to/symptoms_list.csv')
-df = df.rename(columns={"name": "symptom"})
-df.drop(df.columns.difference(['_id','symptom']), 1, inplace=True)
-df = df.dropna().reset_index(drop=True)
-df = df.drop_duplicates(subset=['symptom'])
-# resulting df shape: (388, 2)
-
-from transformers import BertTokenizer
-tokenizer = BertTokenizer.from_pretrained(
-        'bionlp/bluebert_pubmed_mimic_uncased_L-12_H-768_A-12')
-
-symptoms_tokenized = [tokenizer.tokenize('[CLS] ' + symptom + ' [SEP]')
-                      for symptom in df['symptom']]
-
-import torch
-
- # Mark each of the tokens as belonging to sentence "1".
-symptoms_segments_ids = [ 
-  [1] * len(symptom_tokenized) 
-  for symptom_tokenized in symptoms_tokenized]
-
-# Map the token strings to their vocabulary indeces.
-indexed_tokens = [tokenizer.convert_tokens_to_ids(
-        symptom_tokenized) for symptom_tokenized in symptoms_tokenized]
-
-# Convert inputs to PyTorch tensors
-tokens_tensors = [
-                torch.tensor([indexed_tokens]) 
-                for indexed_tokens 
-                in indexed_tokens]
-segments_tensors = [
- torch.tensor([symptom_segments_ids]) for symptom_segments_ids in 
- symptoms_segments_ids
- ]
-
-from transformers import BertModel
-    
-model = BertModel.from_pretrained(
-    'bionlp/bluebert_pubmed_mimic_uncased_L-12_H-768_A-12',
-    # Whether the model returns all hidden-states:
-    output_hidden_states = True)
-
-model.eval() 
-
-# Run the text through BERT, and collect all of the hidden 
-# states produced from all 12 layers. 
-
-with torch.no_grad():
-  symptoms_outputs = [
-    model(tokens_tensor, segments_tensor)
-    for tokens_tensor, segments_tensor in zip(
-        tokens_tensors, 
-        segments_tensors)]
-
-# the third item will be the hidden states from all layers. 
-symptoms_hidden_states = [symptom_outputs[2] 
-                                  for symptom_outputs in symptoms_outputs]
-
-# for each symptom take the average of the 
-# outputs of its tokens for 2nd to last hidden layer
-symptoms_embeddings = [
-        torch.mean(torch.squeeze(hidden_states[-2]), dim=0) for hidden_states in symptoms_hidden_states
-    ]
-
+#
+# Usage: python pre-processing.py /path/to/symptoms_list.csv /path/to/symptoms_embeddings.txt
+#
+# Items are tokenized with padding and run through BERT in batches on the CPU. The embedding of an item
+# is the average of the outputs of its tokens for the 2nd to last hidden layer.
+#
+# Embeddings are kept in a cache (an SQLite database, by default embedding-cache.sqlite next to the output file)
+# keyed by a hash of the model, the embedding settings and the normalized item text. Only items not in the cache
+# are embedded, BERT is not even loaded if all are. The output file (word2vec text format) is then written from
+# the cache item by item, so memory stays bounded for any number of items.
+# With --no-cache, all items are embedded and every batch is written to the output file right away.
+
+import argparse
+import hashlib
+import json
 import os
+import sqlite3
+import sys
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
 
-# dimensions, number of symptoms
-dims, n_symptoms = len(symptoms_embeddings[0]), len(df['symptom'])
-
-# no whitespace allowed in word2vec format 
-symptoms_no_whitespace = df['symptom'].replace(' ', '_', regex=True)
-
-outputfile = "/path/to/symptoms_embeddings.txt"
-if os.path.exists(outputfile): os.remove(outputfile)
-with open(outputfile, "a") as myfile:
-        myfile.write(f"{n_symptoms} {dims}\n")
-        for symptom, embedding in zip(
-            symptoms_no_whitespace, symptoms_embeddings):
-            vector = embedding.detach().cpu().numpy()
-            vector = vector.flatten()
-            # Values of each dimension of the symptom's embedding 
-            # vector, correct to ten decimal places, separated by space
-            vector_string = ' '.join([f'{value:10.10f}'
-                for value in vector])
-            myfile.write(f'{symptom} {vector_string}\n')
\ No newline at end of file
+def parse_args(argv: "list[str]" = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Embed the items of a CSV file with a BERT model into a word2vec text file.')
+    parser.add_argument('input', help='CSV file containing the items')
+    parser.add_argument('output', help='word2vec text file to write')
+    parser.add_argument('--column', default='name', help='CSV column containing the items (default: name)')
+    parser.add_argument('--model', default='bionlp/bluebert_pubmed_mimic_uncased_L-12_H-768_A-12',
+                        help='BERT model to use (default: BlueBERT PubMed + MIMIC-III)')
+    parser.add_argument('--layer', type=int, default=-2,
+                        help='hidden layer whose token outputs are averaged, as index of all hidden states '
+                             '(default: -2)')
+    parser.add_argument('--batch-size', type=int, default=64, help='items per batch (default: 64)')
+    parser.add_argument('--threads', type=int, help='number of threads torch uses (default: torch default)')
+    parser.add_argument('--max-length', type=int, default=512,
+                        help='maximum number of tokens per item (default: 512)')
+    parser.add_argument('--cache', help='embedding cache database (default: embedding-cache.sqlite in the directory '
+                                        'of the output file)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='embed all items, without reading or writing the cache')
+    return parser.parse_args(argv)
+
+
+def embedding_settings(args: argparse.Namespace) -> str:
+    # Everything the embedding of an item depends on besides its text
+    return json.dumps({'model': args.model, 'layer': args.layer, 'max_length': args.max_length,
+                       'pooling': 'mean'}, sort_keys=True)
+
+
+def normalize(item: str) -> str:
+    # BERT's tokenizer splits at any whitespace, so only differences the embedding depends on remain
+    return ' '.join(unicodedata.normalize('NFC', item).split())
+
+
+def cache_key(item: str, settings: str) -> str:
+    return hashlib.sha256(f'{settings}\n{normalize(item)}'.encode('utf-8')).hexdigest()
+
+
+def open_cache(path: str) -> sqlite3.Connection:
+    cache = sqlite3.connect(path)
+    # Vectors as float32 bytes
+    cache.execute('CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)')
+    return cache
+
+
+def cached_keys(cache: sqlite3.Connection, keys: "list[str]") -> "set[str]":
+    found = set()
+    # Below SQLite's limit of variables per statement
+    for chunk_start in range(0, len(keys), 500):
+        chunk = keys[chunk_start:chunk_start + 500]
+        found.update(key for key, in cache.execute(
+            f'SELECT key FROM embeddings WHERE key IN ({",".join("?" * len(chunk))})', chunk))
+    return found
+
+
+def embed(items: "list[str]", args: argparse.Namespace):
+    """Embeds items batch by batch.
+
+    Yields:
+        np.ndarray: (batch size, dims) float32 embeddings of the items of each batch
+    """
+    # torch and transformers are only imported if anything needs to be embedded
+    import torch
+    from transformers import BertModel, BertTokenizer
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    tokenizer = BertTokenizer.from_pretrained(args.model)
+    # The pooler is not needed, only the outputs of the hidden layers
+    model = BertModel.from_pretrained(args.model, add_pooling_layer=False)
+
+    # Drop the layers after the one whose outputs are averaged, so they are not computed at all.
+    # Hidden state 0 is the output of the embeddings, hidden state n the output of the n-th layer.
+    n_layers = args.layer % (model.config.num_hidden_layers + 1)
+    model.encoder.layer = model.encoder.layer[:n_layers]
+    model.config.num_hidden_layers = n_layers
+    model.eval()
+
+    start = time.perf_counter()
+    for batch_start in range(0, len(items), args.batch_size):
+        batch = [normalize(item) for item in items[batch_start:batch_start + args.batch_size]]
+        # Adds [CLS] and [SEP] to every item and pads all items to the longest one of the batch
+        inputs = tokenizer(batch, padding=True, truncation=True,
+                           max_length=args.max_length, return_tensors='pt')
+        attention_mask = inputs['attention_mask']
+
+        with torch.no_grad():
+            hidden_states = model(
+                input_ids=inputs['input_ids'],
+                attention_mask=attention_mask,
+                # All tokens of an item are marked as belonging to sentence "1"
+                token_type_ids=attention_mask).last_hidden_state
+
+        # Average of the outputs of the tokens of each item, leaving out the padding
+        mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+        embeddings = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
+        yield embeddings.numpy().astype(np.float32)
+
+        done = batch_start + len(batch)
+        elapsed = time.perf_counter() - start
+        print(f'\r{done}/{len(items)} items, {done / elapsed:.1f} items/s',
+              end='', file=sys.stderr, flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f'\nEmbedded {len(items)} items in {elapsed:.1f} s ({len(items) / elapsed:.1f} items/s, '
+          f'batch size {args.batch_size}, {torch.get_num_threads()} threads)', file=sys.stderr)
+
+
+def embed_into_cache(items: "list[str]", keys: "list[str]", cache: sqlite3.Connection, args: argparse.Namespace):
+    """Embeds items and stores their embeddings in the cache, committed batch by batch, so an interrupted run
+    keeps what it has embedded."""
+    for batch_start, embeddings in zip(range(0, len(items), args.batch_size), embed(items, args)):
+        batch_keys = keys[batch_start:batch_start + args.batch_size]
+        with cache:
+            cache.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?)',
+                              [(key, vector.tobytes()) for key, vector in zip(batch_keys, embeddings)])
+
+
+def write_output(path: str, items: "list[str]", vectors):
+    """Writes the items with their vectors (an iterable, consumed one vector at a time) in word2vec text format."""
+    # Write into a temporary file first, so an existing output file stays intact until the new one is complete
+    temporary_output = f'{path}.tmp'
+    with open(temporary_output, 'w') as output_file:
+        for i, (item, vector) in enumerate(zip(items, vectors)):
+            if i == 0:
+                output_file.write(f'{len(items)} {len(vector)}\n')
+            # Values of each dimension of the item's embedding vector, correct to ten decimal places,
+            # separated by space. No whitespace is allowed in items in word2vec format.
+            vector_string = ' '.join([f'{value:10.10f}' for value in vector])
+            output_file.write(f"{item.replace(' ', '_')} {vector_string}\n")
+    os.replace(temporary_output, path)
+
+
+def main(argv: "list[str]" = None):
+    args = parse_args(argv)
+    df = pd.read_csv(args.input)
+    items = df[args.column].dropna().drop_duplicates().tolist()
+    # resulting number of items for the symptoms list: 388
+
+    if args.no_cache:
+        # Every batch is written as soon as it is embedded, nothing is kept
+        write_output(args.output, items, (vector for embeddings in embed(items, args) for vector in embeddings))
+        print(f'Wrote {len(items)} items to {args.output}', file=sys.stderr)
+        return
+
+    settings = embedding_settings(args)
+    keys = [cache_key(item, settings) for item in items]
+    cache = open_cache(args.cache or os.path.join(os.path.dirname(os.path.abspath(args.output)),
+                                                  'embedding-cache.sqlite'))
+
+    found = cached_keys(cache, keys)
+    # Items whose normalized text is the same share one embedding
+    missing = {key: item for item, key in zip(items, keys) if key not in found}
+    n_distinct = len(set(keys))
+    print(f'{n_distinct - len(missing)} of {n_distinct} distinct items cached', file=sys.stderr)
+    if missing:
+        embed_into_cache(list(missing.values()), list(missing.keys()), cache, args)
+
+    start = time.perf_counter()
+
+    def cached_vectors():
+        for key in keys:
+            [(vector_bytes,)] = cache.execute('SELECT vector FROM embeddings WHERE key = ?', (key,))
+            yield np.frombuffer(vector_bytes, dtype=np.float32)
+
+    write_output(args.output, items, cached_vectors())
+    cache.close()
+    print(f'Wrote {len(items)} items to {args.output} in {time.perf_counter() - start:.1f} s', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,28 @@
 import random
-from gensim.models.keyedvectors import KeyedVectors
-from sklearn.decomposition import IncrementalPCA
-import matplotlib.pyplot as plt
-import matplotlib
+from typing import TYPE_CHECKING, Union
 import numpy as np
-from io import BytesIO
+import metrics
+from lexical_model import LexicalModel
+from ranking import items_at_ranks
+from evaluation import evaluate_history
+
+if TYPE_CHECKING:
+    from gensim.models.keyedvectors import KeyedVectors
 
 
 class LexicalItemApproximator:
     N_SIMILAR = 10
     N_DISSIMILAR = 2
     N_SUGGESTED_ITEMS = N_SIMILAR + N_DISSIMILAR
-
-    def __init__(self, vectors: KeyedVectors):
-        self.vectors = vectors
+    # With quantized vectors, every window of ranks is re-ranked exactly among this many times as many candidates
+    RERANK_FACTOR = 4
+
+    def __init__(self, vectors: Union["KeyedVectors", LexicalModel], seed: int = None):
+        # The model is shared with other approximators, wrap plain vectors to get one
+        self.model = vectors if isinstance(vectors, LexicalModel) else LexicalModel(vectors)
+        self.vectors = self.model.vectors
+        # Every round of suggestions makes its random choices with a generator seeded with the seed and the round
+        self.seed = random.getrandbits(32) if seed is None else seed
         self.selected_item = ""
         self.__start_items = []
 
@@ -21,40 +30,89 @@ class LexicalItemApproximator:
         self.selection_sequence: "list[str]" = []
         self.suggestions_sequence: "list['list[str]']" = []
 
+        # How often each item occurs in suggestions_sequence, kept up to date with every change of it
+        self._suggestion_counts = np.zeros(len(self.vectors), dtype=np.uint16)
+        # Items that became excluded or not excluded anymore by the last change of suggestions_sequence
+        self.excluded_added: "list[str]" = []
+        self.excluded_removed: "list[str]" = []
+
         # used for result evaluation and persistence
         self.most_similar_of_suggested_sequence: "list[str]" = []
         self.y_vals_selection: "list[float]" = []
         self.y_vals_suggestions_avg: "list[float]" = []
         self.y_vals_closest: "list[float]" = []
 
-        # for plotting suggestions in 2d space
-        self.plot_is_initialized = False
-        self.y_vals = []
-        self.x_vals = []
-        self.labels = []
-        self.plot_pca = None
+        # A new approximation starts with a seed and its start items kept ready by the model, if it has any
+        if seed is None and self.model.start_items_pool is not None:
+            prepared = self.model.start_items_pool.take()
+            if prepared is not None:
+                self.seed, start_items = prepared
+                self._push_suggestions([self.vectors.index_to_key[i] for i in start_items])
+                self.__start_items = self.suggestions_sequence[-1]
+
+    @property
+    def state(self) -> dict:
+        """Compact state of the approximation with all items stored as vocabulary indices.
+        It does not contain the vectors, use from_state to restore an approximator from it.
+        Result evaluation data is not part of it, evaluate_result recomputes it.
+
+        Returns:
+            dict: The state, containing only ints and lists of them
+        """
+        index = self.vectors.key_to_index
+        return {
+            'seed': self.seed,
+            'start_items': [index[item] for item in self.__start_items],
+            'selection_sequence': [index[item] for item in self.selection_sequence],
+            'suggestions_sequence': [[index[item] for item in suggestions]
+                                     for suggestions in self.suggestions_sequence],
+        }
+
+    @classmethod
+    def from_state(cls, vectors: Union["KeyedVectors", LexicalModel], state: dict):
+        """Restores an approximator from its state against (shared) vectors.
+
+        Args:
+            vectors (KeyedVectors | LexicalModel): The vectors the approximator was created with
+            state (dict): The approximator's state property
+
+        Returns:
+            LexicalItemApproximator: The restored approximator
+        """
+        approximator = cls(vectors, seed=state['seed'])
+        keys = approximator.vectors.index_to_key
+        approximator.__start_items = [keys[i] for i in state['start_items']]
+        approximator.selection_sequence = [keys[i] for i in state['selection_sequence']]
+        approximator.suggestions_sequence = [[keys[i] for i in suggestions]
+                                             for suggestions in state['suggestions_sequence']]
+        for suggestions in state['suggestions_sequence']:
+            np.add.at(approximator._suggestion_counts, suggestions, 1)
+        approximator.selected_item = approximator.selection_sequence[-1] if approximator.selection_sequence else ""
+        return approximator
 
     @property
     def start_items(self):
         if(self.__start_items): return self.__start_items
+        rng = self._random()
         # Randomly choose the first suggested item
-        suggestions: "list[str]" = [
-            random.choice(self.vectors.index_to_key)]
+        suggestions: "list[int]" = [rng.randrange(len(self.vectors))]
+        excluded = np.zeros(len(self.vectors), dtype=bool)
+        excluded[suggestions[0]] = True
 
-        # Calculate position and width for a slice whose width is one percent of the length of the item list and whose center is at 67 percent of the length
+        # Position and width of a slice whose width is one percent of the length of the item list and whose center is at 67 percent of the length
         assert(len(self.vectors) >= 100)
-        slice_width = len(self.vectors) / 100
-        slice_position = int(slice_width * 67 - slice_width / 2)
+        start_window = LexicalItemApproximator._start_window(len(self.vectors))
 
         for _ in range(LexicalItemApproximator.N_SUGGESTED_ITEMS - 1):
-            items_sorted = self._get_items_sorted_by_similarity_to(
-                # Get a list sorted by similarity to the last item added to the suggestions
-                item=suggestions[-1], excluded_items=set(suggestions))
+            [items_in_slice] = self._get_items_at_ranks(
+                # Get the slice of a list sorted by similarity to the last item added to the suggestions
+                index=suggestions[-1], excluded=excluded, windows=[start_window])
             # Choose a random item from the sliced sorted similarity list
-            suggestions.append(random.choice(
-                items_sorted[slice_position: int(slice_position + slice_width)]))
+            suggestions.append(rng.choice(items_in_slice))
+            excluded[suggestions[-1]] = True
 
-        self.suggestions_sequence.append(suggestions)
+        suggestions = [self.vectors.index_to_key[i] for i in suggestions]
+        self._push_suggestions(suggestions)
 
         self.__start_items = suggestions
         return suggestions
@@ -63,16 +121,6 @@ class LexicalItemApproximator:
     def iterations(self):
         return len(self.selection_sequence)
 
-    @property
-    def excluded_items(self):
-        """
-        Returns:
-            set[str]: All items suggested previously
-        """
-        return {item
-        for suggestions in self.suggestions_sequence
-        for item in suggestions}
-
     @property
     def items_to_plot(self):
         return self.suggestions_sequence[-1] if self.suggestions_sequence else []
@@ -81,24 +129,28 @@ class LexicalItemApproximator:
         # self.selected_item is the item selected in previous iteration. Do not continue if it is not set.
         if not self.selected_item: return
 
-        items_sorted = self._get_items_sorted_by_similarity_to(
-            self.selected_item, self.excluded_items)
+        selected_index = self.vectors.key_to_index[self.selected_item]
+        excluded = self._suggestion_counts > 0
+        excluded[selected_index] = True
+        # Number of items in the list sorted by similarity, which leaves out the excluded items and the selected item
+        n_remaining = len(self.vectors) - np.count_nonzero(excluded)
 
-        if len(items_sorted) < LexicalItemApproximator.N_SUGGESTED_ITEMS:
+        if n_remaining < LexicalItemApproximator.N_SUGGESTED_ITEMS:
             return []
 
-        similar_items = items_sorted[:LexicalItemApproximator.N_SIMILAR]
+        similar_items, middle_items = self._get_items_at_ranks(
+            selected_index, excluded,
+            windows=[(0, LexicalItemApproximator.N_SIMILAR), LexicalItemApproximator._middle_window(n_remaining)])
 
         # Take the rest as random items of 100 items in the middle of sorted dist list
         # (These are considered relatively dissimilar)
-        slice_middle = int(len(items_sorted) / 2 - 50)
-        dissimilar_items = random.sample(
-            items_sorted[slice_middle: slice_middle + 100], k=LexicalItemApproximator.N_DISSIMILAR)
+        dissimilar_items = self._random().sample(
+            list(middle_items), k=LexicalItemApproximator.N_DISSIMILAR)
 
-        suggestions = similar_items + dissimilar_items
+        suggestions = [self.vectors.index_to_key[i] for i in [*similar_items, *dissimilar_items]]
 
         # Record suggestion history for undo function and excluded items
-        self.suggestions_sequence.append(suggestions)
+        self._push_suggestions(suggestions)
 
         return suggestions
 
@@ -109,187 +161,159 @@ class LexicalItemApproximator:
     def undo(self):
         """Sets selected item to previous selected item and deletes previous suggestions from suggestion history.
         """
-        self.suggestions_sequence.pop()
+        self._pop_suggestions()
         self.selection_sequence.pop()
         self.selected_item = self.selection_sequence[-1] if self.selection_sequence else ""
 
 # region plot
 
-    def init_plot(self):
-        if(self.plot_is_initialized): return
-        num_dimensions = 2
-
-        # extract the items & their vectors, as numpy arrays
-        vectors: np.ndarray = np.array(self.vectors.vectors)
-
-        self.labels = np.array(self.vectors.index_to_key)
-
-        # reduce using pca
-        pca = IncrementalPCA(n_components=num_dimensions, batch_size=10)
-        self.plot_pca = pca
-        vectors = pca.fit_transform(vectors)
-
-        self.x_vals = [v[0] for v in vectors]
-        self.y_vals = [v[1] for v in vectors]
-
-        self.plot_is_initialized = True
-
-    def get_plot_image(self) -> bytes:
-        self.init_plot()
-        items = self.items_to_plot
-        matplotlib.use('Agg')
-        fig = plt.figure(figsize=(12, 12))
-        plt.scatter(self.x_vals, self.y_vals, alpha=.2)
-        ax = plt.gca()
-        ax.axes.get_xaxis().set_visible(False)
-        ax.axes.get_yaxis().set_visible(False)
-
-        selected_indices = []
-        for item in items:
-            selected_index = np.where(self.labels == item)[
-                0][0] 
-            selected_indices.append(selected_index)
-        for i in selected_indices:
-            plt.annotate(text=self.labels[i].replace("_", " "), xy=(
-                self.x_vals[i], self.y_vals[i]), fontsize=14, fontweight='bold', alpha=.7)
-            plt.scatter(self.x_vals[i], self.y_vals[i], color='red', alpha=.5)
-
-        # plot target item
-        if self.selected_item in self.labels:
-            target_index = np.where(self.labels == self.selected_item)[0][0]
-            plt.annotate(text=self.labels[target_index].replace("_", " "), xy=(
-                self.x_vals[target_index], self.y_vals[target_index]), fontsize=20, fontweight='bold', alpha=.7)
-            plt.scatter(self.x_vals[target_index],
-                        self.y_vals[target_index], color='green', s=100, alpha=.5)
-
-        figdata = BytesIO()
-        fig.savefig(figdata, format='png')
-        plt.close(fig)
-
-        return figdata.getvalue()
-
-    def get_result_plot_image(self, result: str):
-        """Records data for result evaluation (most_similar_of_suggested_sequence) and returns a result plot as png image.
+    @property
+    def plot_highlights(self) -> "tuple[list[int], int]":
+        """
+        Returns:
+            tuple[list[int], int]: Indices of the items highlighted in the plot (the current suggestions)
+                and of the selected item, None if there is none
+        """
+        index = self.vectors.key_to_index
+        return [index[item] for item in self.items_to_plot], index.get(self.selected_item)
+
+    def get_plot_data(self) -> dict:
+        """The data behind the plot of the current suggestions (see PlotPool.render_plot),
+        for clients drawing the plot themselves.
+        The coordinates of all items are the same for every session, see LexicalModel.plot_coordinates.
+
+        Returns:
+            dict: Coordinates of the current suggestions ('items') and of the selected item ('target', None if not set)
+        """
+        coordinates = self.model.plot_coordinates
+        index = self.vectors.key_to_index
+
+        def point(item: str):
+            x, y = coordinates[index[item]]
+            return {'item': item, 'x': float(x), 'y': float(y)}
+
+        return {'items': [point(item) for item in self.items_to_plot],
+                'target': point(self.selected_item) if self.selected_item in index else None}
+
+    def evaluate_result(self, result: str):
+        """Records data for result evaluation (y_vals_* and most_similar_of_suggested_sequence).
 
         Args:
             result (str): The target item
-
-        Returns:
-            bytes: png image
         """
-        import math
         if len(self.selection_sequence) < len(self.suggestions_sequence):
-            self.suggestions_sequence.pop()
+            self._pop_suggestions()
         
-        x_vals = range(1, self.iterations + 1)
-        self.y_vals_selection = [self.vectors.similarity(
-            result, item) for item in self.selection_sequence]
-        self.y_vals_suggestions_avg = []
-        self.y_vals_closest = []
-        for suggestions in self.suggestions_sequence:
-            suggestions_vectors = np.array(
-                [self.vectors[item] for item in suggestions])
-            dists = np.dot(suggestions_vectors, np.ravel(self.vectors[result])) / (
-                np.linalg.norm(suggestions_vectors, axis=1) * np.linalg.norm(self.vectors[result]))
-
-            self.y_vals_suggestions_avg.append(np.average(dists))
-            index_closest = np.argsort(dists)[::-1][0]
-            self.most_similar_of_suggested_sequence.append(
-                suggestions[index_closest])
-            self.y_vals_closest.append(dists[index_closest])
-
-        matplotlib.use('Agg')
-
-        assert(len(self.y_vals_selection) == len(
-            self.y_vals_suggestions_avg) == len(self.y_vals_closest) > 0)
-
-
-        iterations = len(self.y_vals_selection)
-
-        x_vals = range(1, iterations + 1)
-
-        fig, (ax, ax2) = plt.subplots(2, 1, sharex=True,
-            gridspec_kw={'height_ratios': [10, 1]})
-
-        ax.plot(x_vals, self.y_vals_selection, marker='^',
-                    label='selected item', ls=(0, (1, 10)), alpha=.5, color='k')
-        ax.plot(x_vals, self.y_vals_closest, marker='o',
-                    label='most similar of suggested', ls=(0, (5, 10)), alpha=.5, color='k')
-        ax.plot(x_vals, self.y_vals_suggestions_avg, marker='o',
-                    label='average of suggested', alpha=.5, color='k')
-        ax.title.set_text(f'Target Item: {result.replace("_", " ").title()}')
-        ax.legend(loc='best', title='cosine similarity for')
-        plt.xlabel('iteration')
-        ax.set_ylabel('cosine similarity to target')
-
-        # hide the spines between ax and ax2
-        ax.spines['bottom'].set_visible(False)
-        ax2.spines['top'].set_visible(False)
-        ax.xaxis.tick_top()
-        ax.tick_params(labeltop=False)  # don't put tick labels at the top
-        ax2.xaxis.tick_bottom()
-
-        ax.set_ylim(math.floor(min(self.y_vals_closest + self.y_vals_selection +
-                    self.y_vals_suggestions_avg)*10)/10 - .02, 1)  # data
-        ax2.set_ylim(0, .01)  # 0 to 0.1
-        plt.xlim(1, iterations)
-
-        d = .015  # how big to make the lines in axes coordinates
-        # arguments to pass to plot, just so we don't keep repeating them
-        kwargs = dict(transform=ax.transAxes, color='k', clip_on=False)
-        ax.plot((-d, +d), (-d, -d), **kwargs)        # top-left line
-        ax.plot((1 - d, 1 + d), (-d, -d), **kwargs)  # top-right line
-
-        kwargs.update(transform=ax2.transAxes)  # switch to the bottom axes
-        ax2.plot((-d, +d), (1 - d, 1 - d), **kwargs)  # bottom-left line
-        ax2.plot((1 - d, 1 + d), (1 - d, 1 - d), **kwargs)  # bottom-right line
-
-        plt.subplots_adjust(hspace=.07)
-
-        ax.xaxis.set_major_locator(plt.MultipleLocator(1))
-        ax.yaxis.set_major_locator(plt.MultipleLocator(.1))
-        ax2.yaxis.set_major_locator(plt.MultipleLocator(.1))
-
-        figdata = BytesIO()
-        fig.savefig(figdata, format='png')
-        plt.close(fig)
-
-        return figdata.getvalue()
+        index = self.vectors.key_to_index
+        evaluation = evaluate_history(
+            self.model.unit_vectors, index[result],
+            [index[item] for item in self.selection_sequence],
+            [[index[item] for item in suggestions] for suggestions in self.suggestions_sequence])
+
+        self.y_vals_selection = evaluation['y_vals_selection'].tolist()
+        self.y_vals_suggestions_avg = evaluation['y_vals_suggestions_avg'].tolist()
+        self.y_vals_closest = evaluation['y_vals_closest'].tolist()
+        self.most_similar_of_suggested_sequence = [
+            self.vectors.index_to_key[i] for i in evaluation['most_similar_of_suggested']]
 
 # endregion
 
 # region 'private' methods
 
-    def _get_items_sorted_by_similarity_to(self, item: str, excluded_items: "set[str]" = None):
-        """Generates a list of lexical items sorted by similarity to a given item
+    @staticmethod
+    def rank_windows(n_items: int) -> "list[tuple[int, int]]":
+        """Windows of ranks beyond the most similar items that start_items and suggest_items choose items from,
+        for a model with n_items and no excluded items. A truncated NeighborIndex needs to sample them.
+
+        Args:
+            n_items (int): Number of items in the model
+
+        Returns:
+            list[tuple[int, int]]: start and stop of the windows
+        """
+        return [LexicalItemApproximator._middle_window(n_items - 1),
+                LexicalItemApproximator._start_window(n_items)]
+
+    @staticmethod
+    def _start_window(n_items: int):
+        slice_width = n_items / 100
+        slice_position = int(slice_width * 67 - slice_width / 2)
+        return slice_position, int(slice_position + slice_width)
+
+    @staticmethod
+    def _middle_window(n_remaining: int):
+        slice_middle = int(n_remaining / 2 - 50)
+        return slice_middle, slice_middle + 100
+
+    def _random(self):
+        """
+        Returns:
+            random.Random: Generator for the random choices of the next round of suggestions
+        """
+        return random.Random(self.seed + (len(self.suggestions_sequence) << 32))
+
+    def _push_suggestions(self, suggestions: "list[str]"):
+        indices = [self.vectors.key_to_index[item] for item in suggestions]
+        np.add.at(self._suggestion_counts, indices, 1)
+        self.suggestions_sequence.append(suggestions)
+        self.excluded_added = [item for item, i in zip(suggestions, indices) if self._suggestion_counts[i] == 1]
+        self.excluded_removed = []
+
+    def _pop_suggestions(self):
+        suggestions = self.suggestions_sequence.pop()
+        indices = [self.vectors.key_to_index[item] for item in suggestions]
+        np.subtract.at(self._suggestion_counts, indices, 1)
+        self.excluded_added = []
+        self.excluded_removed = [item for item, i in zip(suggestions, indices) if self._suggestion_counts[i] == 0]
+
+    @metrics.stage('ranking')
+    def _get_items_at_ranks(self, index: int, excluded: np.ndarray, windows: "list[tuple[int, int]]"):
+        """Slices of the list of lexical items sorted by similarity to a given item.
+        Uses the model's neighbor index (a NeighborIndex or an approximate IVFIndex) if there is one
+        and it can answer, otherwise ranks only
+        the items in the slices (see ranking.items_at_ranks).
 
         Args:
-            item (str): The lexical whose similarity the list will be sorted by
-            excluded_items (set[str], optional): The items to be excluded from the list. Defaults to None.
+            index (int): Index of the lexical item whose similarity the list will be sorted by
+            excluded (np.ndarray): Boolean mask over all items, True for items to be excluded from the list
+            windows (list[tuple[int, int]]): start and stop of the slices
 
         Returns:
-            list[str]: The list of items sorted by similarity to parameter item
+            list[np.ndarray]: Indices of the items in each slice
         """
-        if excluded_items: excluded_items.update([item])
-        else: excluded_items = {item}
-        # self.vectors is the instance of the Gensim KeyedVectors class with the vectors generated before.
-        # Ensures vector lengths are available at self.vectors.norms 
-        self.vectors.fill_norms()
-        # The vector for item can simply be accessed from the KeyedVectors object with item as key 
-        cos_similarities = np.dot(self.vectors.vectors,
-                       self.vectors[item]) / self.vectors.norms
-
-        # Get indices of the list sorted by cosine similarity
-        indices_sorted_similarities = np.argsort(-cos_similarities)
-
-        items_sorted: "list[str]" = [
-            # self.vectors.index_to_key contains all items that can be accessed with their index as key
-            self.vectors.index_to_key[i]
-            for i in indices_sorted_similarities 
-            # ignore (don't return) items from excluded item list
-            if self.vectors.index_to_key[i] not in excluded_items
-        ]
-
-        return items_sorted
+        neighbor_index = self.model.neighbor_index
+        if neighbor_index is not None:
+            slices = [neighbor_index.window(index, excluded, start, stop)
+                      for start, stop in windows]
+            if all(indices is not None for indices in slices):
+                return slices
+
+        # The model's vectors normalized to unit length are computed once per model (or loaded precomputed),
+        # so the cosine similarity is a plain dot product. The model may compute it together with the
+        # queries of concurrent requests (see SimilarityBatcher).
+        unit_vectors = self.model.unit_vectors
+        quantized_vectors = self.model.quantized_vectors
+        cos_similarities = self.model.similarities(index)
+        # The item itself is never part of the list
+        excluded = excluded.copy()
+        excluded[index] = True
+        if quantized_vectors is None:
+            return items_at_ranks(cos_similarities, excluded, windows)
+
+        # The quantized similarities are approximate. Every window is re-ranked with exact similarities among
+        # a few times as many candidates around it, so its items are the ones at its exact ranks unless their
+        # approximate ranks are off by more than the added candidates.
+        n_ranked = len(excluded) - np.count_nonzero(excluded)
+        windows = [slice(start, stop).indices(n_ranked)[:2] for start, stop in windows]
+        widened = [(max(0, start - (stop - start) * (self.RERANK_FACTOR - 1)),
+                    stop + (stop - start) * (self.RERANK_FACTOR - 1)) for start, stop in windows]
+        slices = []
+        for (start, stop), (candidates_start, _), candidates in zip(
+                windows, widened, items_at_ranks(cos_similarities, excluded, widened)):
+            candidates = np.sort(candidates)
+            exact_similarities = np.dot(unit_vectors[candidates], unit_vectors[index])
+            ranked = candidates[np.argsort(-exact_similarities, kind='stable')]
+            slices.append(ranked[start - candidates_start:stop - candidates_start])
+        return slices
 
 # endregion
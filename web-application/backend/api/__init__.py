@@ -1,25 +1,49 @@
 # https://github.com/marshmallow-code/webargs/blob/dev/examples/flaskrestful_example.py
 
 import io
+from concurrent.futures import TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from os import environ
-import os
 
 from flask.helpers import send_file
 from datetime import datetime
 from LexicalItemApproximator import LexicalItemApproximator
-from gensim.models import KeyedVectors
-from flask import Flask, jsonify, session
+from api import instrumentation
+from api.model_registry import ModelRegistry, ModelVersionUnavailable
+from api.token_session import TokenSessionInterface
+from plot_pool import PlotPool, PlotQueueFull
+from results_log import ResultsWriter
+from flask import Flask, Response, current_app, jsonify, request, session
 from flask_session import Session
 from flask_cors import CORS
 from flask_restful import Api, Resource
-import PIL.Image as Image
+import metrics
+import numpy as np
 import pytz
+import threading
+import uuid
 
-from webargs import fields
+from webargs import fields, validate
 from webargs.flaskparser import use_args, parser, abort
 
 # region Models
 MODELS_PATH = environ.get('MODELS_PATH')
+# A complete neighbor index needs memory quadratic in the number of items (2 bytes per pair up to 65535 items)
+NEIGHBOR_INDEX_MAX_ITEMS = int(environ.get('NEIGHBOR_INDEX_MAX_ITEMS', 5000))
+# Milliseconds similarity queries of concurrent requests are collected for to compute them in one matrix product,
+# 0 for none. Only models ranked without (a complete) neighbor index compute similarities per request.
+SIMILARITY_BATCH_WINDOW_MS = float(environ.get('SIMILARITY_BATCH_WINDOW_MS', 0))
+SIMILARITY_BATCH_SIZE = int(environ.get('SIMILARITY_BATCH_SIZE', 16))
+# Seconds between checks of MODELS_PATH for changed model files and models.json, 0 for none.
+# Changed models are loaded in the background and used by new sessions.
+MODELS_WATCH_INTERVAL = float(environ.get('MODELS_WATCH_INTERVAL', 10))
+# Seconds a replaced model version is kept for the sessions using it, after its last use
+MODEL_VERSIONS_RETAIN = float(environ.get('MODEL_VERSIONS_RETAIN', 600))
+# Start items kept ready per model so new sessions do not compute them, 0 for none,
+# and how many of them are computed per second at most (in a background thread of every worker)
+START_ITEMS_POOL_SIZE = int(environ.get('START_ITEMS_POOL_SIZE', 32))
+START_ITEMS_REFILL_RATE = float(environ.get('START_ITEMS_REFILL_RATE', 20))
 
 models = [
     {'id': 0,
@@ -27,36 +51,105 @@ models = [
      'itemName': 'word',
      'description': 'Vectors of items from dialogues of about 600 Simpsons episodes. Vectors generated with "BERT base uncased" (pre-trained on English Wikipedia and BookCorpus).',
      'instructions': 'Think of a word and keep selecting the most similar word from the suggested ones until you see the word you\'re thinking of. Then click the green button.',
-     # Load vectors using Gensim KeyedVectors
-     'vectors': KeyedVectors.load_word2vec_format(
-         f'{MODELS_PATH}/bert-vectors-simpsons.txt')},
+     'file': 'bert-vectors-simpsons.txt'},
 
     {'id': 1,
      'name': 'bluebert_pubmed_mimic_uncased_L-12_H-768_A-12',
      'itemName': 'symptom',
      'description': 'Vectors of items from a list of medical symptoms. Vectors generated with a BERT model pre-trained on PubMed abstracts and clinical notes (MIMIC-III dataset).',
      'instructions': 'Think of a symptom and keep selecting the most similar symptom from the suggested ones until you see the symptom you\'re thinking of. Then click the green button.',
-     'vectors': KeyedVectors.load_word2vec_format(
-         f'{MODELS_PATH}/bluebert-vectors-symptoms.txt')},
+     'file': 'bluebert-vectors-symptoms.txt'},
 ]
+
+# Vectors are loaded once per process, on first use, and shared by all sessions
+registry = ModelRegistry(MODELS_PATH, NEIGHBOR_INDEX_MAX_ITEMS,
+                         SIMILARITY_BATCH_WINDOW_MS / 1000, SIMILARITY_BATCH_SIZE, MODEL_VERSIONS_RETAIN,
+                         START_ITEMS_POOL_SIZE, START_ITEMS_REFILL_RATE)
+for model in models:
+    registry.register(model)
+# Models added or changed by a models.json file in MODELS_PATH
+registry.refresh()
+# Ids of models loaded at import already, e.g. "0,1" (with gunicorn --preload before the workers are forked)
+for model_id in environ.get('PRELOAD_MODELS', '').split(','):
+    if model_id.strip():
+        registry.load(int(model_id))
 # endregion
 
 # region Resources
 
 
+def get_model_id() -> int:
+    """The id of the model selected in the current session."""
+    model_id = session.get('model_id')
+    if model_id not in registry:
+        abort(400, message='No model is selected, please start again.')
+    return model_id
+
+
+def get_model():
+    """The model of the current session, in the version the session started with."""
+    model_id = get_model_id()
+    try:
+        return registry.get(model_id, session.get('model_version'))
+    except ModelVersionUnavailable:
+        abort(409, message='The model was updated, please start again.')
+
+
+def get_approximator() -> LexicalItemApproximator:
+    """Restores the approximator of the current session against the shared vectors of its model."""
+    return LexicalItemApproximator.from_state(get_model(), session['approximator'])
+
+
+def store_approximator(approximator: LexicalItemApproximator):
+    """Stores only the compact state of an approximator in the current session."""
+    session['approximator'] = approximator.state
+
+
+def render_plot(approximator: LexicalItemApproximator, size: float, dpi: int) -> bytes:
+    """Renders the plot of the current suggestions in the app's plot pool."""
+    items, target = approximator.plot_highlights
+    keys = approximator.vectors.index_to_key
+    labels = [keys[i] for i in items] + ([keys[target]] if target is not None else [])
+    return current_app.extensions['plot_pool'].render_plot(
+        registry.plot_coordinates_file(session['model_id'], approximator.model), items, target, labels, size, dpi)
+
+
+def render_result_plot(approximator: LexicalItemApproximator, result: str) -> bytes:
+    """Evaluates the result and renders the result plot in the app's plot pool."""
+    approximator.evaluate_result(result)
+    return current_app.extensions['plot_pool'].render_result_plot(
+        result, approximator.y_vals_selection, approximator.y_vals_closest, approximator.y_vals_suggestions_avg)
+
+
+@contextmanager
+def plot_errors():
+    """Answers requests whose plot is not rendered with 503 if too many plots are queued or a rendering process
+    died, and 504 if it took too long."""
+    try:
+        yield
+    except PlotQueueFull:
+        abort(503, message='Too many plots are being rendered, try again later.')
+    except BrokenProcessPool:
+        abort(503, message='Rendering the plot failed, try again later.')
+    except TimeoutError:
+        abort(504, message='Rendering the plot took too long.')
+
+
 class ModelsRessource(Resource):
     model_id_arg = {"id": fields.Integer(required=False)}
 
     @use_args(model_id_arg, location='query')
     def get(self, query):
         if not query:
-            # Return models without vectors
+            # Return models without their vectors file
             return jsonify([{key:model[key] 
-            for key in model if key!='vectors'} 
-            for model in models])
+            for key in model if key!='file'} 
+            for model in registry.models()])
 
         # The /models?id=number request means that the model with the given id is selected.
-        session['model'] = models[query['id']]
+        if query['id'] not in registry:
+            abort(404, message=f"There is no model with id {query['id']}.")
+        session['model_id'] = query['id']
         return "OK"
 
 class SuggestionsResource(Resource):
@@ -66,41 +159,72 @@ class SuggestionsResource(Resource):
     def get(self, query):
         """Get a selection of similar items for a item."""
         if not query or not 'approximator' in session:
-            # Create a new instance of LexicalItemApproximator for every session and return the start_items
-            approximator = LexicalItemApproximator(
-                vectors=session['model']['vectors'])
-            session['approximator'] = approximator
-            return jsonify({'items': approximator.start_items})
+            # Create a new instance of LexicalItemApproximator for every session and return the start_items.
+            # The session keeps the current version of the model, also when the model is updated meanwhile.
+            model = registry[get_model_id()]
+            session['model_version'] = model.version
+            approximator = LexicalItemApproximator(vectors=model)
+            start_items = approximator.start_items
+            store_approximator(approximator)
+            return jsonify({'items': start_items})
         else:
             # If a selected item is provided, select it and get suggestions
-            approximator: LexicalItemApproximator = session['approximator']
+            approximator = get_approximator()
             approximator.select_item(query['item'])
-            return jsonify({"items": approximator.suggest_items(), "excluded": list(approximator.excluded_items)})
+            suggestions = approximator.suggest_items()
+            store_approximator(approximator)
+            # Only the change of excluded items, the client knows the items excluded before
+            return jsonify({"items": suggestions, "excludedAdded": approximator.excluded_added})
 
 
 class UndoResource(Resource):
     def get(self):
-        approximator: LexicalItemApproximator = session['approximator']
+        approximator = get_approximator()
         approximator.undo()
-        return jsonify({"currentItem": approximator.selected_item, "items": approximator.suggestions_sequence[-1], "excluded": list(approximator.excluded_items)})
+        store_approximator(approximator)
+        return jsonify({"currentItem": approximator.selected_item, "items": approximator.suggestions_sequence[-1], "excludedRemoved": approximator.excluded_removed})
 
 
 class PlotResource(Resource):
-    def get(self):
-        approximator: LexicalItemApproximator = session['approximator']
+    plot_args = {"size": fields.Float(required=False, validate=validate.Range(min=2, max=24)),
+                 "dpi": fields.Integer(required=False, validate=validate.Range(min=50, max=300))}
+
+    @use_args(plot_args, location='query')
+    def get(self, query):
+        approximator = get_approximator()
+        # Whole inches and multiples of 50 dpi, so few backgrounds are rendered and cached (see PlotRenderer)
+        size = round(query.get('size', current_app.config['PLOT_SIZE']))
+        dpi = round(query.get('dpi', current_app.config['PLOT_DPI']) / 50) * 50
+        with plot_errors():
+            plot = render_plot(approximator, size=size, dpi=dpi)
         return send_file(
-            io.BytesIO(approximator.get_plot_image()),
+            io.BytesIO(plot),
             mimetype='image/png',
             attachment_filename=f'plot{datetime.now()}.png')
 
 
+class PlotDataResource(Resource):
+    def get(self):
+        """Get the coordinates of the current suggestions and the selected item, for drawing the plot client-side."""
+        return jsonify(get_approximator().get_plot_data())
+
+
+class CoordinatesResource(Resource):
+    def get(self):
+        """Get the coordinates of all items of the session's model, the background of every plot."""
+        coordinates = get_model().plot_coordinates
+        # Four decimals are plenty for drawing and keep the response compact
+        return jsonify({"x": np.round(coordinates[:, 0], 4).tolist(),
+                        "y": np.round(coordinates[:, 1], 4).tolist()})
+
+
 class DoneResource(Resource):
     suggestion_args = {"item": fields.String(required=True)}
 
     @use_args(suggestion_args, location='query')
     def get(self, query):
         """Get start items and number of iterations needed."""
-        approximator: LexicalItemApproximator = session['approximator']
+        approximator = get_approximator()
         return jsonify({"start_items": approximator.start_items, "iterations": approximator.iterations, "sequence": approximator.selection_sequence})
 
 
@@ -110,52 +234,102 @@ class ResultPlotResource(Resource):
     @use_args(result_args, location='query')
     def get(self, item):
         """Get the concluding plot for this session and a result item."""
-        approximator: LexicalItemApproximator = session['approximator']
-        session['result_plot'] = approximator.get_result_plot_image(
-            item['item'])
+        approximator = get_approximator()
+        with plot_errors():
+            result_plot = render_result_plot(approximator, item['item'])
+        store_approximator(approximator)
+        # Kept for saving the results, unless the session is a token held by the client
+        if current_app.config['SESSION_TYPE'] != 'token':
+            session['result_plot'] = result_plot
         return send_file(
-            io.BytesIO(session['result_plot']),
+            io.BytesIO(result_plot),
             mimetype='image/png',
             attachment_filename=f'plot{datetime.now()}.png')
 
 
+class ResultPlotDataResource(Resource):
+    result_args = {"item": fields.String(required=True)}
+
+    @use_args(result_args, location='query')
+    def get(self, item):
+        """Get the data behind the concluding plot for this session and a result item."""
+        approximator = get_approximator()
+        approximator.evaluate_result(item['item'])
+        store_approximator(approximator)
+        return jsonify({"target": item['item'],
+                        "selection": approximator.y_vals_selection,
+                        "suggestionsAverage": approximator.y_vals_suggestions_avg,
+                        "closest": approximator.y_vals_closest,
+                        "mostSimilarOfSuggested": approximator.most_similar_of_suggested_sequence})
+
+
+class StatsResource(Resource):
+    def get(self):
+        """Get statistics of the similarity batching and the start items pools of the loaded models,
+        for tuning them."""
+        return jsonify([{'id': model_id, 'version': model.version, 'items': len(model),
+                         'similarityBatcher': model.similarity_batcher.stats() if model.similarity_batcher else None,
+                         'startItemsPool': model.start_items_pool.stats() if model.start_items_pool else None}
+                        for model_id, model in registry.loaded().items()])
+
+
+class MetricsResource(Resource):
+    def get(self):
+        """Get the latencies of requests and their stages, session sizes, model load times and cache hits
+        of this process, in the Prometheus text format."""
+        return Response(metrics.REGISTRY.render(), mimetype=metrics.Registry.CONTENT_TYPE)
+
+
+class ReloadModelsResource(Resource):
+    def post(self):
+        """Load changed models now instead of at the next check (see MODELS_WATCH_INTERVAL), in the background.
+        Only in the process answering the request, requires the ADMIN_TOKEN as X-Admin-Token header."""
+        admin_token = current_app.config['ADMIN_TOKEN']
+        if not admin_token:
+            abort(404)
+        if request.headers.get('X-Admin-Token') != admin_token:
+            abort(403)
+        threading.Thread(target=registry.refresh, name='model-reload', daemon=True).start()
+        # The versions before the reload, see /stats for the versions loaded
+        return {'models': [{'id': model_id, 'version': model.version}
+                           for model_id, model in registry.loaded().items()]}, 202
+
+
 class SaveResultsResource(Resource):
     def get(self):
         utc_time = datetime.utcnow()
         time = pytz.utc.localize(utc_time, is_dst=None).astimezone(
             pytz.timezone('Europe/Berlin'))
-        approximator: LexicalItemApproximator = session['approximator']
-        save_dir = f'./results/results_{time.year}-{time.month:02d}-{time.day:02d}-{time.hour:02d}-{time.minute:02d}-{time.second:02d}_{approximator.selected_item}'
-        os.makedirs(save_dir, exist_ok=True)
-        with open(f'{save_dir}/results.txt', "a") as myfile:
-            myfile.write(f"Timestamp: {time.year}-{time.month:02d}-{time.day:02d}, {time.hour:02d}:{time.minute:02d}:{time.second:02d} h\
-            \nIterations needed: {approximator.iterations}\
-            \n\
-            \n\
-            \n---- Selection history: ----\
-            \n{approximator.selection_sequence}\
-            \n\
-            \n\
-            \n---- Most similar of suggested history: ----\
-            \n{approximator.most_similar_of_suggested_sequence}\
-            \n\
-            \n\
-            \n---- Suggestion history: ----\
-            \n{(os.linesep * 2).join([str(suggestions) for suggestions in approximator.suggestions_sequence])}\
-            \n\
-            \n\
-            \n---- Plot Cosine similarity values: ----\
-            \nselected item:\
-            \n{approximator.y_vals_selection}\
-            \n\
-            \naverage of suggested:\
-            \n{approximator.y_vals_suggestions_avg}\
-            \n\
-            \nmost similar of suggested:\
-            \n{approximator.y_vals_closest}\
-                ")
-        image = Image.open(io.BytesIO(session['result_plot']))
-        image.save(f'{save_dir}/result_plot.png')
+        approximator = get_approximator()
+        # The selected item is the result
+        if approximator.selected_item:
+            approximator.evaluate_result(approximator.selected_item)
+        result = {
+            'id': uuid.uuid4().hex,
+            'timestamp': time.isoformat(timespec='seconds'),
+            'modelId': session['model_id'],
+            'target': approximator.selected_item,
+            'iterations': approximator.iterations,
+            'seed': approximator.seed,
+            'selection': approximator.selection_sequence,
+            'suggestions': approximator.suggestions_sequence,
+            'mostSimilarOfSuggested': approximator.most_similar_of_suggested_sequence,
+            'ySelection': [float(y) for y in approximator.y_vals_selection],
+            'ySuggestionsAverage': [float(y) for y in approximator.y_vals_suggestions_avg],
+            'yClosest': [float(y) for y in approximator.y_vals_closest],
+        }
+        result_plot = None
+        if current_app.config['RESULTS_SAVE_PLOTS']:
+            # Render the result plot if the session does not hold it (token sessions, clients drawing it themselves)
+            result_plot = session.get('result_plot')
+            if result_plot is None and approximator.selected_item:
+                try:
+                    result_plot = render_result_plot(approximator, approximator.selected_item)
+                except (PlotQueueFull, TimeoutError, BrokenProcessPool):
+                    # The result is saved without its plot rather than not at all
+                    pass
+        # Written in the background, the png as it was rendered
+        current_app.extensions['results_writer'].write(result, result_plot)
         return "OK"
 
 # endregion
@@ -173,16 +347,34 @@ def handle_request_parsing_error(err, req, schema, *, error_status_code, error_h
 
 def create_app():
     app = Flask(__name__)
-    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+    CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True,
+         expose_headers=[TokenSessionInterface.header_name])
     api = Api(app)
-    sess = Session(app)
     app.config.from_pyfile('settings.py')
-    sess.init_app(app)
+    if app.config['SESSION_TYPE'] == 'token':
+        # The whole session is a signed token held by the client, no session store is needed
+        app.session_interface = TokenSessionInterface()
+    else:
+        Session(app)
+    instrumentation.init_app(app)
+    app.extensions['results_writer'] = ResultsWriter(
+        app.config['RESULTS_PATH'], flush_interval=app.config['RESULTS_FLUSH_INTERVAL'])
+    app.extensions['plot_pool'] = PlotPool(
+        app.config['PLOT_PROCESSES'], app.config['PLOT_QUEUE_SIZE'], app.config['PLOT_TIMEOUT'])
     api.add_resource(ModelsRessource, "/models")
     api.add_resource(SuggestionsResource, "/suggestions")
     api.add_resource(PlotResource, "/plot")
+    api.add_resource(PlotDataResource, "/plot-data")
+    api.add_resource(CoordinatesResource, "/coordinates")
     api.add_resource(DoneResource, '/done')
     api.add_resource(UndoResource, '/undo')
     api.add_resource(ResultPlotResource, '/result-plot')
+    api.add_resource(ResultPlotDataResource, '/result-plot-data')
     api.add_resource(SaveResultsResource, '/save-results')
+    api.add_resource(StatsResource, '/stats')
+    api.add_resource(MetricsResource, '/metrics')
+    api.add_resource(ReloadModelsResource, '/admin/reload-models')
+    if MODELS_WATCH_INTERVAL > 0:
+        # Started in the worker processes, on their first request
+        app.before_request(lambda: registry.watch(MODELS_WATCH_INTERVAL))
     return app
@@ -0,0 +1,124 @@
+import cProfile
+import io
+import os
+import pickle
+import pstats
+import random
+import time
+from datetime import datetime
+from threading import Lock
+
+from flask import Flask, g, request
+from flask.sessions import SessionInterface
+
+import metrics
+
+
+class InstrumentedSessionInterface:
+    """Wraps the session interface of an app to time loading and storing sessions and record their sizes.
+    Everything else is delegated to the wrapped interface.
+    """
+
+    def __init__(self, interface: SessionInterface, session_type: str):
+        self.interface = interface
+        self.session_type = session_type
+
+    def __getattr__(self, name):
+        return getattr(self.interface, name)
+
+    def open_session(self, app, request):
+        with metrics.stage('session_load'):
+            return self.interface.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with metrics.stage('session_store'):
+            self.interface.save_session(app, session, response)
+        if not session or not self.interface.should_set_cookie(app, session):
+            return
+        header_name = getattr(self.interface, 'header_name', None)
+        if header_name and header_name in response.headers:
+            # Token sessions, the signed token is the payload
+            size = len(response.headers[header_name])
+        else:
+            # Session stores pickle the session. Pickled again only to measure it, a fraction of the store's time.
+            size = len(pickle.dumps(dict(session), protocol=pickle.HIGHEST_PROTOCOL))
+        metrics.SESSION_BYTES.observe(size, type=self.session_type)
+
+
+class RequestProfiler:
+    """Profiles a sample of requests with cProfile.
+
+    For each profiled request, a pstats file (for snakeviz, or flameprof for a flame graph) and a text report
+    of the functions with the highest cumulative time are written to the profiles directory.
+    Only one request is profiled at a time, concurrent requests are not sampled meanwhile.
+    """
+
+    def __init__(self, path: str, sample_rate: float, n_functions: int = 40):
+        """
+        Args:
+            path (str): Profiles directory, created if it does not exist
+            sample_rate (float): Fraction of requests profiled
+            n_functions (int, optional): Number of functions listed in the text reports. Defaults to 40.
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.n_functions = n_functions
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def start(self):
+        if random.random() >= self.sample_rate or not self._lock.acquire(blocking=False):
+            return
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def stop(self, endpoint: str, seconds: float):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        self._lock.release()
+
+        name = os.path.join(self.path, f"{datetime.now():%Y%m%d-%H%M%S-%f}-{endpoint.strip('/') or 'root'}"
+                                       f"-{seconds * 1000:.0f}ms")
+        profiler.dump_stats(f'{name}.prof')
+        report = io.StringIO()
+        report.write(f'{request.method} {request.full_path} {seconds * 1000:.1f} ms\n\n')
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(self.n_functions)
+        with open(f'{name}.txt', 'w', encoding='utf-8') as report_file:
+            report_file.write(report.getvalue())
+
+
+def init_app(app: Flask):
+    """Records the latency of every request and stage in metrics.REGISTRY and profiles sampled requests
+    (see the PROFILE_* settings).
+    Must be called after the app's session interface is set up.
+    """
+    app.session_interface = InstrumentedSessionInterface(app.session_interface, app.config['SESSION_TYPE'])
+    profiler = None
+    if app.config['PROFILE_SAMPLE_RATE'] > 0:
+        profiler = RequestProfiler(app.config['PROFILE_PATH'], app.config['PROFILE_SAMPLE_RATE'])
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def record_status(response):
+        g.response_status = response.status_code
+        return response
+
+    # Teardown runs after the session is stored, which belongs to the request's latency
+    @app.teardown_request
+    def record_request(exception):
+        start = g.pop('request_start', None)
+        if start is None:
+            return
+        seconds = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(seconds, endpoint=endpoint, method=request.method,
+                                        status=g.get('response_status', 500))
+        if profiler is not None:
+            profiler.stop(endpoint, seconds)
@@ -0,0 +1,324 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from functools import partial
+from threading import Lock
+
+import numpy as np
+
+import metrics
+from LexicalItemApproximator import LexicalItemApproximator
+from lexical_model import LexicalModel
+from similarity_batcher import SimilarityBatcher
+from start_items_pool import StartItemsPool
+
+logger = logging.getLogger(__name__)
+
+
+def _start_items(model: LexicalModel, seed: int) -> "list[int]":
+    """Start items of approximations of a model with a seed, as vocabulary indices."""
+    return [model.vectors.key_to_index[item] for item in LexicalItemApproximator(model, seed).start_items]
+
+
+class ModelVersionUnavailable(Exception):
+    """Raised when a session's model version is no longer loaded and the current version changed its items."""
+
+
+class ModelRegistry:
+    """Keeps every model loaded once per process.
+
+    Sessions only store the id and the version of their model and look the model up here,
+    so the embedding matrix is never serialized into a session.
+
+    Models are reloaded when their files change (see refresh and watch). The new version is loaded in the
+    background and then swapped in, new sessions use it. Sessions keep the version they started with as long
+    as it is kept (retain seconds after its last use); after that, they continue with the current version
+    if it has the same items at the same indices, which it has if it only appended items.
+    A version that only appends items takes over what was derived from the previous version (see
+    LexicalModel.inherit).
+
+    Besides the models given to register, models described in a models.json file in the models directory
+    (a list of the same dicts) are registered, also when the file is changed.
+    """
+
+    MODELS_FILE = 'models.json'
+
+    def __init__(self, models_path: str, neighbor_index_max_items: int = 0, batch_window: float = 0,
+                 batch_size: int = 16, retain: float = 600, start_items_pool_size: int = 0,
+                 start_items_refill_rate: float = 20):
+        """
+        Args:
+            models_path (str): Directory containing the model files
+            neighbor_index_max_items (int, optional): Models with up to this many items get a complete
+                neighbor index built at load time, unless they come with one. Defaults to 0 (never).
+            batch_window (float, optional): Seconds concurrent similarity queries to a model are collected for
+                to compute them together (see SimilarityBatcher). Defaults to 0 (no batching).
+            batch_size (int, optional): Maximum number of similarity queries computed together. Defaults to 16.
+            retain (float, optional): Seconds a version that is not the current one is kept after its last use.
+                Defaults to 600, the lifetime of sessions.
+            start_items_pool_size (int, optional): Number of start item sets each model keeps ready for new sessions
+                (see StartItemsPool). Defaults to 0 (none).
+            start_items_refill_rate (float, optional): Maximum number of start item sets computed per second and
+                model. Defaults to 20.
+        """
+        self.models_path = models_path
+        self.neighbor_index_max_items = neighbor_index_max_items
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.retain = retain
+        self.start_items_pool_size = start_items_pool_size
+        self.start_items_refill_rate = start_items_refill_rate
+        self._metadata: "dict[int, dict]" = {}
+        # Model id -> version -> model, and the current version's model
+        self._versions: "dict[int, dict[str, LexicalModel]]" = {}
+        self._models: "dict[int, LexicalModel]" = {}
+        # File signature of each current version, and of changed files waiting to stop changing
+        self._signatures: "dict[int, str]" = {}
+        self._pending: "dict[int, str]" = {}
+        self._last_used: "dict[tuple[int, str], float]" = {}
+        self._coordinates_files: "dict[tuple[int, str], str]" = {}
+        self._models_file_signature = None
+        self._lock = Lock()
+        self._refresh_lock = Lock()
+        self._watcher: threading.Thread = None
+        self._watcher_pid = None
+        atexit.register(self._remove_coordinates_files)
+
+    def register(self, model: dict):
+        """Makes a model known to the registry.
+
+        Args:
+            model (dict): Model metadata, 'file' being the name of its word2vec text file in models_path.
+                If the file was converted with convert-model.py, the binary model is used instead.
+        """
+        self._metadata[model['id']] = model
+
+    def models(self) -> "list[dict]":
+        """
+        Returns:
+            list[dict]: Metadata of all registered models
+        """
+        return list(self._metadata.values())
+
+    def path(self, model_id: int) -> str:
+        """
+        Returns:
+            str: Path of the model directory or word2vec text file the model is loaded from
+        """
+        path = f"{self.models_path}/{self._metadata[model_id]['file']}"
+        binary_path = os.path.splitext(path)[0]
+        return binary_path if os.path.isdir(binary_path) else path
+
+    def load(self, model_id: int) -> LexicalModel:
+        """
+        Returns:
+            LexicalModel: The current version of a model, loaded if it is not yet
+        """
+        with self._lock:
+            if model_id not in self._models:
+                model, signature = self._load(model_id)
+                self._swap(model_id, model, signature)
+            return self._models[model_id]
+
+    def __getitem__(self, model_id: int) -> LexicalModel:
+        model = self._models.get(model_id)
+        if model is None:
+            model = self.load(model_id)
+        self._last_used[(model_id, model.version)] = time.monotonic()
+        return model
+
+    def __contains__(self, model_id: int):
+        return model_id in self._metadata
+
+    def get(self, model_id: int, version: str = None) -> LexicalModel:
+        """A model in the version a session started with.
+
+        Args:
+            model_id (int): Id of the model
+            version (str, optional): The version. Defaults to None, meaning the current one.
+
+        Raises:
+            ModelVersionUnavailable: If the version is no longer kept and the current version has different items
+
+        Returns:
+            LexicalModel: The model
+        """
+        model = self._versions.get(model_id, {}).get(version)
+        if model is not None:
+            self._last_used[(model_id, version)] = time.monotonic()
+            return model
+        model = self[model_id]
+        if version is not None and version != model.version and not self._continues(model, version):
+            raise ModelVersionUnavailable(f'Version {version} of model {model_id} is not available anymore')
+        return model
+
+    def loaded(self) -> "dict[int, LexicalModel]":
+        """
+        Returns:
+            dict[int, LexicalModel]: The current versions of the models loaded so far by id
+        """
+        return dict(self._models)
+
+    def plot_coordinates_file(self, model_id: int, model: LexicalModel) -> str:
+        """The plot coordinates of a model version as .npy file, for processes rendering plots of it.
+
+        Returns:
+            str: Path of the file, removed when the version is no longer kept
+        """
+        key = (model_id, model.version)
+        path = self._coordinates_files.get(key)
+        if path is None:
+            directory = os.path.join(tempfile.gettempdir(), 'lexical-plot-coordinates')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'{os.getpid()}-{model_id}-{model.version}.npy')
+            temporary_path = f'{path}.{threading.get_ident()}.npy'
+            np.save(temporary_path, model.plot_coordinates)
+            os.replace(temporary_path, path)
+            self._coordinates_files[key] = path
+        return path
+
+    def _remove_coordinates_files(self):
+        for path in self._coordinates_files.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def refresh(self, wait_until_stable: bool = False):
+        """Registers the models of the models.json file if it changed and loads the loaded models whose files changed,
+        one after another, each swapped in when it is loaded. Versions no longer used are dropped.
+
+        Args:
+            wait_until_stable (bool, optional): Only load files that have not changed since the previous refresh,
+                so files being written are not loaded. Defaults to False.
+        """
+        with self._refresh_lock:
+            self._read_models_file()
+            for model_id in list(self._models):
+                try:
+                    signature = self._signature(self.path(model_id))
+                except OSError:
+                    # Files being replaced
+                    continue
+                if signature == self._signatures[model_id]:
+                    self._pending.pop(model_id, None)
+                    continue
+                if wait_until_stable and self._pending.get(model_id) != signature:
+                    self._pending[model_id] = signature
+                    continue
+                self._pending.pop(model_id, None)
+                try:
+                    model, signature = self._load(model_id, previous=self._models[model_id])
+                except Exception:
+                    logger.exception('Loading model %s failed, keeping version %s',
+                                     model_id, self._models[model_id].version)
+                    # Not loaded again before the files change again
+                    self._signatures[model_id] = signature
+                    continue
+                with self._lock:
+                    self._swap(model_id, model, signature)
+                logger.info('Model %s: version %s loaded (%d items)', model_id, model.version, len(model))
+            self._drop_unused()
+
+    def watch(self, interval: float):
+        """Refreshes the registry every interval seconds in a background thread of this process. Does nothing if
+        the thread runs already, so it can be called in every request (threads do not survive forking workers).
+        """
+        if self._watcher_pid == os.getpid() and self._watcher.is_alive():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid() and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(interval,), name='model-watcher',
+                                             daemon=True)
+            self._watcher_pid = os.getpid()
+            self._watcher.start()
+
+    def _watch(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh(wait_until_stable=True)
+            except Exception:
+                logger.exception('Refreshing the models failed')
+
+    def _load(self, model_id: int, previous: LexicalModel = None) -> "tuple[LexicalModel, str]":
+        path = self.path(model_id)
+        signature = self._signature(path)
+        start = time.perf_counter()
+        model = LexicalModel.load(path)
+        # Only what the model was not loaded with is derived from the previous version
+        inherited = previous is not None and model.inherit(previous)
+        if model.neighbor_index is None and len(model) <= self.neighbor_index_max_items:
+            model.build_neighbor_index()
+        if self.batch_window > 0:
+            model.similarity_batcher = SimilarityBatcher(
+                model.batch_similarities, self.batch_window, self.batch_size)
+        if self.start_items_pool_size > 0:
+            model.start_items_pool = StartItemsPool(
+                partial(_start_items, model), self.start_items_pool_size, self.start_items_refill_rate)
+        # Equal in all processes loading the same files
+        model.version = f'{len(model)}-{model.vocabulary_digest()[:12]}-{signature[:8]}'
+        metrics.MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model=model_id)
+        if previous is not None:
+            logger.info('Model %s: version %s %s version %s', model_id, model.version,
+                        'appends items to' if inherited else 'replaces', previous.version)
+        return model, signature
+
+    def _swap(self, model_id: int, model: LexicalModel, signature: str):
+        self._versions.setdefault(model_id, {})[model.version] = model
+        self._models[model_id] = model
+        self._signatures[model_id] = signature
+        self._last_used[(model_id, model.version)] = time.monotonic()
+
+    def _drop_unused(self):
+        now = time.monotonic()
+        with self._lock:
+            for model_id, versions in self._versions.items():
+                for version in list(versions):
+                    if version != self._models[model_id].version \
+                            and now - self._last_used.get((model_id, version), 0) > self.retain:
+                        if versions[version].start_items_pool is not None:
+                            versions[version].start_items_pool.close()
+                        del versions[version]
+                        self._last_used.pop((model_id, version), None)
+                        coordinates_file = self._coordinates_files.pop((model_id, version), None)
+                        if coordinates_file is not None and os.path.exists(coordinates_file):
+                            os.remove(coordinates_file)
+
+    @staticmethod
+    def _continues(model: LexicalModel, version: str) -> bool:
+        """Whether a model has the items of a version of it at the same indices."""
+        n_items, digest, _ = version.split('-')
+        return int(n_items) <= len(model) and model.vocabulary_digest(int(n_items)).startswith(digest)
+
+    @staticmethod
+    def _signature(path: str) -> str:
+        """Hash of the names, sizes and modification times of a model's files."""
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+        stats = [(os.path.basename(file), os.stat(file).st_size, os.stat(file).st_mtime_ns) for file in paths]
+        return hashlib.sha256(repr(stats).encode()).hexdigest()
+
+    def _read_models_file(self):
+        path = os.path.join(self.models_path, self.MODELS_FILE)
+        try:
+            signature = self._signature(path)
+        except OSError:
+            return
+        if signature == self._models_file_signature:
+            return
+        try:
+            with open(path, encoding='utf-8') as models_file:
+                models = json.load(models_file)
+        except (OSError, ValueError):
+            logger.exception('Reading %s failed', path)
+            return
+        self._models_file_signature = signature
+        for model in models:
+            if model.get('id') is None or not model.get('file'):
+                logger.error('Model %s in %s needs an id and a file', model, path)
+                continue
+            self.register(model)
@@ -2,10 +2,33 @@ from datetime import timedelta
 from os import environ 
 
 SECRET_KEY = environ.get('SECRET_KEY')
-SESSION_TYPE = 'filesystem'
+# 'filesystem' or 'token', where the client holds the whole session as a signed token
+# and workers share no session store
+SESSION_TYPE = environ.get('SESSION_TYPE', 'filesystem')
 SEND_FILE_MAX_AGE_DEFAULT = 0
 SESSION_PERMANENT = True
 PERMANENT_SESSION_LIFETIME = timedelta(minutes=10)
 # The maximum number of items the session stores 
 # before it starts deleting some, default 500
-SESSION_FILE_THRESHOLD = 5 
\ No newline at end of file
+SESSION_FILE_THRESHOLD = 5
+# Default size (inches) and resolution (dots per inch) of /plot images
+PLOT_SIZE = 12
+PLOT_DPI = 100
+# Results are appended to JSON Lines files in this directory (one per process) by a background writer,
+# which writes and fsyncs at least every RESULTS_FLUSH_INTERVAL seconds
+RESULTS_PATH = environ.get('RESULTS_PATH', './results')
+RESULTS_FLUSH_INTERVAL = 1.0
+# Whether result plots are saved (as png files in the plots subdirectory)
+RESULTS_SAVE_PLOTS = True
+# Fraction of requests profiled with cProfile, 0 for none. A pstats file and a text report of each profiled
+# request are written to PROFILE_PATH. Latency metrics of all requests are served at /metrics regardless.
+PROFILE_SAMPLE_RATE = float(environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_PATH = environ.get('PROFILE_PATH', './profiles')
+# Plots are rendered by PLOT_PROCESSES processes (per worker process of the server), 0 to render them in the
+# worker process. Requests wait at most PLOT_TIMEOUT seconds for their plot and are rejected while
+# PLOT_QUEUE_SIZE different plots are queued.
+PLOT_PROCESSES = int(environ.get('PLOT_PROCESSES', 1))
+PLOT_QUEUE_SIZE = int(environ.get('PLOT_QUEUE_SIZE', 16))
+PLOT_TIMEOUT = float(environ.get('PLOT_TIMEOUT', 10))
+# Token required (as X-Admin-Token header) by /admin/reload-models, which is disabled without one
+ADMIN_TOKEN = environ.get('ADMIN_TOKEN')
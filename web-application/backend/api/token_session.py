@@ -0,0 +1,33 @@
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature
+
+
+class TokenSessionInterface(SecureCookieSessionInterface):
+    """Sessions held entirely by the client as a signed, compressed token, so no session store is needed
+    and any worker can serve any request.
+
+    The token is sent as cookie like Flask's default sessions and additionally as X-Session-Token
+    response header. Clients that cannot use cookies send it back in the X-Session-Token request header.
+    """
+
+    salt = 'approximator-session'
+    header_name = 'X-Session-Token'
+
+    def open_session(self, app, request):
+        token = request.headers.get(self.header_name)
+        if not token:
+            return super().open_session(app, request)
+
+        serializer = self.get_signing_serializer(app)
+        if serializer is None:
+            return None
+        try:
+            return self.session_class(serializer.loads(
+                token, max_age=int(app.permanent_session_lifetime.total_seconds())))
+        except BadSignature:
+            return self.session_class()
+
+    def save_session(self, app, session, response):
+        super().save_session(app, session, response)
+        if session and self.should_set_cookie(app, session):
+            response.headers[self.header_name] = self.get_signing_serializer(app).dumps(dict(session))
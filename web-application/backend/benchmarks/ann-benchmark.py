@@ -0,0 +1,95 @@
+# Recall and latency of the approximate IVFIndex against the exact ranking, on synthetic models.
+#
+# Usage: python benchmarks/ann-benchmark.py --items 100000 1000000 --dims 128 --n-probe 4 8 16 32
+#        python benchmarks/ann-benchmark.py --model models/bluebert-vectors-symptoms.txt
+#
+# For random query items (with some items excluded, as in a session) both paths answer the windows
+# suggest_items asks for: the N_SIMILAR most similar items and the 100 items halfway down the ranking.
+# Reported are the recall of the most similar items, how far the ranks of the items returned for the middle
+# window are from it (in percent of the number of items) and the latencies of both paths.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ivf_index import IVFIndex  # noqa: E402
+from lexical_model import LexicalModel  # noqa: E402
+from LexicalItemApproximator import LexicalItemApproximator  # noqa: E402
+from ranking import items_at_ranks  # noqa: E402
+from synthetic import MODEL_DIRECTORIES, synthetic_models_path  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Benchmark the IVF index against the exact ranking.')
+parser.add_argument('--items', type=int, nargs='+', default=[10000, 100000],
+                    help='number of items of the synthetic models (default: 10000 100000)')
+parser.add_argument('--model', nargs='+', default=[],
+                    help='benchmark these models (directories or word2vec text files) instead of synthetic ones')
+parser.add_argument('--dims', type=int, default=768, help='dimensions of the vectors (default: 768)')
+parser.add_argument('--n-lists', type=int, help='number of lists (default: square root of the number of items)')
+parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 8, 16, 32],
+                    help='numbers of lists ranked per query (default: 4 8 16 32)')
+parser.add_argument('--queries', type=int, default=200, help='number of query items (default: 200)')
+parser.add_argument('--excluded', type=int, default=100, help='number of excluded items per query (default: 100)')
+parser.add_argument('--models-cache', default=os.path.join(tempfile.gettempdir(), 'load-test-models'),
+                    help='directory for the generated models (default: load-test-models in the temp directory)')
+parser.add_argument('--seed', type=int, default=0, help='seed for choosing the queries (default: 0)')
+args = parser.parse_args()
+
+k = LexicalItemApproximator.N_SIMILAR
+paths = args.model or [os.path.join(synthetic_models_path(args.models_cache, n_items, args.dims), MODEL_DIRECTORIES[0])
+                       for n_items in args.items]
+for path in paths:
+    model = LexicalModel.load(path)
+    unit_vectors = model.unit_vectors
+    n_items = len(model)
+    start = time.perf_counter()
+    index = IVFIndex.build(unit_vectors, args.n_lists)
+    print(f'\n{path}: {n_items} items, {unit_vectors.shape[1]} dimensions, {index.n_lists} lists built in '
+          f'{time.perf_counter() - start:.1f} s')
+
+    rng = np.random.default_rng(args.seed)
+    queries = []
+    for query in rng.choice(n_items, min(args.queries, n_items), replace=False):
+        excluded = np.zeros(n_items, dtype=bool)
+        excluded[rng.choice(n_items, args.excluded, replace=False)] = True
+        excluded[query] = False
+        queries.append((query, excluded))
+
+    exact_latencies = []
+    exact_results = []
+    for query, excluded in queries:
+        query_start = time.perf_counter()
+        similarities = np.dot(unit_vectors, unit_vectors[query])
+        excluded_query = excluded.copy()
+        excluded_query[query] = True
+        n_remaining = n_items - np.count_nonzero(excluded_query)
+        middle_window = LexicalItemApproximator._middle_window(n_remaining)
+        top, middle = items_at_ranks(similarities, excluded_query, [(0, k), middle_window])
+        exact_latencies.append(time.perf_counter() - query_start)
+        # Ranks of all remaining items, for judging the items returned for the middle window
+        ranks = np.empty(n_items, dtype=np.int64)
+        order = np.argsort(-np.where(excluded_query, -np.inf, similarities))
+        ranks[order] = np.arange(n_items)
+        exact_results.append((top, middle_window, ranks))
+    print(f'  exact: {np.median(exact_latencies) * 1000:.2f} ms median, '
+          f'{np.percentile(exact_latencies, 99) * 1000:.2f} ms p99 per suggestion')
+
+    print(f'  {"n_probe":>7} {"recall@" + str(k):>10} {"middle rank error":>18} {"median ms":>10} {"p99 ms":>8}')
+    for n_probe in args.n_probe:
+        index.n_probe = n_probe
+        latencies, recalls, rank_errors = [], [], []
+        for (query, excluded), (top, middle_window, ranks) in zip(queries, exact_results):
+            query_start = time.perf_counter()
+            approximate_top = index.window(query, excluded, 0, k)
+            approximate_middle = index.window(query, excluded, *middle_window)
+            latencies.append(time.perf_counter() - query_start)
+            recalls.append(len(np.intersect1d(top, approximate_top)) / k)
+            center = sum(middle_window) / 2
+            rank_errors.append(np.median(np.abs(ranks[approximate_middle] - center)) / n_items)
+        print(f'  {n_probe:>7} {np.mean(recalls):>10.3f} {np.median(rank_errors):>17.2%} '
+              f'{np.median(latencies) * 1000:>10.2f} {np.percentile(latencies, 99) * 1000:>8.2f}')
@@ -0,0 +1,286 @@
+# Load test of the backend API with simulated users, on synthetic models of any size.
+#
+# Usage: python benchmarks/load-test.py --items 1000 100000 1000000 --dims 128 --sessions 100 --concurrency 8
+#
+# Every simulated user thinks of a random target item and runs through a complete session:
+# /models?id=, /suggestions, /suggestions?item= (always selecting the suggestion most similar to the target)
+# until the target is suggested and selected, one /undo, /plot, /done, /result-plot and /save-results.
+# Reported per model size are the latencies of every endpoint (p50/p95/p99), requests per second,
+# response sizes and the size of the session payload at the end of a session.
+#
+# By default the app created by create_app() is driven in-process with Flask's test client, so all
+# users share one Python interpreter, which also renders the plots. With --workers, the app is served by
+# gunicorn instead and requests go through HTTP. Every model size runs in a fresh process, as the backend
+# loads its models at import.
+# Generated models are kept in --models-cache and reused. A model with 1M items of 768 dimensions needs
+# about 6 GB of memory while it is generated, use --dims to reduce it.
+
+import argparse
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BACKEND_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_PATH)
+
+from lexical_model import LexicalModel  # noqa: E402
+from synthetic import MODEL_DIRECTORIES, synthetic_models_path  # noqa: E402
+
+TOKEN_HEADER = 'X-Session-Token'
+
+
+class TestClient:
+    """Requests to the app in this process."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path: str):
+        response = self.client.get(path)
+        return response.status_code, response.headers, response.data
+
+    def session_size(self) -> int:
+        # Size of the session as the session store keeps it
+        import pickle
+        with self.client.session_transaction() as session:
+            return len(pickle.dumps(dict(session)))
+
+
+class HttpClient:
+    """Requests to a server, with its own cookies."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def get(self, path: str):
+        try:
+            with self.opener.open(self.url + path) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read()
+
+    def session_size(self):
+        # Only known for token sessions, from the token
+        return None
+
+
+class SimulatedUser:
+    """Runs sessions, always selecting the suggestion most similar to a target item."""
+
+    def __init__(self, client, model: LexicalModel, max_iterations: int, latencies: dict, sizes: dict):
+        self.client = client
+        self.model = model
+        self.max_iterations = max_iterations
+        self.latencies = latencies
+        self.sizes = sizes
+        self.token_size = None
+
+    def request(self, path: str, endpoint: str = None):
+        start = time.perf_counter()
+        status, headers, body = self.client.get(path)
+        endpoint = endpoint or path.split('?')[0]
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.sizes[endpoint].append(len(body))
+        if headers.get(TOKEN_HEADER):
+            self.token_size = len(headers[TOKEN_HEADER])
+        if status != 200:
+            raise RuntimeError(f'{endpoint}: status {status}')
+        return body
+
+    def most_similar(self, items: "list[str]", target: str) -> str:
+        index = self.model.vectors.key_to_index
+        unit_vectors = self.model.unit_vectors
+        similarities = unit_vectors[[index[item] for item in items]] @ unit_vectors[index[target]]
+        return items[int(np.argmax(similarities))]
+
+    def run(self, target: str) -> dict:
+        """Runs a complete session approximating the target.
+
+        Returns:
+            dict: 'iterations' needed, 'found' if the target was selected and 'session_size' in bytes
+        """
+        self.request('/models?id=0', '/models?id')
+        items = json.loads(self.request('/suggestions', '/suggestions (start)'))['items']
+        iterations = 0
+        item = None
+        undone = False
+        # Like the frontend, the user finally selects the target and the selected item is the result
+        while item != target and iterations < self.max_iterations:
+            item = target if target in items else self.most_similar(items, target)
+            items = json.loads(self.request(
+                f'/suggestions?item={urllib.parse.quote(item)}', '/suggestions?item'))['items']
+            iterations += 1
+            if not undone and iterations == 2 and item != target:
+                # Undo once and select the same item again
+                items = json.loads(self.request('/undo'))['items']
+                item = None
+                iterations -= 1
+                undone = True
+        quoted_item = urllib.parse.quote(item)
+        self.request('/plot')
+        self.request(f'/done?item={quoted_item}')
+        self.request(f'/result-plot?item={quoted_item}')
+        session_size = self.client.session_size() if self.token_size is None else self.token_size
+        self.request('/save-results')
+        return {'iterations': iterations, 'found': item == target, 'session_size': session_size}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, environment: dict, work_dir: str):
+    port = free_port()
+    server = subprocess.Popen(
+        ['gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+         '--bind', f'127.0.0.1:{port}', '--chdir', work_dir, '--pythonpath', BACKEND_PATH,
+         '--log-level', 'warning', 'api:create_app()'],
+        env={**os.environ, **environment})
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited')
+        try:
+            urllib.request.urlopen(url + '/models').close()
+            return server, url
+        except OSError:
+            time.sleep(.5)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def run_benchmark(n_items: int, args: dict) -> dict:
+    args = argparse.Namespace(**args)
+    models_path = synthetic_models_path(args.models_cache, n_items, args.dims)
+    work_dir = tempfile.mkdtemp(prefix='load-test-')
+    environment = {
+        'MODELS_PATH': models_path,
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'load-test'),
+        'SESSION_TYPE': args.session,
+        'RESULTS_PATH': os.path.join(work_dir, 'results'),
+    }
+    model = LexicalModel.load(os.path.join(models_path, MODEL_DIRECTORIES[0]))
+
+    server = None
+    if args.workers:
+        server, url = start_server(args, environment, work_dir)
+        def new_client(): return HttpClient(url)
+    else:
+        # The benchmark runs in a daemon process of a multiprocessing pool, which cannot start plot processes
+        os.environ.update(environment, PLOT_PROCESSES='0')
+        # Flask-Session stores its files in the working directory
+        os.chdir(work_dir)
+        from api import create_app
+        app = create_app()
+        def new_client(): return TestClient(app)
+
+    latencies = defaultdict(list)
+    sizes = defaultdict(list)
+    rng = np.random.default_rng(args.seed)
+    targets = [model.vectors.index_to_key[i] for i in rng.integers(len(model), size=args.sessions)]
+
+    def session(target):
+        try:
+            return SimulatedUser(new_client(), model, args.max_iterations, latencies, sizes).run(target)
+        except RuntimeError as error:
+            return {'error': str(error)}
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            sessions = list(executor.map(session, targets))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    elapsed = time.perf_counter() - start
+
+    completed = [s for s in sessions if 'error' not in s]
+    session_sizes = [s['session_size'] for s in completed if s['session_size'] is not None]
+    return {
+        'items': n_items,
+        'dims': args.dims,
+        'sessions': len(sessions),
+        'failed': len(sessions) - len(completed),
+        'errors': sorted({s['error'] for s in sessions if 'error' in s}),
+        'found': sum(s['found'] for s in completed),
+        'iterations': float(np.mean([s['iterations'] for s in completed])) if completed else None,
+        'seconds': elapsed,
+        'requests_per_second': sum(map(len, latencies.values())) / elapsed,
+        'session_size': {'p50': float(np.median(session_sizes)), 'max': max(session_sizes)} if session_sizes else None,
+        'endpoints': {endpoint: {
+            'requests': len(values),
+            'p50': float(np.percentile(values, 50)) * 1000,
+            'p95': float(np.percentile(values, 95)) * 1000,
+            'p99': float(np.percentile(values, 99)) * 1000,
+            'bytes': float(np.mean(sizes[endpoint])),
+        } for endpoint, values in latencies.items()},
+    }
+
+
+def print_report(result: dict):
+    print(f"\n{result['items']} items, {result['dims']} dimensions: {result['sessions']} sessions "
+          f"({result['failed']} failed, target found in {result['found']}), "
+          f"{result['iterations'] or 0:.1f} iterations on average")
+    for error in result['errors']:
+        print(f'  error: {error}')
+    print(f"  {result['requests_per_second']:.1f} requests/s over {result['seconds']:.1f} s")
+    if result['session_size']:
+        print(f"  session payload: {result['session_size']['p50']:.0f} bytes median, "
+              f"{result['session_size']['max']} bytes max")
+    print(f"  {'endpoint':<22}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'bytes':>10}")
+    for endpoint, stats in result['endpoints'].items():
+        print(f"  {endpoint:<22}{stats['requests']:>9}{stats['p50']:>9.1f}{stats['p95']:>9.1f}"
+              f"{stats['p99']:>9.1f}{stats['bytes']:>10.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the backend API with simulated users.')
+    parser.add_argument('--items', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='number of items of the synthetic models (default: 1000 10000 100000)')
+    parser.add_argument('--dims', type=int, default=768, help='dimensions of the vectors (default: 768)')
+    parser.add_argument('--sessions', type=int, default=50, help='sessions per model size (default: 50)')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous users (default: 4)')
+    parser.add_argument('--max-iterations', type=int, default=30,
+                        help='iterations after which a user gives up (default: 30)')
+    parser.add_argument('--session', choices=['filesystem', 'token'], default='filesystem',
+                        help='SESSION_TYPE of the app (default: filesystem)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='serve the app with this many gunicorn workers instead of the test client')
+    parser.add_argument('--threads', type=int, default=1, help='threads per gunicorn worker (default: 1)')
+    parser.add_argument('--startup-timeout', type=float, default=600,
+                        help='seconds to wait for gunicorn to load the models (default: 600)')
+    parser.add_argument('--models-cache', default=os.path.join(tempfile.gettempdir(), 'load-test-models'),
+                        help='directory for the generated models (default: load-test-models in the temp directory)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for choosing the targets (default: 0)')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for n_items in args.items:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_benchmark, (n_items, vars(args)))
+        print_report(result)
+        results.append(result)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
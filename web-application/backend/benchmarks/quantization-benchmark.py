@@ -0,0 +1,83 @@
+# Memory, speed and differences of suggestions with quantized vectors, against the float32 unit vectors.
+#
+# Usage: python benchmarks/quantization-benchmark.py --items 100000 1000000 --dims 768
+#        python benchmarks/quantization-benchmark.py --model models/bluebert-vectors-symptoms.txt
+#
+# For random items, suggest_items is called with the item selected, by an approximator scoring with the
+# float32 unit vectors and by one scoring with the quantized vectors, both with the same seed.
+# Reported are how often the suggestions differ, for all suggested items and for the most similar ones,
+# with and without re-ranking every window of ranks exactly among more candidates, and the time per suggestion.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lexical_model import LexicalModel  # noqa: E402
+from LexicalItemApproximator import LexicalItemApproximator  # noqa: E402
+from quantized_vectors import QuantizedVectors  # noqa: E402
+from synthetic import MODEL_DIRECTORIES, synthetic_models_path  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Benchmark quantized vectors against float32 vectors.')
+parser.add_argument('--items', type=int, nargs='+', default=[10000, 100000],
+                    help='number of items of the synthetic models (default: 10000 100000)')
+parser.add_argument('--model', nargs='+', default=[],
+                    help='benchmark these models (directories or word2vec text files) instead of synthetic ones')
+parser.add_argument('--dims', type=int, default=768, help='dimensions of the vectors (default: 768)')
+parser.add_argument('--queries', type=int, default=200, help='number of selected items (default: 200)')
+parser.add_argument('--models-cache', default=os.path.join(tempfile.gettempdir(), 'load-test-models'),
+                    help='directory for the generated models (default: load-test-models in the temp directory)')
+parser.add_argument('--seed', type=int, default=0, help='seed for choosing the items (default: 0)')
+args = parser.parse_args()
+
+
+def suggest(model: LexicalModel, item: str, seed: int):
+    approximator = LexicalItemApproximator(model, seed=seed)
+    approximator.select_item(item)
+    start = time.perf_counter()
+    suggestions = approximator.suggest_items()
+    return suggestions, time.perf_counter() - start
+
+
+n_similar = LexicalItemApproximator.N_SIMILAR
+rerank_factor = LexicalItemApproximator.RERANK_FACTOR
+paths = args.model or [os.path.join(synthetic_models_path(args.models_cache, n_items, args.dims), MODEL_DIRECTORIES[0])
+                       for n_items in args.items]
+for path in paths:
+    model = LexicalModel.load(path)
+    # Both paths rank all items, without a neighbor index
+    model.neighbor_index = None
+    unit_vectors = np.asarray(model.unit_vectors)
+    model = LexicalModel(model.vectors, unit_vectors=unit_vectors)
+    n_items = len(model)
+    rng = np.random.default_rng(args.seed)
+    queries = [(model.vectors.index_to_key[i], int(rng.integers(2 ** 32)))
+               for i in rng.choice(n_items, min(args.queries, n_items), replace=False)]
+
+    reference = [suggest(model, item, seed) for item, seed in queries]
+    print(f'\n{path}: {n_items} items, {unit_vectors.shape[1]} dimensions')
+    print(f'  {"vectors":<9}{"MB":>9}{"rerank":>8}{"differ":>8}{"similar differ":>16}{"median ms":>11}{"p99 ms":>8}')
+    latencies = [latency for _, latency in reference]
+    print(f'  {"float32":<9}{unit_vectors.nbytes / 2 ** 20:>9.1f}{"":>8}{"":>8}{"":>16}'
+          f'{np.median(latencies) * 1000:>11.2f}{np.percentile(latencies, 99) * 1000:>8.2f}')
+
+    for dtype in QuantizedVectors.DTYPES:
+        quantized_model = LexicalModel(model.vectors, unit_vectors=unit_vectors,
+                                       quantized_vectors=QuantizedVectors.quantize(unit_vectors, dtype))
+        for factor in [1, rerank_factor]:
+            # A factor of 1 only reorders the items of each window, their selection is not re-ranked
+            LexicalItemApproximator.RERANK_FACTOR = factor
+            results = [suggest(quantized_model, item, seed) for item, seed in queries]
+            differ = np.mean([suggestions != expected for (suggestions, _), (expected, _) in zip(results, reference)])
+            similar_differ = np.mean([suggestions[:n_similar] != expected[:n_similar]
+                                      for (suggestions, _), (expected, _) in zip(results, reference)])
+            latencies = [latency for _, latency in results]
+            print(f'  {dtype:<9}{quantized_model.quantized_vectors.nbytes / 2 ** 20:>9.1f}'
+                  f'{factor if factor > 1 else "no":>8}{differ:>8.1%}{similar_differ:>16.1%}'
+                  f'{np.median(latencies) * 1000:>11.2f}{np.percentile(latencies, 99) * 1000:>8.2f}')
+        LexicalItemApproximator.RERANK_FACTOR = rerank_factor
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+from gensim.models.keyedvectors import KeyedVectors
+
+from lexical_model import LexicalModel
+
+# The model files the backend loads (see api.models), as directories in the binary model format
+MODEL_DIRECTORIES = ['bert-vectors-simpsons', 'bluebert-vectors-symptoms']
+
+
+def synthetic_model(n_items: int, dims: int = 768, n_clusters: int = None, seed: int = 0) -> LexicalModel:
+    """Generates a model of random items, clustered like the items of a real model are.
+
+    Args:
+        n_items (int): Number of items
+        dims (int, optional): Dimensions of the vectors. Defaults to 768 (BERT base).
+        n_clusters (int, optional): Number of clusters the items are drawn around. Defaults to one per 20 items.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        LexicalModel: The model, with items named item0000000, item0000001, ...
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = n_clusters or max(1, n_items // 20)
+    centers = rng.standard_normal((n_clusters, dims), dtype=np.float32)
+    labels = rng.integers(n_clusters, size=n_items)
+    vectors = centers[labels]
+    vectors += rng.standard_normal((n_items, dims), dtype=np.float32)
+
+    keyed_vectors = KeyedVectors(vector_size=dims)
+    keyed_vectors.add_vectors([f'item{i:07d}' for i in range(n_items)], vectors)
+    return LexicalModel(keyed_vectors)
+
+
+def synthetic_models_path(path: str, n_items: int, dims: int = 768, seed: int = 0) -> str:
+    """Creates a directory the backend can use as MODELS_PATH, with a synthetic model in place of every model.
+    Existing models in the directory are reused, so they are only generated once.
+
+    Args:
+        path (str): Parent directory of the models directories
+        n_items (int): Number of items of the synthetic model
+        dims (int, optional): Dimensions of the vectors. Defaults to 768.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        str: The models directory
+    """
+    models_path = os.path.join(path, f'synthetic-{n_items}-{dims}-{seed}')
+    model_path = os.path.join(models_path, MODEL_DIRECTORIES[0])
+    if not os.path.isdir(model_path):
+        synthetic_model(n_items, dims, seed=seed).save(f'{model_path}.tmp')
+        os.replace(f'{model_path}.tmp', model_path)
+    # All models are the same one
+    for directory in MODEL_DIRECTORIES[1:]:
+        if not os.path.lexists(os.path.join(models_path, directory)):
+            os.symlink(MODEL_DIRECTORIES[0], os.path.join(models_path, directory))
+    return models_path
@@ -0,0 +1,50 @@
+# Converts word2vec text files (as written by pre-processing.py) into the binary,
+# memory-mappable model format of LexicalModel.
+#
+# Usage: python convert-model.py models/bluebert-vectors-symptoms.txt [more.txt ...]
+# Each file is converted into a directory with the same name without '.txt' next to it,
+# which the backend then loads instead of the text file.
+# With --neighbors, a NeighborIndex is built and stored with the model (--neighbors 0 for a complete one).
+# With --ivf, an IVFIndex is built instead, for models too large to rank all items per suggestion.
+# With --quantize, quantized vectors are stored, which approximators score items with (see QuantizedVectors).
+
+import argparse
+import os
+import time
+
+from lexical_model import LexicalModel
+from LexicalItemApproximator import LexicalItemApproximator
+from quantized_vectors import QuantizedVectors
+
+parser = argparse.ArgumentParser(
+    description='Convert word2vec text files into the binary model format.')
+parser.add_argument('files', nargs='+', help='word2vec text files to convert')
+parser.add_argument('--output', help='output directory (only for a single input file)')
+parser.add_argument('--neighbors', type=int,
+                    help='number of neighbors stored per item in a neighbor index, 0 for all')
+parser.add_argument('--ivf', type=int,
+                    help='number of lists of an IVF index, 0 for the square root of the number of items')
+parser.add_argument('--quantize', choices=QuantizedVectors.SUGGESTION_DTYPES,
+                    help='also store the unit vectors as float16 (int8 vectors change suggestions)')
+args = parser.parse_args()
+
+if args.neighbors is not None and args.ivf is not None:
+    parser.error('--neighbors and --ivf cannot be used together')
+
+if args.output and len(args.files) > 1:
+    parser.error('--output can only be used with a single input file')
+
+for file in args.files:
+    output = args.output or os.path.splitext(file)[0]
+    start = time.perf_counter()
+    model = LexicalModel.load(file)
+    if args.neighbors is not None:
+        model.build_neighbor_index(args.neighbors or None,
+                                   LexicalItemApproximator.rank_windows(len(model)))
+    if args.ivf is not None:
+        model.build_ivf_index(args.ivf or None)
+    if args.quantize:
+        model.quantize(args.quantize)
+    model.save(output)
+    print(f'{file} -> {output}: {len(model)} items, {model.vectors.vector_size} dimensions '
+          f'({time.perf_counter() - start:.1f} s)')
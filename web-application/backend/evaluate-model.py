@@ -0,0 +1,129 @@
+# Evaluates how well items of a model can be approximated, by simulating a session for every item as target.
+#
+# Usage: python evaluate-model.py models/bluebert-vectors-symptoms [--noise 0.1] [--output results.npz]
+#
+# The simulated user selects the suggested item most similar to the target (see simulation.simulate_session).
+# Sessions run in a process pool. The workers share the model: a binary model (see convert-model.py)
+# is memory-mapped by every worker, a word2vec text file is converted into a temporary binary model
+# in shared memory first. Every session is seeded with --seed and its target, so results do not depend
+# on the number of processes.
+#
+# Prints the distribution of the iterations needed and the average similarity curves. With --output, writes
+# the iterations and the y_vals_* curves (NaN after the last iteration) of every session to a .npz file.
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from LexicalItemApproximator import LexicalItemApproximator
+from lexical_model import LexicalModel
+from simulation import session_seed, simulate_session
+
+CURVES = ['y_vals_selection', 'y_vals_suggestions_avg', 'y_vals_closest']
+
+_model: LexicalModel = None
+_options: dict = None
+
+
+def init_worker(path: str, options: dict):
+    global _model, _options
+    _options = options
+    LexicalItemApproximator.N_SIMILAR = options['n_similar']
+    LexicalItemApproximator.N_DISSIMILAR = options['n_dissimilar']
+    LexicalItemApproximator.N_SUGGESTED_ITEMS = options['n_similar'] + options['n_dissimilar']
+    _model = LexicalModel.load(path)
+    if _model.neighbor_index is None and len(_model) <= options['neighbor_index_max_items']:
+        _model.build_neighbor_index()
+
+
+def simulate_target(target: int) -> "tuple[int, dict]":
+    return target, simulate_session(_model, target, session_seed(_options['seed'], target),
+                                    _options['noise'], _options['max_iterations'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Simulate approximating every item of a model and report the iterations needed.')
+    parser.add_argument('model', help='binary model directory or word2vec text file')
+    parser.add_argument('--targets', type=int,
+                        help='simulate only this many randomly chosen targets (default: all items)')
+    parser.add_argument('--noise', type=float, default=0,
+                        help='probability that the user selects a random suggested item (default: 0)')
+    parser.add_argument('--max-iterations', type=int, default=100,
+                        help='iterations after which the user gives up (default: 100)')
+    parser.add_argument('--n-similar', type=int, default=LexicalItemApproximator.N_SIMILAR,
+                        help=f'similar items per suggestion (default: {LexicalItemApproximator.N_SIMILAR})')
+    parser.add_argument('--n-dissimilar', type=int, default=LexicalItemApproximator.N_DISSIMILAR,
+                        help=f'dissimilar items per suggestion (default: {LexicalItemApproximator.N_DISSIMILAR})')
+    parser.add_argument('--neighbor-index-max-items', type=int, default=5000,
+                        help='build a complete neighbor index in every worker for models up to this size '
+                             '(default: 5000)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of all sessions (default: 0)')
+    parser.add_argument('--output', help='.npz file for the results of all sessions')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    path = args.model
+    temporary_path = None
+    if not os.path.isdir(path):
+        # Workers memory-map the converted model, from shared memory where available
+        temporary_path = tempfile.mkdtemp(dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        LexicalModel.load(path).save(temporary_path)
+        path = temporary_path
+
+    try:
+        n_items = len(LexicalModel.load(path))
+        targets = np.arange(n_items)
+        if args.targets is not None and args.targets < n_items:
+            targets = np.sort(np.random.default_rng(args.seed).choice(n_items, args.targets, replace=False))
+
+        options = {key: vars(args)[key] for key in ['noise', 'max_iterations', 'n_similar', 'n_dissimilar',
+                                                    'neighbor_index_max_items', 'seed']}
+        sessions = {}
+        with multiprocessing.Pool(args.processes, initializer=init_worker, initargs=(path, options)) as pool:
+            chunk_size = max(1, min(64, len(targets) // (args.processes * 4)))
+            for target, session in pool.imap_unordered(simulate_target, targets.tolist(), chunk_size):
+                sessions[target] = session
+    finally:
+        if temporary_path:
+            shutil.rmtree(temporary_path)
+
+    sessions = [sessions[target] for target in targets.tolist()]
+    iterations = np.array([session['iterations'] for session in sessions])
+    found = np.array([session['found'] for session in sessions])
+    curves = {}
+    for curve in CURVES:
+        values = np.full((len(sessions), iterations.max()), np.nan)
+        for row, session in zip(values, sessions):
+            row[:len(session[curve])] = session[curve]
+        curves[curve] = values
+    elapsed = time.perf_counter() - start
+    if args.output:
+        np.savez_compressed(args.output, targets=targets, iterations=iterations, found=found, **curves)
+
+    print(f'{len(sessions)} targets of {n_items} items in {elapsed:.1f} s '
+          f'({len(sessions) / elapsed:.1f} targets/s, {args.processes} processes)')
+    print(f'Found: {found.sum()} ({found.mean():.1%})')
+    found_iterations = iterations[found]
+    if len(found_iterations):
+        percentiles = np.percentile(found_iterations, [25, 50, 75, 90, 99])
+        print(f'Iterations until found: mean {found_iterations.mean():.2f}, '
+              + ', '.join(f'p{p} {value:g}' for p, value in zip([25, 50, 75, 90, 99], percentiles))
+              + f', max {found_iterations.max()}')
+        counts = np.bincount(found_iterations)
+        for n, count in enumerate(counts):
+            if count:
+                print(f'  {n:>4} {count:>7}  {"#" * int(np.ceil(60 * count / counts.max()))}')
+    print('Average cosine similarity to the target per iteration (sessions still running):')
+    print(f'  {"iteration":>9} {"sessions":>9} {"selected":>9} {"average":>9} {"closest":>9}')
+    for i in range(min(iterations.max(), 20)):
+        running = ~np.isnan(curves['y_vals_selection'][:, i])
+        print(f'  {i + 1:>9} {running.sum():>9}'
+              + ''.join(f' {np.nanmean(curves[curve][:, i]):>9.3f}' for curve in CURVES))
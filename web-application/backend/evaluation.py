@@ -0,0 +1,37 @@
+import numpy as np
+
+
+def evaluate_history(unit_vectors: np.ndarray, target: int, selection: "list[int]", suggestions: "list[list[int]]") -> dict:
+    """Evaluates an approximation against its target item: how similar the selected and the suggested items were
+    to the target in every iteration. All similarities are computed in one matrix product.
+
+    Args:
+        unit_vectors (np.ndarray): The model's vectors normalized to unit length
+        target (int): Index of the target item
+        selection (list[int]): Indices of the selected items, one per iteration
+        suggestions (list[list[int]]): Indices of the suggested items, one row of equal length per iteration
+
+    Returns:
+        dict: Cosine similarities to the target of the selected items ('y_vals_selection'),
+            averaged over the suggested items ('y_vals_suggestions_avg') and of the most similar suggested items
+            ('y_vals_closest'), as well as the indices of the most similar suggested items
+            ('most_similar_of_suggested'), all as arrays with one value per iteration
+    """
+    selection = np.asarray(selection, dtype=np.intp)
+    suggestions = np.asarray(suggestions, dtype=np.intp)
+    if suggestions.size == 0:
+        suggestions = suggestions.reshape(0, 0)
+
+    history = np.concatenate([selection, suggestions.ravel()])
+    similarities = np.dot(unit_vectors[history], unit_vectors[target])
+    selection_similarities = similarities[:len(selection)]
+    suggestions_similarities = similarities[len(selection):].reshape(suggestions.shape)
+
+    closest = np.argmax(suggestions_similarities, axis=1) if suggestions.size else np.empty(0, dtype=np.intp)
+    rows = np.arange(len(suggestions))
+    return {
+        'y_vals_selection': selection_similarities,
+        'y_vals_suggestions_avg': suggestions_similarities.mean(axis=1) if suggestions.size else np.empty(0),
+        'y_vals_closest': suggestions_similarities[rows, closest],
+        'most_similar_of_suggested': suggestions[rows, closest],
+    }
@@ -0,0 +1,226 @@
+import os
+
+import numpy as np
+
+
+class IVFIndex:
+    """Approximate neighbor rankings for models too large to rank all items per query or to store rankings of.
+
+    The items are clustered by k-means into lists (an inverted file index). A query ranks only the items
+    of some lists: for the most similar items, the lists whose items are most similar on average,
+    for items further down the ranking (e.g. halfway), the lists whose items are on average about as
+    similar as the items at those ranks. The similarity at a rank is estimated from a fixed random sample
+    of all items. Windows far down the ranking are therefore answered only roughly: with the items whose
+    similarity is closest to the estimated similarity at the center of the window, in no particular order.
+
+    It answers the same queries as a NeighborIndex and can be used in its place.
+    Queries it cannot answer return None, so the caller can fall back to computing the ranking.
+    """
+
+    CENTROIDS_FILE = 'ivf_centroids.npy'
+    OFFSETS_FILE = 'ivf_offsets.npy'
+    ITEMS_FILE = 'ivf_items.npy'
+    SAMPLE_FILE = 'ivf_sample.npy'
+
+    def __init__(self, unit_vectors: np.ndarray, centroids: np.ndarray, offsets: np.ndarray, items: np.ndarray,
+                 sample: np.ndarray, n_probe: int = 16):
+        """
+        Args:
+            unit_vectors (np.ndarray): The model's vectors normalized to unit length
+            centroids (np.ndarray): (n_lists, dims) mean of the unit vectors of the items of each list, so that the
+                dot product with a unit vector is the average similarity of the list's items
+            offsets (np.ndarray): (n_lists + 1) start of each list in items
+            items (np.ndarray): Indices of all items, ordered by list
+            sample (np.ndarray): Indices of a random sample of the items, for estimating the similarity at a rank
+            n_probe (int, optional): Minimum number of lists ranked per query,
+                more lists mean better recall and slower queries. Defaults to 16.
+        """
+        self.unit_vectors = unit_vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        self.items = items
+        self.sample = sample
+        self.n_probe = n_probe
+        norms = np.linalg.norm(centroids, axis=1)
+        self._centroid_norms = np.where(norms > 0, norms, 1)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def window(self, index: int, excluded: np.ndarray, start: int, stop: int):
+        """Items at about the ranks [start, stop) of the ranking of an item with the excluded items removed.
+
+        Args:
+            index (int): Index of the item whose neighbors are ranked
+            excluded (np.ndarray): Boolean mask over all item indices, True for items to leave out
+            start (int): First rank of the window (slice semantics, as for a list of the remaining items)
+            stop (int): Rank after the last rank of the window
+
+        Returns:
+            np.ndarray | None: Indices of the items in the window, sorted by similarity for windows at the top of
+                the ranking and unsorted otherwise, or None if the index cannot answer
+        """
+        n_remaining = len(self) - 1 - np.count_nonzero(excluded) + excluded[index]
+        start, stop, _ = slice(start, stop).indices(n_remaining)
+        if stop <= start:
+            return np.empty(0, dtype=self.items.dtype)
+
+        query = self.unit_vectors[index]
+        list_similarities = np.dot(self.centroids, query)
+        # Windows the n_probe most similar lists are expected to contain are searched directly
+        top = stop <= len(self) * self.n_probe // (2 * self.n_lists)
+        if top:
+            # Cosine similarity to the lists' centroids
+            order = np.argsort(-list_similarities / self._centroid_norms)
+            n_needed = stop
+        else:
+            sample_similarities = np.sort(np.dot(self.unit_vectors[self.sample], query))[::-1]
+            position = int((start + stop) / 2 / n_remaining * len(self.sample))
+            threshold = sample_similarities[min(position, len(self.sample) - 1)]
+            order = np.argsort(np.abs(list_similarities - threshold))
+            n_needed = 2 * (stop - start)
+
+        # Rank at least n_probe lists, and more until they contain enough items
+        sizes = np.diff(self.offsets)[order]
+        n_lists = max(self.n_probe, int(np.searchsorted(np.cumsum(sizes), n_needed)) + 1)
+        candidates = np.concatenate([self.items[self.offsets[i]:self.offsets[i + 1]] for i in order[:n_lists]])
+        # Sorted, memory-mapped vectors are read in order
+        candidates = np.sort(candidates[~excluded[candidates] & (candidates != index)])
+        if len(candidates) < (stop if top else stop - start):
+            return None
+
+        similarities = np.dot(self.unit_vectors[candidates], query)
+        if top:
+            ranked = np.argpartition(-similarities, stop - 1)[:stop]
+            ranked = ranked[np.argsort(-similarities[ranked], kind='stable')]
+            return candidates[ranked[start:stop]]
+        closest = np.argpartition(np.abs(similarities - threshold), stop - start - 1)[:stop - start]
+        return candidates[closest]
+
+    @classmethod
+    def build(cls, unit_vectors: np.ndarray, n_lists: int = None, n_iterations: int = 10, n_train: int = 256,
+              n_sample: int = 4096, chunk_size: int = 4096, seed: int = 0):
+        """Builds the index by spherical k-means clustering of the items.
+
+        Args:
+            unit_vectors (np.ndarray): The model's vectors normalized to unit length
+            n_lists (int, optional): Number of lists. Defaults to None, meaning the square root of the number of items.
+            n_iterations (int, optional): Iterations of k-means. Defaults to 10.
+            n_train (int, optional): Items per list k-means is trained on, a random sample of all items. Defaults to 256.
+            n_sample (int, optional): Size of the sample for estimating similarities at ranks. Defaults to 4096.
+            chunk_size (int, optional): Number of items assigned to lists at once. Defaults to 4096.
+            seed (int, optional): Seed for the k-means initialization and the samples. Defaults to 0.
+
+        Returns:
+            IVFIndex: The index
+        """
+        n_items = len(unit_vectors)
+        n_lists = min(n_lists or max(1, int(np.sqrt(n_items))), n_items)
+        dtype = np.uint16 if n_items <= np.iinfo(np.uint16).max else np.int32
+        rng = np.random.default_rng(seed)
+
+        # Sorted samples read memory-mapped vectors sequentially
+        train = np.asarray(unit_vectors[np.sort(rng.choice(n_items, min(n_items, n_lists * n_train), replace=False))])
+        centroids = train[rng.choice(len(train), n_lists, replace=False)]
+        for _ in range(n_iterations):
+            assignment = cls._assign(train, centroids, chunk_size)
+            sums, counts = cls._sum_by_list(train, assignment, n_lists)
+            # Lists that lost all their items start over at a random item
+            empty = counts == 0
+            sums[empty] = train[rng.choice(len(train), np.count_nonzero(empty), replace=False)]
+            centroids = (sums / np.linalg.norm(sums, axis=1, keepdims=True)).astype(np.float32)
+
+        assignment = cls._assign(unit_vectors, centroids, chunk_size)
+        sums = np.zeros((n_lists, unit_vectors.shape[1]), dtype=np.float64)
+        for chunk_start in range(0, n_items, chunk_size):
+            chunk_sums, _ = cls._sum_by_list(np.asarray(unit_vectors[chunk_start:chunk_start + chunk_size]),
+                                             assignment[chunk_start:chunk_start + chunk_size], n_lists)
+            sums += chunk_sums
+        counts = np.bincount(assignment, minlength=n_lists)
+        means = (sums / np.maximum(counts, 1)[:, np.newaxis]).astype(np.float32)
+
+        return cls(unit_vectors, means,
+                   offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                   items=np.argsort(assignment, kind='stable').astype(dtype),
+                   sample=np.sort(rng.choice(n_items, min(n_items, n_sample), replace=False)).astype(dtype))
+
+    def extend(self, unit_vectors: np.ndarray, chunk_size: int = 4096, seed: int = 0):
+        """Index of a model whose first items are this index's items, for models that only append items.
+        The appended items are added to the lists with the most similar centroids (without clustering again)
+        and to the sample in proportion.
+
+        Args:
+            unit_vectors (np.ndarray): The vectors of all items of the extended model normalized to unit length
+            chunk_size (int, optional): Number of items assigned to lists at once. Defaults to 4096.
+            seed (int, optional): Seed for sampling the appended items. Defaults to 0.
+
+        Returns:
+            IVFIndex: The index
+        """
+        n_previous, n_items = len(self), len(unit_vectors)
+        dtype = np.uint16 if n_items <= np.iinfo(np.uint16).max else np.int32
+        appended = np.asarray(unit_vectors[n_previous:])
+        assignment = self._assign(appended, self.centroids / self._centroid_norms[:, np.newaxis], chunk_size)
+
+        previous_counts = np.diff(self.offsets)
+        sums, counts = self._sum_by_list(appended, assignment, self.n_lists)
+        counts += previous_counts
+        means = ((self.centroids * previous_counts[:, np.newaxis] + sums)
+                 / np.maximum(counts, 1)[:, np.newaxis]).astype(np.float32)
+        # Appended items after the previous items of their list
+        lists = np.concatenate([np.repeat(np.arange(self.n_lists), previous_counts), assignment])
+        items = np.concatenate([np.asarray(self.items, dtype=np.int64), np.arange(n_previous, n_items)])
+        rng = np.random.default_rng(seed)
+        n_sampled = round(len(appended) * len(self.sample) / n_previous)
+        sample = np.concatenate([self.sample, n_previous + np.sort(rng.choice(len(appended), n_sampled, replace=False))])
+
+        return IVFIndex(unit_vectors, means,
+                        offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                        items=items[np.argsort(lists, kind='stable')].astype(dtype),
+                        sample=sample.astype(dtype), n_probe=self.n_probe)
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int) -> np.ndarray:
+        return np.concatenate([np.argmax(np.dot(vectors[chunk_start:chunk_start + chunk_size], centroids.T), axis=1)
+                               for chunk_start in range(0, len(vectors), chunk_size)])
+
+    @staticmethod
+    def _sum_by_list(vectors: np.ndarray, assignment: np.ndarray, n_lists: int):
+        """Sums of the vectors assigned to each list and the number of vectors per list."""
+        order = np.argsort(assignment, kind='stable')
+        lists, starts, counts = np.unique(assignment[order], return_index=True, return_counts=True)
+        sums = np.zeros((n_lists, vectors.shape[1]), dtype=np.float64)
+        if len(lists):
+            sums[lists] = np.add.reduceat(vectors[order].astype(np.float64), starts)
+        all_counts = np.zeros(n_lists, dtype=np.int64)
+        all_counts[lists] = counts
+        return sums, all_counts
+
+    @classmethod
+    def load(cls, path: str, unit_vectors: np.ndarray):
+        """Loads the index saved in a model directory, memory-mapped.
+
+        Args:
+            path (str): Path of the model directory
+            unit_vectors (np.ndarray): The model's vectors normalized to unit length
+
+        Returns:
+            IVFIndex | None: The index or None if the model directory contains none
+        """
+        if not os.path.exists(os.path.join(path, cls.CENTROIDS_FILE)):
+            return None
+        return cls(unit_vectors,
+                   np.load(os.path.join(path, cls.CENTROIDS_FILE)),
+                   np.load(os.path.join(path, cls.OFFSETS_FILE)),
+                   np.load(os.path.join(path, cls.ITEMS_FILE), mmap_mode='r'),
+                   np.load(os.path.join(path, cls.SAMPLE_FILE)))
+
+    def save(self, path: str):
+        np.save(os.path.join(path, self.CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(path, self.OFFSETS_FILE), self.offsets)
+        np.save(os.path.join(path, self.ITEMS_FILE), self.items)
+        np.save(os.path.join(path, self.SAMPLE_FILE), self.sample)
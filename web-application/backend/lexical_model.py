@@ -0,0 +1,277 @@
+import hashlib
+import os
+from typing import TYPE_CHECKING, Union
+
+import numpy as np
+
+import metrics
+from ivf_index import IVFIndex
+from neighbor_index import NeighborIndex
+from quantized_vectors import QuantizedVectors
+
+if TYPE_CHECKING:
+    from gensim.models.keyedvectors import KeyedVectors
+
+
+class LexicalModel:
+    """The vectors of a model together with the read-only structures derived from them.
+
+    A LexicalModel is shared by all approximators (and therefore all sessions) using the model,
+    so everything derived from the vectors is computed at most once per process.
+
+    Models can be stored in a binary format: a directory containing
+        vectors.npy       float32 vectors, one row per item
+        unit_vectors.npy  float32 vectors normalized to unit length
+        norms.npy         float32 lengths of the vectors
+        vocab.txt         the items (index_to_key), one per line
+        plot.npy          float32 2d coordinates of the items for plotting
+    and optionally the files of a NeighborIndex or an IVFIndex and of QuantizedVectors.
+    The arrays are opened memory-mapped, so all worker processes share one page-cache copy.
+    With quantized vectors, only the rows of unit_vectors.npy needed for exact similarities are read.
+    """
+
+    VECTORS_FILE = 'vectors.npy'
+    UNIT_VECTORS_FILE = 'unit_vectors.npy'
+    NORMS_FILE = 'norms.npy'
+    VOCAB_FILE = 'vocab.txt'
+    PLOT_FILE = 'plot.npy'
+
+    def __init__(self, vectors: "KeyedVectors", unit_vectors: np.ndarray = None,
+                 neighbor_index: Union[NeighborIndex, IVFIndex] = None, plot_coordinates: np.ndarray = None,
+                 quantized_vectors: QuantizedVectors = None):
+        self.vectors = vectors
+        self._unit_vectors = unit_vectors
+        self._plot_coordinates = plot_coordinates
+        # Mean and (dims, 2) projection of the PCA the plot coordinates were reduced by
+        self._plot_projection = None
+        # Version of the model's files, set by the ModelRegistry
+        self.version: str = None
+        self._vocabulary_digests: "dict[int, str]" = {}
+        # Optional, approximators rank items themselves without it. A NeighborIndex or, for large models, an IVFIndex
+        self.neighbor_index = neighbor_index
+        # Optional, approximators score items with it instead of the unit vectors
+        self.quantized_vectors = quantized_vectors
+        # Optional, computes the similarities of concurrent queries together (see SimilarityBatcher)
+        self.similarity_batcher = None
+        # Optional, keeps start items of new sessions ready (see StartItemsPool)
+        self.start_items_pool = None
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def unit_vectors(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The vectors normalized to unit length, so that cosine similarity is a dot product
+        """
+        if self._unit_vectors is None:
+            self.vectors.fill_norms()
+            # Avoid division by zero for null vectors, which stay null
+            norms = np.where(self.vectors.norms > 0, self.vectors.norms, 1)
+            self._unit_vectors = (self.vectors.vectors / norms[:, np.newaxis]).astype(np.float32)
+        return self._unit_vectors
+
+    def similarities(self, index: int) -> np.ndarray:
+        """Cosine similarities of an item to all items, approximate if the model has quantized vectors.
+        Computed by the model's similarity batcher if it has one.
+
+        Args:
+            index (int): Index of the item
+
+        Returns:
+            np.ndarray: Similarities, one per item
+        """
+        if self.similarity_batcher is not None:
+            return self.similarity_batcher.similarities(index)
+        return self.batch_similarities([index])[0]
+
+    def batch_similarities(self, indices: "list[int]") -> np.ndarray:
+        """Cosine similarities of items to all items in one matrix product.
+
+        Args:
+            indices (list[int]): Indices of the items
+
+        Returns:
+            np.ndarray: (len(indices), n_items) similarities
+        """
+        queries = self.unit_vectors[np.asarray(indices)]
+        if self.quantized_vectors is not None:
+            return self.quantized_vectors.similarities(queries)
+        return np.dot(queries, self.unit_vectors.T)
+
+    @property
+    def plot_coordinates(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: (n_items, 2) read-only coordinates of the items in 2d space, reduced from the vectors by PCA
+        """
+        if self._plot_coordinates is None:
+            # sklearn is only imported if the coordinates are not stored with the model
+            from sklearn.decomposition import IncrementalPCA
+            with metrics.stage('pca'):
+                pca = IncrementalPCA(n_components=2)
+                coordinates = pca.fit_transform(self.vectors.vectors).astype(np.float32)
+            coordinates.flags.writeable = False
+            self._plot_coordinates = coordinates
+            self._plot_projection = pca.mean_, pca.components_.T
+        return self._plot_coordinates
+
+    @property
+    def plot_projection(self) -> "tuple[np.ndarray, np.ndarray]":
+        """
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Mean and (dims, 2) projection mapping vectors to plot coordinates,
+                coordinates = (vectors - mean) @ projection
+        """
+        if self._plot_projection is None:
+            coordinates = self.plot_coordinates
+            if self._plot_projection is None:
+                # Coordinates loaded with the model. They are a linear projection of the centered vectors, which
+                # least squares recovers (the minimum norm solution is the PCA's, which lies in the span of the
+                # centered vectors). Enough items to span the vectors determine it. Directions without variance
+                # (centering removes one) are cut off, rounding errors along them would dominate the solution.
+                n_items, dims = self.vectors.vectors.shape
+                mean = np.zeros(dims)
+                for chunk_start in range(0, n_items, 65536):
+                    mean += np.asarray(self.vectors.vectors[chunk_start:chunk_start + 65536]).sum(axis=0)
+                mean /= n_items
+                sample = np.sort(np.random.default_rng(0).choice(n_items, min(n_items, 2 * dims), replace=False))
+                projection = np.linalg.lstsq(self.vectors.vectors[sample] - mean,
+                                             np.asarray(coordinates[sample], dtype=np.float64), rcond=1e-6)[0]
+                self._plot_projection = mean, projection
+        return self._plot_projection
+
+    def vocabulary_digest(self, n_items: int = None) -> str:
+        """
+        Args:
+            n_items (int, optional): Number of items. Defaults to None, meaning all.
+
+        Returns:
+            str: Hash of the first n_items items, equal for models with the same items at the same indices
+        """
+        n_items = len(self) if n_items is None else n_items
+        if n_items not in self._vocabulary_digests:
+            digest = hashlib.sha256()
+            for key in self.vectors.index_to_key[:n_items]:
+                digest.update(key.encode('utf-8') + b'\n')
+            self._vocabulary_digests[n_items] = digest.hexdigest()
+        return self._vocabulary_digests[n_items]
+
+    def appends_to(self, previous: "LexicalModel", chunk_size: int = 65536) -> bool:
+        """
+        Returns:
+            bool: Whether the model's first items are the items of a previous version of it, with the same vectors
+        """
+        n_previous = len(previous)
+        if len(self) < n_previous or self.vectors.vector_size != previous.vectors.vector_size \
+                or self.vectors.index_to_key[:n_previous] != previous.vectors.index_to_key:
+            return False
+        return all(np.array_equal(self.vectors.vectors[chunk_start:min(chunk_start + chunk_size, n_previous)],
+                                  previous.vectors.vectors[chunk_start:chunk_start + chunk_size])
+                   for chunk_start in range(0, n_previous, chunk_size))
+
+    def inherit(self, previous: "LexicalModel") -> bool:
+        """Takes over what was derived from the items of a previous version of the model, if the model only appends
+        items to it, and derives it for the appended items only: unit vectors, plot coordinates (projected like
+        the previous items, which keep their coordinates), an IVFIndex and quantized vectors.
+        Whatever the model was loaded with is kept.
+
+        Args:
+            previous (LexicalModel): The previous version
+
+        Returns:
+            bool: Whether the model only appends items to the previous version
+        """
+        if not self.appends_to(previous):
+            return False
+        n_previous = len(previous)
+        appended = np.asarray(self.vectors.vectors[n_previous:], dtype=np.float32)
+
+        if self._unit_vectors is None and previous._unit_vectors is not None:
+            norms = np.linalg.norm(appended, axis=1)
+            appended_unit_vectors = appended / np.where(norms > 0, norms, 1)[:, np.newaxis]
+            self._unit_vectors = np.concatenate([previous._unit_vectors, appended_unit_vectors])
+        if self._plot_coordinates is None and previous._plot_coordinates is not None:
+            mean, projection = previous.plot_projection
+            coordinates = np.concatenate([previous._plot_coordinates,
+                                          ((appended - mean) @ projection).astype(np.float32)])
+            coordinates.flags.writeable = False
+            self._plot_coordinates = coordinates
+            self._plot_projection = mean, projection
+        if self.neighbor_index is None and isinstance(previous.neighbor_index, IVFIndex):
+            self.neighbor_index = previous.neighbor_index.extend(self.unit_vectors)
+        if self.quantized_vectors is None and previous.quantized_vectors is not None:
+            self.quantized_vectors = previous.quantized_vectors.extend(self.unit_vectors[n_previous:])
+        return True
+
+    def build_neighbor_index(self, size: int = None, bucket_ranges: "list[tuple[int, int]]" = ()):
+        """Builds the model's neighbor index, see NeighborIndex.build."""
+        self.neighbor_index = NeighborIndex.build(self.unit_vectors, size, bucket_ranges)
+
+    def build_ivf_index(self, n_lists: int = None):
+        """Builds an IVFIndex as the model's neighbor index, see IVFIndex.build."""
+        self.neighbor_index = IVFIndex.build(self.unit_vectors, n_lists)
+
+    def quantize(self, dtype: str = 'float16'):
+        """Quantizes the unit vectors, see QuantizedVectors.quantize."""
+        self.quantized_vectors = QuantizedVectors.quantize(self.unit_vectors, dtype)
+
+    @classmethod
+    def load(cls, path: str):
+        """Loads a model in binary format (a directory) or in word2vec text format (a file).
+
+        Args:
+            path (str): Path of the model directory or the word2vec text file
+
+        Returns:
+            LexicalModel: The loaded model
+        """
+        # gensim is only imported when a model is loaded
+        from gensim.models.keyedvectors import KeyedVectors
+        if not os.path.isdir(path):
+            return cls(KeyedVectors.load_word2vec_format(path))
+
+        with open(os.path.join(path, cls.VOCAB_FILE), encoding='utf-8') as vocab_file:
+            keys = vocab_file.read().splitlines()
+        vectors_array = np.load(os.path.join(path, cls.VECTORS_FILE), mmap_mode='r')
+
+        # Assign the memory-mapped array instead of adding vectors, which would copy them
+        vectors = KeyedVectors(vector_size=vectors_array.shape[1])
+        vectors.vectors = vectors_array
+        vectors.index_to_key = keys
+        vectors.key_to_index = {key: index for index, key in enumerate(keys)}
+        vectors.next_index = len(keys)
+        vectors.norms = np.load(os.path.join(path, cls.NORMS_FILE), mmap_mode='r')
+
+        unit_vectors = np.load(os.path.join(path, cls.UNIT_VECTORS_FILE), mmap_mode='r')
+        neighbor_index = NeighborIndex.load(path)
+        if neighbor_index is None:
+            neighbor_index = IVFIndex.load(path, unit_vectors)
+        plot_path = os.path.join(path, cls.PLOT_FILE)
+        return cls(vectors,
+                   unit_vectors=unit_vectors,
+                   neighbor_index=neighbor_index,
+                   plot_coordinates=np.load(plot_path, mmap_mode='r') if os.path.exists(plot_path) else None,
+                   quantized_vectors=QuantizedVectors.load(path))
+
+    def save(self, path: str):
+        """Saves the model in binary format.
+
+        Args:
+            path (str): Path of the model directory, created if it does not exist
+        """
+        os.makedirs(path, exist_ok=True)
+        self.vectors.fill_norms()
+        np.save(os.path.join(path, self.VECTORS_FILE),
+                np.asarray(self.vectors.vectors, dtype=np.float32))
+        np.save(os.path.join(path, self.UNIT_VECTORS_FILE), self.unit_vectors)
+        np.save(os.path.join(path, self.NORMS_FILE),
+                np.asarray(self.vectors.norms, dtype=np.float32))
+        np.save(os.path.join(path, self.PLOT_FILE), self.plot_coordinates)
+        with open(os.path.join(path, self.VOCAB_FILE), 'w', encoding='utf-8') as vocab_file:
+            vocab_file.writelines(f'{key}\n' for key in self.vectors.index_to_key)
+        if self.neighbor_index is not None:
+            self.neighbor_index.save(path)
+        if self.quantized_vectors is not None:
+            self.quantized_vectors.save(path)
@@ -0,0 +1,175 @@
+import math
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+
+# Upper bounds (seconds) of the latency buckets, from sub-millisecond rankings to seconds of PCA or model loading
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+# Upper bounds (bytes) of the payload size buckets
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(names: "tuple[str, ...]", values: "tuple[str, ...]", extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: "tuple[str, ...]" = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> "tuple[str, ...]":
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> "list[str]":
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}', *self.samples()]
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+    """A count that only increases, e.g. of cache hits."""
+
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> "list[str]":
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in values]
+
+
+class Gauge(_Metric):
+    """A value that is set, e.g. the seconds a model took to load."""
+
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> "list[str]":
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in values]
+
+
+class Histogram(_Metric):
+    """Counts of observed values (latencies, sizes) in cumulative buckets, with their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: "tuple[str, ...]" = (),
+                 buckets: "tuple[float, ...]" = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Counts per bucket (the last one for values above all bounds) and the sum of the values
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            bucket = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            counts[0][bucket] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the seconds the with block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> "list[str]":
+        with self._lock:
+            values = sorted((key, (list(buckets), total)) for key, (buckets, total) in self._values.items())
+        lines = []
+        for key, (buckets, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), buckets):
+                cumulative += count
+                labels = _format_labels(self.labels, key, 'le="' + _format_value(bound) + '"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """The metrics of a process, rendered in the Prometheus text exposition format.
+
+    Metrics are kept per process. With several gunicorn workers, every scrape of /metrics is answered
+    by one of them; scrape the workers separately (or run a single worker) to see all requests.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics: "dict[str, _Metric]" = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return ''.join(metric.render() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'backend_request_seconds', 'Latency of requests, including storing the session (see stage session_load).',
+    ('endpoint', 'method', 'status')))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'backend_stage_seconds', 'Latency of the stages of handling requests: session_load, session_store, ranking, '
+    'pca, plot_render, result_plot_render and results_write (in the background).', ('stage',)))
+SESSION_BYTES = REGISTRY.register(Histogram(
+    'backend_session_bytes', 'Size of the stored session payloads (the pickled session or the signed token).',
+    ('type',), SIZE_BUCKETS))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    'backend_model_load_seconds', 'Seconds loading a model took, including building its neighbor index.',
+    ('model',)))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'backend_cache_requests_total', 'Lookups of caches: plot_jobs (hit if an identical plot was being rendered, '
+    'miss if rendered, rejected if too many plots were queued), start_items (hit if a new session took start items '
+    'kept ready, miss if it computed them).',
+    ('cache', 'result')))
+SIMILARITY_BATCH_SIZE = REGISTRY.register(Histogram(
+    'backend_similarity_batch_size', 'Number of similarity queries computed together by a SimilarityBatcher.',
+    (), (1, 2, 4, 8, 16, 32, 64)))
+SIMILARITY_BATCH_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'backend_similarity_batch_wait_seconds', 'Seconds similarity queries waited for their batch to be computed.'))
+
+
+def stage(name: str):
+    """Times a stage of handling requests, as `with stage('ranking'): ...` or as decorator `@stage('ranking')`."""
+    return STAGE_SECONDS.time(stage=name)
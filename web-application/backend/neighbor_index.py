@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+
+
+class NeighborIndex:
+    """Precomputed neighbor rankings of all items of a model.
+
+    For every item the index stores its neighbors sorted by cosine similarity (most similar first,
+    the item itself left out). A complete index stores all neighbors and answers every query exactly.
+    A truncated index stores only the first neighbors plus, for rank windows further down the ranking
+    (buckets), a random sample of the items in each window. Queries it cannot answer return None,
+    so the caller can fall back to computing the ranking.
+    """
+
+    NEIGHBORS_FILE = 'neighbors.npy'
+    BUCKETS_FILE = 'neighbor_buckets.npy'
+    BUCKET_RANGES_FILE = 'neighbor_bucket_ranges.npy'
+
+    def __init__(self, neighbors: np.ndarray, buckets: np.ndarray = None, bucket_ranges: np.ndarray = None):
+        """
+        Args:
+            neighbors (np.ndarray): (n_items, k) indices of the k most similar items of each item, sorted
+            buckets (np.ndarray, optional): (n_buckets, n_items, n_samples) samples of items at the ranks of each bucket
+            bucket_ranges (np.ndarray, optional): (n_buckets, 2) start and stop rank of each bucket
+        """
+        self.neighbors = neighbors
+        self.buckets = buckets if buckets is not None else np.empty((0, len(neighbors), 0), dtype=neighbors.dtype)
+        self.bucket_ranges = bucket_ranges if bucket_ranges is not None else np.empty((0, 2), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    @property
+    def is_complete(self):
+        return self.neighbors.shape[1] >= len(self.neighbors) - 1
+
+    def window(self, index: int, excluded: np.ndarray, start: int, stop: int):
+        """Items at the ranks [start, stop) of the ranking of an item with the excluded items removed.
+
+        Args:
+            index (int): Index of the item whose neighbors are ranked
+            excluded (np.ndarray): Boolean mask over all item indices, True for items to leave out
+            start (int): First rank of the window (slice semantics, as for a list of the remaining items)
+            stop (int): Rank after the last rank of the window
+
+        Returns:
+            np.ndarray | None: Indices of the items in the window, sorted by similarity if taken from the
+                stored neighbors and unsorted if taken from a bucket sample, or None if the index cannot answer
+        """
+        neighbors = self.neighbors[index]
+        neighbors = neighbors[~excluded[neighbors]]
+        if self.is_complete:
+            return neighbors[start:stop]
+
+        n_remaining = len(self) - 1 - np.count_nonzero(excluded) + excluded[index]
+        start, stop, _ = slice(start, stop).indices(n_remaining)
+        if stop <= len(neighbors):
+            return neighbors[start:stop]
+
+        # Excluded items only shift ranks by a few positions, so any overlapping bucket is good enough
+        for bucket, (bucket_start, bucket_stop) in zip(self.buckets, self.bucket_ranges):
+            if start < bucket_stop and stop > bucket_start:
+                samples = bucket[index]
+                samples = samples[~excluded[samples]]
+                return samples if len(samples) else None
+        return None
+
+    @classmethod
+    def build(cls, unit_vectors: np.ndarray, size: int = None, bucket_ranges: "list[tuple[int, int]]" = (),
+              n_samples: int = 64, chunk_size: int = 256, seed: int = 0):
+        """Builds the index by ranking the neighbors of all items, a chunk of items at a time.
+
+        Args:
+            unit_vectors (np.ndarray): The model's vectors normalized to unit length
+            size (int, optional): Number of neighbors stored per item. Defaults to None, meaning all (complete index).
+            bucket_ranges (list[tuple[int, int]], optional): Rank windows to sample for a truncated index
+            n_samples (int, optional): Number of items sampled per bucket and item, without replacement.
+                Defaults to 64, at most the width of the narrowest bucket.
+            chunk_size (int, optional): Number of items ranked at once. Defaults to 256.
+            seed (int, optional): Seed for the bucket samples. Defaults to 0.
+
+        Returns:
+            NeighborIndex: The index
+        """
+        n_items = len(unit_vectors)
+        size = n_items - 1 if size is None else min(size, n_items - 1)
+        # The smallest index type halves or quarters the memory needed for large vocabularies
+        dtype = np.uint16 if n_items <= np.iinfo(np.uint16).max else np.int32
+        complete = size == n_items - 1
+        bucket_ranges = [] if complete else [(max(0, start), min(stop, n_items - 1))
+                                             for start, stop in bucket_ranges]
+        rng = np.random.default_rng(seed)
+        n_samples = min([n_samples, *(stop - start for start, stop in bucket_ranges)])
+
+        neighbors = np.empty((n_items, size), dtype=dtype)
+        buckets = np.empty((len(bucket_ranges), n_items, n_samples), dtype=dtype)
+        for chunk_start in range(0, n_items, chunk_size):
+            chunk = np.arange(chunk_start, min(chunk_start + chunk_size, n_items))
+            similarities = np.dot(unit_vectors[chunk], unit_vectors.T)
+            # The item itself always ranks last and therefore never among its neighbors
+            similarities[np.arange(len(chunk)), chunk] = -np.inf
+            if complete:
+                neighbors[chunk] = np.argsort(-similarities, axis=1)[:, :size]
+            else:
+                top = np.argpartition(-similarities, size, axis=1)[:, :size]
+                order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1)
+                neighbors[chunk] = np.take_along_axis(top, order, axis=1)
+            for bucket, (start, stop) in zip(buckets, bucket_ranges):
+                # Partitioning at both ends of the window moves exactly the items at its ranks between them
+                window = np.argpartition(-similarities, (start, stop - 1), axis=1)[:, start:stop]
+                # Different ranks of the window for every item, the first ones of a random permutation
+                samples = np.argpartition(rng.random((len(chunk), stop - start)), n_samples - 1,
+                                          axis=1)[:, :n_samples]
+                bucket[chunk] = np.take_along_axis(window, samples, axis=1)
+
+        return cls(neighbors, buckets, np.array(bucket_ranges, dtype=np.int64).reshape(-1, 2))
+
+    @classmethod
+    def load(cls, path: str):
+        """Loads the index saved in a model directory, memory-mapped.
+
+        Returns:
+            NeighborIndex | None: The index or None if the model directory contains none
+        """
+        if not os.path.exists(os.path.join(path, cls.NEIGHBORS_FILE)):
+            return None
+        neighbors = np.load(os.path.join(path, cls.NEIGHBORS_FILE), mmap_mode='r')
+        if not os.path.exists(os.path.join(path, cls.BUCKETS_FILE)):
+            return cls(neighbors)
+        return cls(neighbors,
+                   np.load(os.path.join(path, cls.BUCKETS_FILE), mmap_mode='r'),
+                   np.load(os.path.join(path, cls.BUCKET_RANGES_FILE)))
+
+    def save(self, path: str):
+        np.save(os.path.join(path, self.NEIGHBORS_FILE), self.neighbors)
+        if len(self.bucket_ranges):
+            np.save(os.path.join(path, self.BUCKETS_FILE), self.buckets)
+            np.save(os.path.join(path, self.BUCKET_RANGES_FILE), self.bucket_ranges)
@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+import numpy as np
+
+import metrics
+
+# PlotRenderers of the model versions plotted by a pool process, by plot coordinates file
+_renderers = {}
+# Renderers kept per process, each caches the backgrounds of the plot sizes it rendered
+MAX_RENDERERS = 8
+
+
+def _render_plot(coordinates_path: str, items: "tuple[int, ...]", target: int, labels: "tuple[str, ...]",
+                 size: float, dpi: int) -> bytes:
+    renderer = _renderers.get(coordinates_path)
+    if renderer is None:
+        from plot_renderer import PlotRenderer
+        if len(_renderers) >= MAX_RENDERERS:
+            # Of a model version no longer plotted, most likely
+            del _renderers[next(iter(_renderers))]
+        renderer = _renderers[coordinates_path] = PlotRenderer(np.load(coordinates_path, mmap_mode='r'))
+    highlighted = [*items, target] if target is not None else list(items)
+    return renderer.render(list(items), target, size, dpi, labels=dict(zip(highlighted, labels)))
+
+
+def _render_result_plot(target: str, y_selection: "tuple[float, ...]", y_closest: "tuple[float, ...]",
+                        y_suggestions_avg: "tuple[float, ...]") -> bytes:
+    from plot_renderer import render_result_plot
+    return render_result_plot(target, list(y_selection), list(y_closest), list(y_suggestions_avg))
+
+
+class PlotQueueFull(Exception):
+    """Raised when a plot is requested while the pool has as many plots to render as it queues."""
+
+
+class PlotPool:
+    """Renders plots in separate processes, so rendering never holds up the process serving requests.
+
+    Identical plots requested while one of them is being rendered are rendered once, all requests wait for
+    the same job. The number of different plots queued or being rendered is limited, further requests
+    are rejected with PlotQueueFull instead of piling up. Pool processes are started on the first plot
+    and each loads the plot coordinates of a model version on its first plot of it.
+    With no rendering processes, or in a daemon process (which cannot start processes), plots are rendered
+    by a thread of this process instead. A pool process that died is replaced by new ones.
+    """
+
+    def __init__(self, n_processes: int = 1, max_queued: int = 16, timeout: float = 10):
+        """
+        Args:
+            n_processes (int, optional): Number of rendering processes, 0 to render in this process.
+                Defaults to 1.
+            max_queued (int, optional): Maximum number of different plots queued or being rendered. Defaults to 16.
+            timeout (float, optional): Seconds a request waits for its plot, the plot is still rendered for
+                identical requests after that. Defaults to 10.
+        """
+        self.n_processes = n_processes
+        self.max_queued = max_queued
+        self.timeout = timeout
+        # (function name, *arguments) of the plots queued or being rendered -> their job
+        self._jobs: "dict[tuple, Future]" = {}
+        self._lock = Lock()
+        # Created by the first plot in a process, an executor does not survive forking workers
+        self._executor = None
+        self._pid = None
+
+    def _create_executor(self):
+        self._pid = os.getpid()
+        if self.n_processes == 0 or multiprocessing.current_process().daemon:
+            return ThreadPoolExecutor(1, thread_name_prefix='plot-renderer')
+        # Spawned, not forked from a process running threads (results writer, request threads)
+        return ProcessPoolExecutor(self.n_processes, mp_context=multiprocessing.get_context('spawn'))
+
+    def render_plot(self, coordinates_path: str, items: "list[int]", target: int = None,
+                    labels: "list[str]" = (), size: float = 12, dpi: int = 100) -> bytes:
+        """Renders a plot of all items of a model with some of them highlighted, see PlotRenderer.render.
+
+        Args:
+            coordinates_path (str): .npy file of the (n_items, 2) plot coordinates of the model,
+                see ModelRegistry.plot_coordinates_file
+            labels (list[str]): Labels of the items and then of the target
+
+        Raises:
+            PlotQueueFull: If too many plots are queued
+            concurrent.futures.TimeoutError: If the plot takes longer than timeout seconds
+            concurrent.futures.process.BrokenProcessPool: If a rendering process died
+
+        Returns:
+            bytes: png image
+        """
+        with metrics.stage('plot_render'):
+            return self._render(_render_plot, coordinates_path, tuple(items), target, tuple(labels), size, dpi)
+
+    def render_result_plot(self, target: str, y_selection: "list[float]", y_closest: "list[float]",
+                           y_suggestions_avg: "list[float]") -> bytes:
+        """Renders the concluding plot of a session, see plot_renderer.render_result_plot.
+
+        Raises:
+            PlotQueueFull: If too many plots are queued
+            concurrent.futures.TimeoutError: If the plot takes longer than timeout seconds
+            concurrent.futures.process.BrokenProcessPool: If a rendering process died
+
+        Returns:
+            bytes: png image
+        """
+        with metrics.stage('result_plot_render'):
+            return self._render(_render_result_plot, target, tuple(y_selection), tuple(y_closest),
+                                tuple(y_suggestions_avg))
+
+    def _render(self, function, *args) -> bytes:
+        key = (function.__name__, *args)
+        with self._lock:
+            job = self._jobs.get(key)
+            joined = job is not None
+            if not joined:
+                if len(self._jobs) >= self.max_queued:
+                    metrics.CACHE_REQUESTS.inc(cache='plot_jobs', result='rejected')
+                    raise PlotQueueFull(f'{len(self._jobs)} plots are queued')
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = self._create_executor()
+                executor = self._executor
+                try:
+                    job = executor.submit(function, *args)
+                except BrokenProcessPool:
+                    # Broken by a job that failed before its callback replaced the executor
+                    executor = self._executor = self._create_executor()
+                    job = executor.submit(function, *args)
+                self._jobs[key] = job
+        metrics.CACHE_REQUESTS.inc(cache='plot_jobs', result='hit' if joined else 'miss')
+        if not joined:
+            # Outside the lock, the callback runs right away if the job is done already
+            job.add_done_callback(lambda done: self._forget(key, done, executor))
+        return job.result(self.timeout)
+
+    def _forget(self, key: tuple, job: Future, executor):
+        with self._lock:
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+            if not job.cancelled() and isinstance(job.exception(), BrokenProcessPool) and self._executor is executor:
+                # A rendering process died (e.g. killed for its memory) and all jobs of the pool failed.
+                # Plots requested from now on are rendered by new processes.
+                executor.shutdown(wait=False)
+                self._executor = self._create_executor()
@@ -0,0 +1,177 @@
+import math
+from collections import OrderedDict
+from io import BytesIO
+from threading import Lock
+
+import numpy as np
+import PIL.Image as Image
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import MultipleLocator
+
+
+class PlotRenderer:
+    """Renders plots of a model's items in 2d space, highlighting some of them.
+
+    The scatter of all items is the same in every plot of a model. It is rendered once per output size
+    and resolution (for the MAX_BACKGROUNDS sizes and resolutions used last), and each plot only draws the highlighted items on a transparent canvas,
+    which is then composited onto the cached raster.
+    Only the object-oriented matplotlib API is used (no pyplot), so plots can be rendered concurrently.
+    """
+
+    # zlib compression level of the png images, low levels encode a lot faster for slightly larger images
+    PNG_COMPRESS_LEVEL = 1
+    # Rasters kept per renderer, one of 24 inches at 300 dpi takes about 200 MB
+    MAX_BACKGROUNDS = 4
+
+    def __init__(self, coordinates: np.ndarray, keys: "list[str]" = None):
+        """
+        Args:
+            coordinates (np.ndarray): (n_items, 2) coordinates of the items
+            keys (list[str], optional): The items, used as labels unless render is given labels
+        """
+        self.coordinates = coordinates
+        self.keys = keys
+        # (size, dpi) -> (raster, x limits, y limits), least recently used first
+        self._backgrounds = OrderedDict()
+        self._lock = Lock()
+
+    def render(self, items: "list[int]", target: int = None, size: float = 12, dpi: int = 100,
+               labels: "dict[int, str]" = None) -> bytes:
+        """Renders a plot of all items with some items and a target item highlighted.
+
+        Args:
+            items (list[int]): Indices of the items to highlight
+            target (int, optional): Index of the target item, highlighted more prominently. Defaults to None.
+            size (float, optional): Width and height in inches. Defaults to 12.
+            dpi (int, optional): Resolution in dots per inch. Defaults to 100.
+            labels (dict[int, str], optional): Labels of the highlighted items by index. Defaults to None,
+                meaning the renderer's keys.
+
+        Returns:
+            bytes: png image
+        """
+        background, x_limits, y_limits = self._background(size, dpi)
+        fig, ax = self._figure(size, dpi)
+        # Same coordinate system as the cached raster, but nothing drawn except the highlighted items
+        fig.patch.set_visible(False)
+        ax.set_axis_off()
+        ax.set_xlim(x_limits)
+        ax.set_ylim(y_limits)
+
+        keys = self.keys if labels is None else labels
+        x_vals, y_vals = self.coordinates[:, 0], self.coordinates[:, 1]
+        for i in items:
+            ax.annotate(text=keys[i].replace("_", " "), xy=(
+                x_vals[i], y_vals[i]), fontsize=14, fontweight='bold', alpha=.7)
+            ax.scatter(x_vals[i], y_vals[i], color='red', alpha=.5)
+
+        # plot target item
+        if target is not None:
+            ax.annotate(text=keys[target].replace("_", " "), xy=(
+                x_vals[target], y_vals[target]), fontsize=20, fontweight='bold', alpha=.7)
+            ax.scatter(x_vals[target], y_vals[target], color='green', s=100, alpha=.5)
+
+        fig.canvas.draw()
+        highlights = np.asarray(fig.canvas.buffer_rgba())
+
+        # Alpha-composite the (non-premultiplied) highlights onto the opaque background,
+        # only where anything was drawn
+        image = background[..., :3].copy()
+        drawn = highlights[..., 3] > 0
+        alpha = highlights[drawn, 3:].astype(np.float32) / 255
+        image[drawn] = (highlights[drawn, :3] * alpha + image[drawn] * (1 - alpha) + .5).astype(np.uint8)
+
+        figdata = BytesIO()
+        Image.fromarray(image).save(figdata, format='png', compress_level=self.PNG_COMPRESS_LEVEL)
+        return figdata.getvalue()
+
+    def _background(self, size: float, dpi: int):
+        with self._lock:
+            if (size, dpi) in self._backgrounds:
+                self._backgrounds.move_to_end((size, dpi))
+            else:
+                if len(self._backgrounds) >= self.MAX_BACKGROUNDS:
+                    self._backgrounds.popitem(last=False)
+                fig, ax = self._figure(size, dpi)
+                ax.scatter(self.coordinates[:, 0], self.coordinates[:, 1], alpha=.2)
+                fig.canvas.draw()
+                raster = np.asarray(fig.canvas.buffer_rgba()).copy()
+                self._backgrounds[(size, dpi)] = raster, ax.get_xlim(), ax.get_ylim()
+            return self._backgrounds[(size, dpi)]
+
+    @staticmethod
+    def _figure(size: float, dpi: int):
+        fig = Figure(figsize=(size, size), dpi=dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.axes.get_xaxis().set_visible(False)
+        ax.axes.get_yaxis().set_visible(False)
+        return fig, ax
+
+
+def render_result_plot(target: str, y_selection: "list[float]", y_closest: "list[float]",
+                       y_suggestions_avg: "list[float]") -> bytes:
+    """Renders the concluding plot of a session, the similarity of its selected and suggested items to the target
+    in every iteration (see LexicalItemApproximator.evaluate_result).
+
+    Args:
+        target (str): The target item
+        y_selection (list[float]): Similarity of the selected item to the target per iteration
+        y_closest (list[float]): Similarity of the most similar suggested item to the target per iteration
+        y_suggestions_avg (list[float]): Average similarity of the suggested items to the target per iteration
+
+    Returns:
+        bytes: png image
+    """
+    assert(len(y_selection) == len(y_suggestions_avg) == len(y_closest) > 0)
+
+    iterations = len(y_selection)
+
+    x_vals = range(1, iterations + 1)
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax, ax2 = fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [10, 1]})
+
+    ax.plot(x_vals, y_selection, marker='^',
+            label='selected item', ls=(0, (1, 10)), alpha=.5, color='k')
+    ax.plot(x_vals, y_closest, marker='o',
+            label='most similar of suggested', ls=(0, (5, 10)), alpha=.5, color='k')
+    ax.plot(x_vals, y_suggestions_avg, marker='o',
+            label='average of suggested', alpha=.5, color='k')
+    ax.title.set_text(f'Target Item: {target.replace("_", " ").title()}')
+    ax.legend(loc='best', title='cosine similarity for')
+    ax2.set_xlabel('iteration')
+    ax.set_ylabel('cosine similarity to target')
+
+    # hide the spines between ax and ax2
+    ax.spines['bottom'].set_visible(False)
+    ax2.spines['top'].set_visible(False)
+    ax.xaxis.tick_top()
+    ax.tick_params(labeltop=False)  # don't put tick labels at the top
+    ax2.xaxis.tick_bottom()
+
+    ax.set_ylim(math.floor(min(y_closest + y_selection + y_suggestions_avg)*10)/10 - .02, 1)  # data
+    ax2.set_ylim(0, .01)  # 0 to 0.1
+    ax2.set_xlim(1, iterations)
+
+    d = .015  # how big to make the lines in axes coordinates
+    # arguments to pass to plot, just so we don't keep repeating them
+    kwargs = dict(transform=ax.transAxes, color='k', clip_on=False)
+    ax.plot((-d, +d), (-d, -d), **kwargs)        # top-left line
+    ax.plot((1 - d, 1 + d), (-d, -d), **kwargs)  # top-right line
+
+    kwargs.update(transform=ax2.transAxes)  # switch to the bottom axes
+    ax2.plot((-d, +d), (1 - d, 1 - d), **kwargs)  # bottom-left line
+    ax2.plot((1 - d, 1 + d), (1 - d, 1 - d), **kwargs)  # bottom-right line
+
+    fig.subplots_adjust(hspace=.07)
+
+    ax.xaxis.set_major_locator(MultipleLocator(1))
+    ax.yaxis.set_major_locator(MultipleLocator(.1))
+    ax2.yaxis.set_major_locator(MultipleLocator(.1))
+
+    figdata = BytesIO()
+    fig.savefig(figdata, format='png')
+    return figdata.getvalue()
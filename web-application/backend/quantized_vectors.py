@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+
+
+class QuantizedVectors:
+    """Compact copy of a model's unit vectors for scoring all items against a query.
+
+    Stored either as float16 or as int8 scaled per dimension (value = int8 value * scale of the dimension),
+    a half or a quarter of the memory of the float32 unit vectors. Similarities computed from them are
+    approximate, callers re-rank the items they need exactly with the float32 unit vectors.
+    Scoring int8 vectors is faster than the float32 matrix-vector product; float16 is a lot slower,
+    as numpy has no fast conversion from float16.
+    int8 vectors are not suitable for suggestions: the items in the middle of the ranking, which suggestions
+    sample dissimilar items from, are closer in similarity than the int8 error, so re-ranking them exactly
+    does not restore their exact ranks (see benchmarks/quantization-benchmark.py).
+    """
+
+    VECTORS_FILE = 'quantized_vectors.npy'
+    SCALES_FILE = 'quantized_scales.npy'
+    DTYPES = ['float16', 'int8']
+    # Dtypes whose re-ranked suggestions are the ones of the float32 unit vectors
+    SUGGESTION_DTYPES = ['float16']
+
+    def __init__(self, vectors: np.ndarray, scales: np.ndarray = None, chunk_size: int = 1024):
+        """
+        Args:
+            vectors (np.ndarray): (n_items, dims) float16 or int8 vectors
+            scales (np.ndarray, optional): (dims,) float32 scale of each dimension, only for int8 vectors
+            chunk_size (int, optional): Number of items scored at once. The float32 copy made for it stays
+                in the CPU cache. Defaults to 1024.
+        """
+        self.vectors = vectors
+        self.scales = scales
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def similarities(self, queries: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarities of all items to one or more queries.
+
+        Args:
+            queries (np.ndarray): A unit vector or (n_queries, dims) unit vectors
+
+        Returns:
+            np.ndarray: float32 similarities, one per item, or (n_queries, n_items) for several queries
+        """
+        # Scaling the queries instead of the vectors gives the same dot products
+        queries = (queries * self.scales if self.scales is not None else queries).astype(np.float32)
+        similarities = np.empty((*queries.shape[:-1], len(self)), dtype=np.float32)
+        for chunk_start in range(0, len(self), self.chunk_size):
+            chunk = self.vectors[chunk_start:chunk_start + self.chunk_size]
+            similarities[..., chunk_start:chunk_start + len(chunk)] = np.dot(queries, chunk.astype(np.float32).T)
+        return similarities
+
+    @classmethod
+    def quantize(cls, unit_vectors: np.ndarray, dtype: str = 'float16', chunk_size: int = 1024):
+        """
+        Args:
+            unit_vectors (np.ndarray): The model's vectors normalized to unit length
+            dtype (str, optional): 'float16' or 'int8'. Defaults to 'float16'.
+            chunk_size (int, optional): Number of items scored at once. Defaults to 1024.
+
+        Returns:
+            QuantizedVectors: The quantized vectors
+        """
+        if dtype == 'float16':
+            return cls(np.asarray(unit_vectors, dtype=np.float16), chunk_size=chunk_size)
+        if dtype != 'int8':
+            raise ValueError(f'dtype must be one of {cls.DTYPES}')
+
+        n_items, dims = unit_vectors.shape
+        maxima = np.zeros(dims, dtype=np.float32)
+        for chunk_start in range(0, n_items, 65536):
+            maxima = np.maximum(maxima, np.abs(unit_vectors[chunk_start:chunk_start + 65536]).max(axis=0))
+        # The largest value of each dimension maps to 127, null dimensions keep the scale 1
+        scales = np.where(maxima > 0, maxima / 127, 1).astype(np.float32)
+        vectors = np.empty((n_items, dims), dtype=np.int8)
+        for chunk_start in range(0, n_items, 65536):
+            vectors[chunk_start:chunk_start + 65536] = np.round(unit_vectors[chunk_start:chunk_start + 65536] / scales)
+        return cls(vectors, scales, chunk_size)
+
+    def extend(self, unit_vectors: np.ndarray):
+        """Quantized vectors of a model whose first items are these vectors' items, for models that only
+        append items. Only the appended items are quantized, with the scales of these vectors.
+
+        Args:
+            unit_vectors (np.ndarray): The vectors of the appended items normalized to unit length
+
+        Returns:
+            QuantizedVectors: The quantized vectors of all items
+        """
+        if self.scales is None:
+            appended = np.asarray(unit_vectors, dtype=np.float16)
+        else:
+            # Values beyond the largest value of a dimension so far are clipped
+            appended = np.clip(np.round(unit_vectors / self.scales), -127, 127).astype(np.int8)
+        return QuantizedVectors(np.concatenate([self.vectors, appended]), self.scales, self.chunk_size)
+
+    @classmethod
+    def load(cls, path: str):
+        """Loads the quantized vectors saved in a model directory, memory-mapped.
+
+        Returns:
+            QuantizedVectors | None: The quantized vectors or None if the model directory contains none
+        """
+        if not os.path.exists(os.path.join(path, cls.VECTORS_FILE)):
+            return None
+        scales_path = os.path.join(path, cls.SCALES_FILE)
+        return cls(np.load(os.path.join(path, cls.VECTORS_FILE), mmap_mode='r'),
+                   np.load(scales_path) if os.path.exists(scales_path) else None)
+
+    def save(self, path: str):
+        np.save(os.path.join(path, self.VECTORS_FILE), self.vectors)
+        if self.scales is not None:
+            np.save(os.path.join(path, self.SCALES_FILE), self.scales)
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def items_at_ranks(similarities: np.ndarray, excluded: np.ndarray, windows: "list[tuple[int, int]]"):
+    """Items at windows of ranks of the ranking by similarity, without sorting the whole ranking.
+
+    Only the boundaries of the windows are selected with np.argpartition, only the items
+    inside the windows are sorted.
+
+    Args:
+        similarities (np.ndarray): Similarity of every item (to the item the ranking is for)
+        excluded (np.ndarray): Boolean mask over all items, True for items left out of the ranking
+        windows (list[tuple[int, int]]): start and stop of each window, with slice semantics
+            as for a list of the ranked (not excluded) items
+
+    Returns:
+        list[np.ndarray]: Indices of the items in each window, most similar first
+    """
+    candidates = np.flatnonzero(~excluded)
+    scores = -similarities[candidates]
+    windows = [slice(start, stop).indices(len(candidates))[:2] for start, stop in windows]
+
+    kth = sorted({rank for start, stop in windows if stop > start for rank in (start, stop - 1)})
+    partitioned = np.argpartition(scores, kth) if kth else np.empty(0, dtype=np.intp)
+
+    items = []
+    for start, stop in windows:
+        window = partitioned[start:stop]
+        items.append(candidates[window[np.argsort(scores[window])]])
+    return items
@@ -0,0 +1,136 @@
+import atexit
+import glob
+import json
+import os
+import socket
+import queue
+import threading
+
+import numpy as np
+
+import metrics
+
+
+class ResultsWriter:
+    """Append-only log of approximation results in JSON Lines format.
+
+    Results are queued and written by a background thread in batches, which fsyncs the log after every
+    batch, so saving a result never waits for the disk. Every process appends to its own file
+    (results-<host>-<pid>.jsonl), so several workers can share one results directory.
+    Result plots are written as they are, as png files in the plots subdirectory.
+    The thread is started by the first write in a process, so a writer created before forking workers
+    (e.g. with gunicorn --preload) writes the results of every worker to the worker's own file.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, batch_size: int = 100):
+        """
+        Args:
+            path (str): Results directory, created if it does not exist
+            flush_interval (float, optional): Maximum seconds a result waits before being written. Defaults to 1.0.
+            batch_size (int, optional): Maximum number of results written at once. Defaults to 100.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        os.makedirs(os.path.join(path, 'plots'), exist_ok=True)
+        self._file_name = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pid = None
+        # Write what is still queued when the process exits
+        atexit.register(self.close)
+
+    def write(self, result: dict, plot: bytes = None):
+        """Queues a result for writing.
+
+        Args:
+            result (dict): The result, must be JSON serializable and contain a unique 'id'
+            plot (bytes, optional): png image of the result plot. Defaults to None.
+        """
+        if self._pid != os.getpid():
+            self._start()
+        if plot is not None:
+            result = {**result, 'plot': f"plots/{result['id']}.png"}
+        self._queue.put((result, plot))
+
+    def close(self):
+        """Writes all queued results and stops the background thread."""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Results queued in the parent process are written there
+            self._file_name = os.path.join(self.path, f'results-{socket.gethostname()}-{os.getpid()}.jsonl')
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='results-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    item = self._queue.get_nowait()
+                closed = item is None
+            except queue.Empty:
+                pass
+            if batch:
+                self._write_batch(batch)
+
+    @metrics.stage('results_write')
+    def _write_batch(self, batch: "list[tuple[dict, bytes]]"):
+        for result, plot in batch:
+            if plot is not None:
+                with open(os.path.join(self.path, result['plot']), 'wb') as plot_file:
+                    plot_file.write(plot)
+        with open(self._file_name, 'a', encoding='utf-8') as results_file:
+            results_file.write(''.join(json.dumps(result) + '\n' for result, _ in batch))
+            results_file.flush()
+            os.fsync(results_file.fileno())
+
+
+def load_results(path: str) -> dict:
+    """Loads all results of a results directory for analysis.
+
+    Args:
+        path (str): Results directory
+
+    Returns:
+        dict: 'results', the list of all results, and for every numeric result field an array,
+            of shape (n_results,) for numbers and (n_results, max length) padded with NaN for lists of numbers
+    """
+    results = []
+    for file_name in sorted(glob.glob(os.path.join(path, 'results-*.jsonl'))):
+        with open(file_name, encoding='utf-8') as results_file:
+            results.extend(json.loads(line) for line in results_file if line.strip())
+    results.sort(key=lambda result: result['timestamp'])
+
+    arrays = {'results': results}
+    if not results:
+        return arrays
+    for key in dict.fromkeys(key for result in results for key in result):
+        # The type of a field is that of its first value which is neither None nor an empty list
+        value = next((result[key] for result in results if result.get(key) not in (None, [])), None)
+        if _is_number(value):
+            arrays[key] = np.array([result[key] for result in results])
+        elif isinstance(value, list) and all(_is_number(v) for v in value):
+            series = np.full((len(results), max(len(result[key]) for result in results)), np.nan)
+            for row, result in zip(series, results):
+                row[:len(result[key])] = result[key]
+            arrays[key] = series
+    return arrays
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
@@ -0,0 +1,136 @@
+import time
+from collections import deque
+from threading import Event, Lock
+
+import numpy as np
+
+import metrics
+
+
+class _Batch:
+    def __init__(self):
+        self.indices: "list[int]" = []
+        self.submitted: "list[float]" = []
+        self.full = Event()
+        self.done = Event()
+        self.results: np.ndarray = None
+        self.error: Exception = None
+
+
+class SimilarityBatcher:
+    """Computes the similarities of concurrently queried items to all items of a model in one matrix product.
+
+    The first query opens a batch and waits up to window seconds for more queries to join it
+    (or until max_size queries have), then computes the similarities of all of them at once and hands
+    every query its row. All vectors are read once per batch instead of once per query. No thread is
+    needed, the first query of a batch computes it while the others wait.
+    """
+
+    def __init__(self, compute, window: float = .002, max_size: int = 16, n_recent: int = 1000):
+        """
+        Args:
+            compute (Callable[[list[int]], np.ndarray]): Computes the (n_queries, n_items) similarities of
+                the items with the given indices to all items, e.g. LexicalModel.batch_similarities
+            window (float, optional): Seconds a batch waits for queries. Defaults to .002.
+            max_size (int, optional): Maximum number of queries per batch, each needs a row of n_items float32.
+                Defaults to 16.
+            n_recent (int, optional): Number of recent queries and batches the latency statistics are computed of.
+                Defaults to 1000.
+        """
+        self.compute = compute
+        self.window = window
+        self.max_size = max_size
+        self._batch: _Batch = None
+        self._lock = Lock()
+
+        self._started = time.monotonic()
+        self._n_queries = 0
+        self._n_batches = 0
+        # Seconds from submitting a query to the start of its batch's computation, the latency the batching adds
+        self._waits = deque(maxlen=n_recent)
+        # Seconds and size of the computations of batches
+        self._computations = deque(maxlen=n_recent)
+        self._sizes = deque(maxlen=n_recent)
+
+    def similarities(self, index: int) -> np.ndarray:
+        """Cosine similarities of an item to all items, computed together with other queries arriving meanwhile.
+
+        Args:
+            index (int): Index of the item
+
+        Returns:
+            np.ndarray: Read-only similarities, one per item
+        """
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            position = len(batch.indices)
+            batch.indices.append(index)
+            batch.submitted.append(time.perf_counter())
+            if len(batch.indices) >= self.max_size:
+                # Later queries open the next batch
+                self._batch = None
+                batch.full.set()
+
+        if not leader:
+            batch.done.wait()
+        else:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            start = time.perf_counter()
+            try:
+                batch.results = self.compute(batch.indices)
+                batch.results.flags.writeable = False
+            except Exception as error:
+                batch.error = error
+            finally:
+                batch.done.set()
+            self._record(batch, start, time.perf_counter() - start)
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[position]
+
+    def _record(self, batch: _Batch, start: float, seconds: float):
+        metrics.SIMILARITY_BATCH_SIZE.observe(len(batch.indices))
+        for submitted in batch.submitted:
+            metrics.SIMILARITY_BATCH_WAIT_SECONDS.observe(start - submitted)
+        with self._lock:
+            self._n_queries += len(batch.indices)
+            self._n_batches += 1
+            self._waits.extend(start - submitted for submitted in batch.submitted)
+            self._computations.append(seconds)
+            self._sizes.append(len(batch.indices))
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Numbers of queries and batches and queries per second since the batcher was created,
+                and of recent batches the average size, the time computing them and the latency added to queries
+                by waiting for the batch (in milliseconds)
+        """
+        with self._lock:
+            waits = np.array(self._waits) * 1000
+            computations = np.array(self._computations) * 1000
+            sizes = np.array(self._sizes)
+            stats = {
+                'window': self.window * 1000,
+                'maxSize': self.max_size,
+                'queries': self._n_queries,
+                'batches': self._n_batches,
+                'queriesPerSecond': self._n_queries / (time.monotonic() - self._started),
+            }
+        if len(sizes):
+            stats.update({
+                'averageSize': float(sizes.mean()),
+                'computeAverage': float(computations.mean()),
+                'waitAverage': float(waits.mean()),
+                'waitP50': float(np.percentile(waits, 50)),
+                'waitP95': float(np.percentile(waits, 95)),
+                'waitMax': float(waits.max()),
+            })
+        return stats
@@ -0,0 +1,62 @@
+import random
+
+import numpy as np
+
+from LexicalItemApproximator import LexicalItemApproximator
+from lexical_model import LexicalModel
+
+
+def simulate_session(model: LexicalModel, target: int, seed: int, noise: float = 0, max_iterations: int = 100) -> dict:
+    """Simulates a session of a user approximating a target item, the way the web application is used:
+    the user selects one of the suggested items until the target is suggested and then selects the target.
+
+    The user knows the target's vector and selects the suggested item most similar to it (an oracle),
+    or a random suggested item instead with probability noise.
+
+    Args:
+        model (LexicalModel): The model
+        target (int): Index of the target item
+        seed (int): Seed of the approximator and the user's random choices, the session is reproducible with it
+        noise (float, optional): Probability of selecting a random suggested item. Defaults to 0.
+        max_iterations (int, optional): Iterations after which the user gives up. Defaults to 100.
+
+    Returns:
+        dict: 'iterations' (selections including the target), 'found' (whether the target was selected)
+            and the result evaluation of the session (see evaluation.evaluate_history)
+    """
+    approximator = LexicalItemApproximator(model, seed=seed)
+    user_random = random.Random(seed)
+    index = model.vectors.key_to_index
+    target_key = model.vectors.index_to_key[target]
+    unit_vectors = model.unit_vectors
+
+    items = approximator.start_items
+    while items and approximator.iterations < max_iterations:
+        if target_key in items:
+            item = target_key
+        elif user_random.random() < noise:
+            item = user_random.choice(items)
+        else:
+            similarities = unit_vectors[[index[item] for item in items]] @ unit_vectors[target]
+            item = items[int(np.argmax(similarities))]
+        approximator.select_item(item)
+        if item == target_key:
+            break
+        items = approximator.suggest_items()
+
+    approximator.evaluate_result(target_key)
+    return {
+        'iterations': approximator.iterations,
+        'found': approximator.selected_item == target_key,
+        'y_vals_selection': approximator.y_vals_selection,
+        'y_vals_suggestions_avg': approximator.y_vals_suggestions_avg,
+        'y_vals_closest': approximator.y_vals_closest,
+    }
+
+
+def session_seed(seed: int, target: int) -> int:
+    """
+    Returns:
+        int: Seed of the session for a target, independent of which process simulates it and when
+    """
+    return int(np.random.SeedSequence([seed, target]).generate_state(1)[0])
@@ -0,0 +1,109 @@
+import os
+import random
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import Optional
+
+import metrics
+
+
+class StartItemsPool:
+    """Keeps start items of new sessions ready, computed by a background thread.
+
+    The start items of an approximator are determined by its seed (see LexicalItemApproximator.start_items),
+    the pool keeps seeds with their start items. A new session takes a set and starts with its seed,
+    so the set is the one the session would have computed itself and is reproducible from the seed
+    recorded with the session's results.
+    The thread refills the pool at up to refill_rate sets per second and waits while it is full. It is started
+    by the first take in a process, so a pool filled before forking workers does not hand out the same sets
+    in every worker.
+    """
+
+    def __init__(self, generate, size: int = 32, refill_rate: float = 20):
+        """
+        Args:
+            generate (Callable[[int], list[int]]): Computes the start items of a seed as vocabulary indices
+            size (int, optional): Maximum number of sets kept. Defaults to 32.
+            refill_rate (float, optional): Maximum number of sets computed per second, limiting the time the
+                thread takes from serving requests. Defaults to 20.
+        """
+        self.generate = generate
+        self.size = size
+        self.refill_rate = refill_rate
+        # (seed, start items), taken from the left and refilled at the right
+        self._sets: "deque[tuple[int, list[int]]]" = deque()
+        self._taken = Event()
+        self._closed = False
+        self._lock = Lock()
+        self._pid = None
+        self._n_hits = 0
+        self._n_misses = 0
+        self._n_generated = 0
+
+    def take(self) -> "Optional[tuple[int, list[int]]]":
+        """
+        Returns:
+            tuple[int, list[int]] | None: A seed and its start items, or None if the pool is empty
+        """
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            prepared = self._sets.popleft()
+        except IndexError:
+            prepared = None
+        self._taken.set()
+        hit = prepared is not None
+        metrics.CACHE_REQUESTS.inc(cache='start_items', result='hit' if hit else 'miss')
+        with self._lock:
+            if hit:
+                self._n_hits += 1
+            else:
+                self._n_misses += 1
+        return prepared
+
+    def close(self):
+        """Stops the thread, e.g. when the model version is no longer used."""
+        self._closed = True
+        self._taken.set()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Sets inherited from the parent process are handed out there
+            self._sets.clear()
+            self._pid = os.getpid()
+            Thread(target=self._refill, name='start-items-pool', daemon=True).start()
+
+    def _refill(self):
+        pid = os.getpid()
+        while not self._closed and self._pid == pid:
+            if len(self._sets) >= self.size:
+                self._taken.wait()
+                self._taken.clear()
+                continue
+            start = time.monotonic()
+            seed = random.getrandbits(32)
+            self._sets.append((seed, self.generate(seed)))
+            with self._lock:
+                self._n_generated += 1
+            time.sleep(max(0, 1 / self.refill_rate - (time.monotonic() - start)))
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Size and refill rate of the pool, the number of sets ready, taken (hits), computed by sessions
+                because the pool was empty (misses) and computed by the pool, and the hit rate
+        """
+        with self._lock:
+            n_taken = self._n_hits + self._n_misses
+            return {
+                'size': self.size,
+                'refillRate': self.refill_rate,
+                'ready': len(self._sets),
+                'hits': self._n_hits,
+                'misses': self._n_misses,
+                'generated': self._n_generated,
+                'hitRate': self._n_hits / n_taken if n_taken else None,
+            }
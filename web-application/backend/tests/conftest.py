@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+from gensim.models.keyedvectors import KeyedVectors
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The api package registers the models of MODELS_PATH when it is imported. The tests provide their own models,
+# which are neither watched for changes nor kept start items ready for.
+os.environ.setdefault('MODELS_PATH', tempfile.mkdtemp(prefix='models-'))
+os.environ.setdefault('MODELS_WATCH_INTERVAL', '0')
+os.environ.setdefault('START_ITEMS_POOL_SIZE', '0')
+
+from lexical_model import LexicalModel  # noqa: E402
+
+
+def random_vectors(n_items: int, dims: int = 16, seed: int = 0, prefix: str = 'item') -> KeyedVectors:
+    """Vectors of random items named <prefix>0000, <prefix>0001, ..."""
+    rng = np.random.default_rng(seed)
+    vectors = KeyedVectors(vector_size=dims)
+    vectors.add_vectors([f'{prefix}{i:04d}' for i in range(n_items)],
+                        rng.standard_normal((n_items, dims), dtype=np.float32))
+    return vectors
+
+
+def ranking(unit_vectors: np.ndarray, index: int, excluded: np.ndarray) -> np.ndarray:
+    """The full ranking of the items by similarity to an item, without the item and the excluded items."""
+    similarities = np.dot(unit_vectors, unit_vectors[index])
+    order = np.argsort(-similarities, kind='stable')
+    return order[~excluded[order] & (order != index)]
+
+
+@pytest.fixture
+def model() -> LexicalModel:
+    return LexicalModel(random_vectors(500))
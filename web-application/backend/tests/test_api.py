@@ -0,0 +1,101 @@
+import os
+from io import BytesIO
+
+import PIL.Image as Image
+import pytest
+
+from conftest import random_vectors
+from lexical_model import LexicalModel
+
+
+@pytest.fixture(scope='module')
+def app():
+    # Both models of the app are loaded from the binary model directories in MODELS_PATH
+    model = LexicalModel(random_vectors(500))
+    for directory in ['bert-vectors-simpsons', 'bluebert-vectors-symptoms']:
+        path = os.path.join(os.environ['MODELS_PATH'], directory)
+        if not os.path.isdir(path):
+            model.save(path)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('SESSION_TYPE', 'token')
+        monkeypatch.setenv('SECRET_KEY', 'test')
+        monkeypatch.setenv('RESULTS_PATH', os.path.join(os.environ['MODELS_PATH'], 'results'))
+        monkeypatch.setenv('PLOT_PROCESSES', '0')
+        from api import create_app
+        yield create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def start_session(client) -> "list[str]":
+    assert client.get('/models?id=0').status_code == 200
+    response = client.get('/suggestions')
+    assert response.status_code == 200
+    return response.get_json()['items']
+
+
+def test_session(client):
+    items = start_session(client)
+    assert len(items) == 12
+    response = client.get(f'/suggestions?item={items[0]}')
+    assert response.status_code == 200
+    suggestions = response.get_json()['items']
+    assert len(suggestions) == 12 and not set(suggestions) & set(items)
+
+
+def test_unknown_model_is_not_found(client):
+    assert client.get('/models?id=7').status_code == 404
+    assert client.get('/suggestions').status_code == 400
+
+
+def test_suggestions_need_a_model(client):
+    assert client.get('/suggestions').status_code == 400
+
+
+def test_plot_size_and_resolution_are_rounded(client):
+    start_session(client)
+    response = client.get('/plot?size=3.4&dpi=60')
+    assert response.status_code == 200
+    assert Image.open(BytesIO(response.data)).size == (150, 150)
+
+
+def test_plot_data(client):
+    items = start_session(client)
+    data = client.get('/plot-data').get_json()
+    assert [point['item'] for point in data['items']] == items and data['target'] is None
+
+    suggestions = client.get(f'/suggestions?item={items[0]}').get_json()['items']
+    data = client.get('/plot-data').get_json()
+    assert [point['item'] for point in data['items']] == suggestions
+    assert data['target']['item'] == items[0]
+    coordinates = client.get('/coordinates').get_json()
+    assert len(coordinates['x']) == len(coordinates['y']) == 500
+    # The points are the items' coordinates, rounded for the coordinates of all items
+    point = data['items'][0]
+    index = int(point['item'][len('item'):])
+    assert abs(coordinates['x'][index] - point['x']) < 1e-4 and abs(coordinates['y'][index] - point['y']) < 1e-4
+
+
+def test_result_plot_data(client):
+    items = start_session(client)
+    client.get(f'/suggestions?item={items[0]}')
+    target = items[1]
+    data = client.get(f'/result-plot-data?item={target}').get_json()
+    assert data['target'] == target
+    assert len(data['selection']) == len(data['suggestionsAverage']) == len(data['closest']) == 1
+    assert len(data['mostSimilarOfSuggested']) == 1
+    # The target itself was suggested in the first iteration
+    assert data['mostSimilarOfSuggested'] == [target] and abs(data['closest'][0] - 1) < 1e-6
+
+
+def test_metrics(client):
+    start_session(client)
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE backend_request_seconds histogram' in text
+    assert 'backend_request_seconds_count{endpoint="/suggestions",method="GET",status="200"}' in text
+    assert 'backend_session_bytes_count{type="token"}' in text
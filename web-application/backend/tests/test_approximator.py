@@ -0,0 +1,65 @@
+import numpy as np
+
+from LexicalItemApproximator import LexicalItemApproximator
+
+
+def approximate(approximator: LexicalItemApproximator, n_iterations: int):
+    """Selects the first suggested item n_iterations times."""
+    suggestions = approximator.start_items
+    for _ in range(n_iterations):
+        approximator.select_item(suggestions[0])
+        suggestions = approximator.suggest_items()
+    return suggestions
+
+
+def assert_same_approximation(restored: LexicalItemApproximator, approximator: LexicalItemApproximator):
+    assert restored.state == approximator.state
+    assert restored.seed == approximator.seed
+    assert restored.start_items == approximator.start_items
+    assert restored.selected_item == approximator.selected_item
+    assert restored.selection_sequence == approximator.selection_sequence
+    assert restored.suggestions_sequence == approximator.suggestions_sequence
+    np.testing.assert_array_equal(restored._suggestion_counts, approximator._suggestion_counts)
+
+
+def test_state_round_trip(model):
+    approximator = LexicalItemApproximator(model, seed=1)
+    approximate(approximator, 3)
+    restored = LexicalItemApproximator.from_state(model, approximator.state)
+    assert_same_approximation(restored, approximator)
+
+    # Both continue with the same suggestions
+    item = approximator.suggestions_sequence[-1][1]
+    for a in (approximator, restored):
+        a.select_item(item)
+    assert restored.suggest_items() == approximator.suggest_items()
+
+
+def test_state_round_trip_after_undo(model):
+    approximator = LexicalItemApproximator(model, seed=2)
+    approximate(approximator, 3)
+    approximator.undo()
+    restored = LexicalItemApproximator.from_state(model, approximator.state)
+    assert_same_approximation(restored, approximator)
+    assert restored.iterations == 2
+
+    restored.undo()
+    restored.undo()
+    assert restored.selected_item == ""
+    assert restored.suggestions_sequence == [restored.start_items]
+    assert np.count_nonzero(restored._suggestion_counts) == LexicalItemApproximator.N_SUGGESTED_ITEMS
+
+
+def test_excluded_items_change(model):
+    approximator = LexicalItemApproximator(model, seed=3)
+    assert approximator.start_items == approximator.excluded_added
+    approximate(approximator, 1)
+    suggestions = approximator.suggestions_sequence[-1]
+    added = approximator.excluded_added
+    assert added == [item for item in suggestions if item not in approximator.start_items]
+
+    approximator.undo()
+    assert approximator.excluded_removed == added
+    assert approximator.excluded_added == []
+    excluded = {model.vectors.index_to_key[i] for i in np.flatnonzero(approximator._suggestion_counts)}
+    assert excluded == set(approximator.start_items)
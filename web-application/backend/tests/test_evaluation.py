@@ -0,0 +1,27 @@
+import numpy as np
+
+from evaluation import evaluate_history
+
+
+def test_evaluate_history(model):
+    unit_vectors = model.unit_vectors
+    target = 5
+    selection = [10, 20]
+    suggestions = [[1, 2, 3], [4, 5, 6]]
+    evaluation = evaluate_history(unit_vectors, target, selection, suggestions)
+
+    def similarity(i):
+        return float(np.dot(unit_vectors[i], unit_vectors[target]))
+
+    np.testing.assert_allclose(evaluation['y_vals_selection'], [similarity(10), similarity(20)], rtol=1e-6)
+    np.testing.assert_allclose(evaluation['y_vals_suggestions_avg'],
+                               [np.mean([similarity(i) for i in row]) for row in suggestions], rtol=1e-5)
+    closest = [max(row, key=similarity) for row in suggestions]
+    assert evaluation['most_similar_of_suggested'].tolist() == closest
+    assert closest[1] == target
+    np.testing.assert_allclose(evaluation['y_vals_closest'], [similarity(i) for i in closest], rtol=1e-6)
+
+
+def test_evaluate_empty_history(model):
+    evaluation = evaluate_history(model.unit_vectors, 5, [], [])
+    assert all(len(values) == 0 for values in evaluation.values())
@@ -0,0 +1,44 @@
+import numpy as np
+
+from conftest import ranking
+from ivf_index import IVFIndex
+
+
+def test_top_window_probing_all_lists_is_exact(model):
+    # With at least as many lists probed as there are, the most similar items are ranked exactly
+    ivf_index = IVFIndex.build(model.unit_vectors, n_lists=4)
+    np.testing.assert_array_equal(np.sort(ivf_index.items), np.arange(len(model)))
+    rng = np.random.default_rng(0)
+    excluded = rng.random(len(model)) < .1
+    for index in rng.integers(len(model), size=5):
+        expected = ranking(model.unit_vectors, index, excluded)
+        np.testing.assert_array_equal(ivf_index.window(index, excluded, 0, 10), expected[:10])
+
+
+def test_middle_window_has_items_of_about_its_ranks(model):
+    ivf_index = IVFIndex.build(model.unit_vectors, n_lists=8)
+    ivf_index.n_probe = 2
+    excluded = np.zeros(len(model), dtype=bool)
+    expected = ranking(model.unit_vectors, 3, excluded)
+    items = ivf_index.window(3, excluded, 200, 300)
+    assert len(items) == 100 and len(np.unique(items)) == 100
+    ranks = np.argsort(expected)[items]
+    # The window is answered roughly, with items around its ranks
+    assert 150 < np.median(ranks) < 350
+
+
+def test_extend_indexes_appended_items(model):
+    ivf_index = IVFIndex.build(model.unit_vectors[:400], n_lists=8)
+    extended = ivf_index.extend(model.unit_vectors)
+    assert len(extended) == len(model)
+    np.testing.assert_array_equal(np.sort(extended.items), np.arange(len(model)))
+    assert np.diff(extended.offsets).sum() == len(model)
+    assert np.all(extended.sample < len(model))
+
+
+def test_save_and_load(model, tmp_path):
+    ivf_index = IVFIndex.build(model.unit_vectors, n_lists=8)
+    ivf_index.save(tmp_path)
+    loaded = IVFIndex.load(tmp_path, model.unit_vectors)
+    for name in ['centroids', 'offsets', 'items', 'sample']:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(ivf_index, name))
@@ -0,0 +1,41 @@
+import metrics
+
+
+def test_render_prometheus_text_format():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter('test_total', 'Counted.', ('result',)))
+    gauge = registry.register(metrics.Gauge('test_seconds', 'Set.'))
+    histogram = registry.register(metrics.Histogram('test_latency_seconds', 'Observed.', ('stage',), (.1, 1)))
+    counter.inc(result='hit')
+    counter.inc(2, result='hit')
+    counter.inc(result='say "miss"')
+    gauge.set(1.5)
+    for value in (.05, .5, 5):
+        histogram.observe(value, stage='ranking')
+
+    assert registry.render().splitlines() == [
+        '# HELP test_total Counted.',
+        '# TYPE test_total counter',
+        'test_total{result="hit"} 3',
+        'test_total{result="say \\"miss\\""} 1',
+        '# HELP test_seconds Set.',
+        '# TYPE test_seconds gauge',
+        'test_seconds 1.5',
+        '# HELP test_latency_seconds Observed.',
+        '# TYPE test_latency_seconds histogram',
+        'test_latency_seconds_bucket{stage="ranking",le="0.1"} 1',
+        'test_latency_seconds_bucket{stage="ranking",le="1"} 2',
+        'test_latency_seconds_bucket{stage="ranking",le="+Inf"} 3',
+        'test_latency_seconds_sum{stage="ranking"} 5.55',
+        'test_latency_seconds_count{stage="ranking"} 3',
+    ]
+
+
+def test_stage_times_with_block_and_function():
+    @metrics.stage('test_stage')
+    def function():
+        return 1
+
+    with metrics.stage('test_stage'):
+        assert function() == 1
+    assert 'backend_stage_seconds_count{stage="test_stage"} 2' in metrics.REGISTRY.render()
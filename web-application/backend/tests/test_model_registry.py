@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from api.model_registry import ModelRegistry, ModelVersionUnavailable
+from conftest import random_vectors
+from lexical_model import LexicalModel
+
+
+def save_model(models_path, n_items: int, prefix: str = 'item'):
+    # The first items are the same for models with the same prefix, others are appended
+    LexicalModel(random_vectors(n_items, prefix=prefix)).save(models_path / 'model')
+    # A different modification time even on file systems with coarse timestamps
+    time.sleep(.01)
+
+
+def registry(models_path, retain: float) -> ModelRegistry:
+    registry = ModelRegistry(str(models_path), retain=retain)
+    registry.register({'id': 0, 'name': 'model', 'file': 'model.txt'})
+    return registry
+
+
+def test_pins_session_to_its_version(tmp_path):
+    save_model(tmp_path, 200)
+    models = registry(tmp_path, retain=600)
+    old = models[0]
+
+    save_model(tmp_path, 300, prefix='other')
+    models.refresh()
+    new = models[0]
+    assert new.version != old.version and len(new) == 300
+    # Sessions started with the old version keep it, new sessions get the new one
+    assert models.get(0, old.version) is old
+    assert models.get(0, new.version) is new
+    assert models.get(0) is new
+
+
+def test_accepts_append_only_vocabulary(tmp_path):
+    save_model(tmp_path, 200)
+    models = registry(tmp_path, retain=0)
+    old = models[0]
+    old_version = old.version
+
+    save_model(tmp_path, 250)
+    models.refresh()
+    # The old version is dropped, its sessions continue with the new version, which has the same first items
+    new = models.get(0, old_version)
+    assert new is models[0] and new is not old
+    assert new.vectors.index_to_key[:200] == old.vectors.index_to_key
+
+
+def test_rejects_changed_vocabulary_of_dropped_version(tmp_path):
+    save_model(tmp_path, 200)
+    models = registry(tmp_path, retain=0)
+    old_version = models[0].version
+
+    save_model(tmp_path, 250, prefix='other')
+    models.refresh()
+    with pytest.raises(ModelVersionUnavailable):
+        models.get(0, old_version)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from conftest import ranking
+from LexicalItemApproximator import LexicalItemApproximator
+from neighbor_index import NeighborIndex
+
+WINDOWS = [(0, 10), (0, 1), (200, 300), (330, 335), (480, 600), (-20, -5)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_complete_index_matches_full_sort(model, seed):
+    rng = np.random.default_rng(seed)
+    neighbor_index = NeighborIndex.build(model.unit_vectors)
+    assert neighbor_index.is_complete
+    index = int(rng.integers(len(model)))
+    excluded = rng.random(len(model)) < .1
+    expected = ranking(model.unit_vectors, index, excluded)
+
+    for start, stop in WINDOWS:
+        np.testing.assert_array_equal(neighbor_index.window(index, excluded, start, stop), expected[start:stop])
+
+
+def test_truncated_index(model):
+    rng = np.random.default_rng(0)
+    neighbor_index = NeighborIndex.build(model.unit_vectors, size=50, bucket_ranges=[(200, 300)])
+    index = 7
+    excluded = rng.random(len(model)) < .1
+    expected = ranking(model.unit_vectors, index, excluded)
+
+    # Stored neighbors answer exactly, excluded ones are left out
+    np.testing.assert_array_equal(neighbor_index.window(index, excluded, 0, 10), expected[:10])
+    # A bucket answers with a sample of the items at about its ranks
+    samples = neighbor_index.window(index, excluded, 220, 320)
+    assert len(samples) > 0 and not excluded[samples].any()
+    assert set(samples) <= set(ranking(model.unit_vectors, index, np.zeros(len(model), dtype=bool))[200:300])
+    # Ranks neither stored nor sampled
+    assert neighbor_index.window(index, excluded, 400, 410) is None
+
+
+def test_bucket_samples_are_distinct(model):
+    neighbor_index = NeighborIndex.build(model.unit_vectors, size=50, bucket_ranges=[(200, 300), (330, 335)],
+                                         chunk_size=64)
+    # No more samples than the narrowest bucket has items
+    assert neighbor_index.buckets.shape == (2, len(model), 5)
+    neighbor_index = NeighborIndex.build(model.unit_vectors, size=50, bucket_ranges=[(200, 300)], chunk_size=64)
+    assert neighbor_index.buckets.shape == (1, len(model), 64)
+    for bucket in neighbor_index.buckets:
+        for samples in bucket:
+            assert len(np.unique(samples)) == len(samples)
+
+
+def test_truncated_index_suggests_distinct_items(model):
+    model.build_neighbor_index(20, LexicalItemApproximator.rank_windows(len(model)))
+    for seed in range(20):
+        approximator = LexicalItemApproximator(model, seed=seed)
+        suggestions = approximator.start_items
+        for _ in range(5):
+            approximator.select_item(suggestions[0])
+            suggestions = approximator.suggest_items()
+            assert len(set(suggestions)) == len(suggestions)
+
+
+def test_save_and_load(model, tmp_path):
+    neighbor_index = NeighborIndex.build(model.unit_vectors, size=50, bucket_ranges=[(200, 300)])
+    neighbor_index.save(tmp_path)
+    loaded = NeighborIndex.load(tmp_path)
+    np.testing.assert_array_equal(loaded.neighbors, neighbor_index.neighbors)
+    np.testing.assert_array_equal(loaded.buckets, neighbor_index.buckets)
+    np.testing.assert_array_equal(loaded.bucket_ranges, neighbor_index.bucket_ranges)
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+from plot_pool import PlotPool, PlotQueueFull
+
+renders = []
+
+
+def _render(seconds: float, result: bytes = b'png') -> bytes:
+    renders.append(result)
+    time.sleep(seconds)
+    return result
+
+
+def _pid() -> int:
+    return os.getpid()
+
+
+def _exit():
+    os._exit(1)
+
+
+def test_identical_plots_are_rendered_once():
+    renders.clear()
+    pool = PlotPool(0, max_queued=4)
+    with ThreadPoolExecutor(3) as executor:
+        results = list(executor.map(lambda _: pool._render(_render, .2), range(3)))
+    assert results == [b'png'] * 3 and len(renders) == 1
+    # Once rendered, it is rendered again
+    pool._render(_render, 0)
+    assert len(renders) == 2
+
+
+def test_queued_plots_are_limited():
+    pool = PlotPool(0, max_queued=1)
+    rendering = threading.Thread(target=pool._render, args=(_render, .3))
+    rendering.start()
+    time.sleep(.05)
+    with pytest.raises(PlotQueueFull):
+        pool._render(_render, 0, b'other')
+    rendering.join()
+    assert pool._render(_render, 0, b'other') == b'other'
+
+
+def test_requests_wait_at_most_timeout():
+    pool = PlotPool(0, timeout=.05)
+    with pytest.raises(TimeoutError):
+        pool._render(_render, .3)
+    # The plot is still rendered for identical requests
+    pool.timeout = 1
+    assert pool._render(_render, .3) == b'png'
+
+
+def test_without_processes_plots_are_rendered_in_this_process(tmp_path):
+    pool = PlotPool(0)
+    assert pool._render(_pid) == os.getpid()
+    coordinates_path = str(tmp_path / 'coordinates.npy')
+    np.save(coordinates_path, np.random.default_rng(0).standard_normal((50, 2)).astype(np.float32))
+    assert pool.render_plot(coordinates_path, [1, 2], 3, ['a', 'b', 'c'], size=2, dpi=50).startswith(b'\x89PNG')
+
+
+def test_dead_renderer_is_replaced():
+    pool = PlotPool(1, timeout=60)
+    with pytest.raises(BrokenProcessPool):
+        pool._render(_exit)
+    pid = pool._render(_pid)
+    assert pid != os.getpid()
@@ -0,0 +1,28 @@
+from io import BytesIO
+
+import numpy as np
+import PIL.Image as Image
+
+from plot_renderer import PlotRenderer
+
+
+def test_render_highlights_items():
+    coordinates = np.random.default_rng(0).standard_normal((100, 2)).astype(np.float32)
+    renderer = PlotRenderer(coordinates, [f'item{i}' for i in range(100)])
+    image = Image.open(BytesIO(renderer.render([1, 2, 3], target=4, size=2, dpi=50)))
+    assert image.size == (100, 100)
+    # The highlights change the background
+    background = renderer._backgrounds[(2, 50)][0][..., :3]
+    assert not np.array_equal(np.asarray(image), background)
+
+
+def test_backgrounds_are_bounded():
+    coordinates = np.random.default_rng(0).standard_normal((100, 2)).astype(np.float32)
+    renderer = PlotRenderer(coordinates, [f'item{i}' for i in range(100)])
+    for size in range(2, 2 + PlotRenderer.MAX_BACKGROUNDS):
+        renderer.render([1], size=size, dpi=20)
+    # The least recently used one is evicted
+    renderer.render([1], size=2, dpi=20)
+    renderer.render([1], size=10, dpi=20)
+    assert len(renderer._backgrounds) == PlotRenderer.MAX_BACKGROUNDS
+    assert (2, 20) in renderer._backgrounds and (3, 20) not in renderer._backgrounds
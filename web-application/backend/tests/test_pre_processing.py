@@ -0,0 +1,70 @@
+import hashlib
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+PRE_PROCESSING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'pre-processing.py')
+
+
+@pytest.fixture
+def pre_processing(monkeypatch):
+    """The pre-processing module, embedding items with a stand-in for BERT that records the items it embeds."""
+    spec = importlib.util.spec_from_file_location('pre_processing', PRE_PROCESSING_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.embedded = []
+
+    def embed(items, args):
+        for batch_start in range(0, len(items), args.batch_size):
+            batch = items[batch_start:batch_start + args.batch_size]
+            module.embedded.extend(batch)
+            yield np.array([[int.from_bytes(hashlib.sha256(module.normalize(item).encode()).digest()[:2], 'big'), 1]
+                            for item in batch], dtype=np.float32)
+
+    monkeypatch.setattr(module, 'embed', embed)
+    return module
+
+
+def write_items(path, items: "list[str]"):
+    path.write_text('name\n' + ''.join(f'{item}\n' for item in items))
+
+
+def read_output(path) -> "list[str]":
+    return path.read_text().splitlines()
+
+
+def test_embeds_only_items_missing_from_cache(pre_processing, tmp_path):
+    items = tmp_path / 'items.csv'
+    output = tmp_path / 'embeddings.txt'
+    write_items(items, ['fever', 'cough', 'sore  throat'])
+    pre_processing.main([str(items), str(output), '--batch-size', '2'])
+    assert pre_processing.embedded == ['fever', 'cough', 'sore  throat']
+    lines = read_output(output)
+    assert lines[0] == '3 2' and [line.split()[0] for line in lines[1:]] == ['fever', 'cough', 'sore__throat']
+
+    # Cache hits, also for items whose normalized text is the same
+    pre_processing.embedded.clear()
+    write_items(items, ['fever', 'headache', 'sore throat', 'cough'])
+    pre_processing.main([str(items), str(output), '--batch-size', '2'])
+    assert pre_processing.embedded == ['headache']
+    assert len(read_output(output)) == 5
+    assert (tmp_path / 'embedding-cache.sqlite').exists()
+
+    # Other embedding settings miss the cache
+    pre_processing.embedded.clear()
+    pre_processing.main([str(items), str(output), '--layer', '-3'])
+    assert len(pre_processing.embedded) == 4
+
+
+def test_without_cache_writes_batches_to_output(pre_processing, tmp_path):
+    items = tmp_path / 'items.csv'
+    write_items(items, ['fever', 'cough', 'headache'])
+    pre_processing.main([str(items), str(tmp_path / 'cached.txt')])
+    pre_processing.embedded.clear()
+    pre_processing.main([str(items), str(tmp_path / 'uncached.txt'), '--no-cache', '--batch-size', '2',
+                         '--cache', str(tmp_path / 'unused.sqlite')])
+    assert pre_processing.embedded == ['fever', 'cough', 'headache']
+    assert not (tmp_path / 'unused.sqlite').exists()
+    assert read_output(tmp_path / 'uncached.txt') == read_output(tmp_path / 'cached.txt')
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from LexicalItemApproximator import LexicalItemApproximator
+from lexical_model import LexicalModel
+from quantized_vectors import QuantizedVectors
+
+
+@pytest.mark.parametrize('dtype', QuantizedVectors.DTYPES)
+def test_similarities_are_close(model, dtype):
+    unit_vectors = model.unit_vectors
+    quantized_vectors = QuantizedVectors.quantize(unit_vectors, dtype, chunk_size=64)
+    queries = unit_vectors[[3, 99]]
+    np.testing.assert_allclose(quantized_vectors.similarities(queries), np.dot(queries, unit_vectors.T), atol=.02)
+    np.testing.assert_allclose(quantized_vectors.similarities(queries[0]), np.dot(unit_vectors, queries[0]), atol=.02)
+
+
+def test_extend(model):
+    unit_vectors = model.unit_vectors
+    quantized_vectors = QuantizedVectors.quantize(unit_vectors[:400], 'int8')
+    extended = quantized_vectors.extend(unit_vectors[400:])
+    assert len(extended) == len(model)
+    np.testing.assert_array_equal(extended.scales, quantized_vectors.scales)
+    np.testing.assert_array_equal(extended.vectors[:400], quantized_vectors.vectors)
+
+
+def test_save_and_load(model, tmp_path):
+    quantized_vectors = QuantizedVectors.quantize(model.unit_vectors, 'int8')
+    quantized_vectors.save(tmp_path)
+    loaded = QuantizedVectors.load(tmp_path)
+    np.testing.assert_array_equal(loaded.vectors, quantized_vectors.vectors)
+    np.testing.assert_array_equal(loaded.scales, quantized_vectors.scales)
+
+
+@pytest.mark.parametrize('dtype', QuantizedVectors.SUGGESTION_DTYPES)
+def test_suggestions_are_those_of_float32(model, dtype):
+    unit_vectors = np.asarray(model.unit_vectors)
+    quantized_model = LexicalModel(model.vectors, unit_vectors=unit_vectors,
+                                   quantized_vectors=QuantizedVectors.quantize(unit_vectors, dtype))
+    for seed in range(5):
+        approximators = [LexicalItemApproximator(m, seed=seed) for m in (model, quantized_model)]
+        assert approximators[0].start_items == approximators[1].start_items
+        for _ in range(3):
+            for approximator in approximators:
+                approximator.select_item(approximator.suggestions_sequence[-1][0])
+            assert approximators[0].suggest_items() == approximators[1].suggest_items()
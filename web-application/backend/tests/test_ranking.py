@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from conftest import ranking
+from ranking import items_at_ranks
+
+WINDOWS = [(0, 10), (0, 1), (200, 300), (330, 335), (480, 600), (-20, -5), (50, 50)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_items_at_ranks_matches_full_sort(model, seed):
+    rng = np.random.default_rng(seed)
+    unit_vectors = model.unit_vectors
+    index = int(rng.integers(len(model)))
+    excluded = rng.random(len(model)) < .1
+    expected = ranking(unit_vectors, index, excluded)
+
+    masked = excluded.copy()
+    masked[index] = True
+    windows = items_at_ranks(np.dot(unit_vectors, unit_vectors[index]), masked, WINDOWS)
+
+    for (start, stop), items in zip(WINDOWS, windows):
+        np.testing.assert_array_equal(items, expected[start:stop])
+
+
+def test_items_at_ranks_without_items():
+    assert [len(items) for items in items_at_ranks(np.zeros(3), np.ones(3, dtype=bool), [(0, 2)])] == [0]
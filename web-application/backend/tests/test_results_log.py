@@ -0,0 +1,28 @@
+import numpy as np
+
+from results_log import ResultsWriter, load_results
+
+
+def result(id: str, timestamp: str, selection: "list[str]", y_selection: "list[float]") -> dict:
+    return {'id': id, 'timestamp': timestamp, 'target': selection[-1] if selection else None,
+            'iterations': len(selection), 'selection': selection, 'ySelection': y_selection}
+
+
+def test_load_results_reads_written_results(tmp_path):
+    writer = ResultsWriter(str(tmp_path), flush_interval=.1)
+    # The first result has empty lists, the types of the fields are taken from later results
+    writer.write(result('a', '2021-01-01T10:00:00', [], []))
+    writer.write(result('b', '2021-01-01T10:00:01', ['x', 'y'], [.5, .75]), plot=b'png')
+    writer.close()
+
+    results = load_results(str(tmp_path))
+    assert [r['id'] for r in results['results']] == ['a', 'b']
+    assert results['results'][1]['plot'] == 'plots/b.png'
+    assert (tmp_path / 'plots' / 'b.png').read_bytes() == b'png'
+    np.testing.assert_array_equal(results['iterations'], [0, 2])
+    np.testing.assert_array_equal(results['ySelection'], [[np.nan, np.nan], [.5, .75]])
+    assert 'selection' not in results and 'target' not in results
+
+
+def test_load_results_of_empty_directory(tmp_path):
+    assert load_results(str(tmp_path)) == {'results': []}
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from similarity_batcher import SimilarityBatcher
+
+
+def query_concurrently(batcher: SimilarityBatcher, indices: "list[int]") -> list:
+    with ThreadPoolExecutor(len(indices)) as executor:
+        return list(executor.map(batcher.similarities, indices))
+
+
+def test_concurrent_queries_are_computed_together(model):
+    batches = []
+
+    def compute(indices):
+        batches.append(list(indices))
+        return model.batch_similarities(indices)
+
+    # Long enough for all queries to join the first batch, which is computed as soon as it is full
+    batcher = SimilarityBatcher(compute, window=10, max_size=4)
+    results = query_concurrently(batcher, [1, 2, 3, 4])
+    assert len(batches) == 1 and sorted(batches[0]) == [1, 2, 3, 4]
+    for index, similarities in zip([1, 2, 3, 4], results):
+        np.testing.assert_allclose(similarities, model.batch_similarities([index])[0], atol=1e-6)
+        assert not similarities.flags.writeable
+    stats = batcher.stats()
+    assert stats['queries'] == 4 and stats['batches'] == 1 and stats['averageSize'] == 4
+
+
+def test_batches_are_limited_to_max_size(model):
+    sizes = []
+
+    def compute(indices):
+        sizes.append(len(indices))
+        return model.batch_similarities(indices)
+
+    batcher = SimilarityBatcher(compute, window=.05, max_size=2)
+    query_concurrently(batcher, [1, 2, 3, 4, 5])
+    assert sum(sizes) == 5 and max(sizes) <= 2
+
+
+def test_errors_are_raised_in_every_query(model):
+    def compute(indices):
+        raise MemoryError('no memory for the similarities')
+
+    batcher = SimilarityBatcher(compute, window=10, max_size=3)
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(batcher.similarities, index) for index in [1, 2, 3]]
+    for future in futures:
+        with pytest.raises(MemoryError):
+            future.result()
+    # The batcher keeps working
+    batcher.compute = model.batch_similarities
+    batcher.max_size = 1
+    assert len(batcher.similarities(1)) == len(model)
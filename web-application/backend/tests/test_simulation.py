@@ -0,0 +1,21 @@
+from simulation import session_seed, simulate_session
+
+
+def test_simulated_session_finds_target(model):
+    target = 42
+    result = simulate_session(model, target, seed=1, max_iterations=500)
+    assert result['found']
+    assert len(result['y_vals_selection']) == result['iterations']
+    # The last selection is the target
+    assert abs(result['y_vals_selection'][-1] - 1) < 1e-6
+
+
+def test_simulated_session_is_reproducible(model):
+    seed = session_seed(0, 42)
+    assert seed == session_seed(0, 42) and seed != session_seed(0, 43)
+    assert simulate_session(model, 42, seed, noise=.3) == simulate_session(model, 42, seed, noise=.3)
+
+
+def test_simulated_user_gives_up(model):
+    result = simulate_session(model, 42, seed=1, noise=1, max_iterations=2)
+    assert result['iterations'] <= 2
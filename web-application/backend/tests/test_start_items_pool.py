@@ -0,0 +1,67 @@
+import time
+from functools import partial
+
+from api.model_registry import _start_items
+from LexicalItemApproximator import LexicalItemApproximator
+from start_items_pool import StartItemsPool
+
+
+def generate(seed: int) -> "list[int]":
+    return [seed % 7]
+
+
+def wait_until(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(.01)
+    return condition()
+
+
+def test_refills_up_to_size():
+    pool = StartItemsPool(generate, size=4, refill_rate=1000)
+    # The first take starts the thread
+    pool.take()
+    assert wait_until(lambda: pool.stats()['ready'] == 4)
+    time.sleep(.05)
+    generated = pool.stats()['generated']
+    assert pool.stats()['ready'] == 4 and generated <= 5
+
+    seed, start_items = pool.take()
+    assert start_items == generate(seed)
+    # The taken set is replaced
+    assert wait_until(lambda: pool.stats()['generated'] == generated + 1 and pool.stats()['ready'] == 4)
+    stats = pool.stats()
+    assert stats['hits'] + stats['misses'] == 2 and stats['hits'] >= 1
+    pool.close()
+
+
+def test_refill_rate_is_limited():
+    pool = StartItemsPool(generate, size=100, refill_rate=20)
+    pool.take()
+    time.sleep(.5)
+    assert 1 <= pool.stats()['generated'] <= 12
+    pool.close()
+
+
+def test_close_stops_refilling():
+    pool = StartItemsPool(generate, size=2, refill_rate=1000)
+    pool.take()
+    assert wait_until(lambda: pool.stats()['ready'] == 2)
+    pool.close()
+    generated = pool.stats()['generated']
+    assert pool.take() is not None and pool.take() is not None
+    time.sleep(.1)
+    assert pool.stats()['generated'] == generated and pool.stats()['ready'] == 0
+
+
+def test_sessions_start_with_the_items_of_their_seed(model):
+    model.start_items_pool = StartItemsPool(partial(_start_items, model), size=4, refill_rate=1000)
+    model.start_items_pool.take()
+    assert wait_until(lambda: model.start_items_pool.stats()['ready'] == 4)
+    hits = model.start_items_pool.stats()['hits']
+    approximator = LexicalItemApproximator(model)
+    # Taken from the pool, the same as computed with the seed
+    assert model.start_items_pool.stats()['hits'] == hits + 1
+    assert approximator.start_items == LexicalItemApproximator(model, seed=approximator.seed).start_items
+    assert approximator.excluded_added == approximator.start_items
+    model.start_items_pool.close()
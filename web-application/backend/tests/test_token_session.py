@@ -0,0 +1,36 @@
+import pytest
+from flask import Flask, jsonify, session
+
+from api.token_session import TokenSessionInterface
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    app.session_interface = TokenSessionInterface()
+
+    @app.route('/set')
+    def set_session():
+        session['model_id'] = 1
+        return 'OK'
+
+    @app.route('/get')
+    def get_session():
+        return jsonify(dict(session))
+
+    return app.test_client()
+
+
+def test_token_restores_session(client):
+    token = client.get('/set').headers[TokenSessionInterface.header_name]
+    response = client.get('/get', headers={TokenSessionInterface.header_name: token})
+    assert response.get_json() == {'model_id': 1}
+
+
+def test_tampered_token_is_rejected(client):
+    token = client.get('/set').headers[TokenSessionInterface.header_name]
+    # A different payload with the original signature
+    tampered = token[:5] + ('A' if token[5] != 'A' else 'B') + token[6:]
+    response = client.get('/get', headers={TokenSessionInterface.header_name: tampered})
+    assert response.get_json() == {}